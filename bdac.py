@@ -10,10 +10,44 @@
 
 # Usage:
 #   bdac                     Normal use, must have serial connection established.
+#                            "Add Controller" in the menu opens more ports,
+#                            <Tab> switches between them.
 #   bdac --help              Print this help.
 #   bdac --report            Retrieve controller settings and print report.
 #   bdac --report <filename> Retrieve settings from file and report.
 #   bdac --test              Run bdac with test data.
+#   bdac --validate <path>   Check a .bdac file or directory of them.
+#   bdac --write <filename>  Write settings from file to the controller.
+#   bdac --write --resume    Finish an interrupted write from bdac.journal.
+#   bdac --ride <log> <file> Speed and distance from a telemetry log.
+#   bdac --energy <log|dir> <file> Energy use and range per assist level.
+#   bdac --simulate <file|dir> [log]  Preview PAS current curves of configs.
+#   bdac --optimize <in> <out> <target> [amps]  Fit assist levels to a curve.
+#   bdac --watch <job>       Run a job (report or a .bdac file to write) on
+#                            every controller plugged in.
+#   bdac --batch <jobfile> [--resume]  Write .bdac files to many ports.
+#   bdac --wear              Flash writes per controller and area.
+#   bdac --ingest <store> <file|dir> ...  Add .bdac files to a fleet store.
+#   bdac --fleet <store> [query ...]      Query the fleet store.
+#   bdac --bundle <bundle> [file|dir ...]  Add .bdac files to a bundle, or
+#                            list it.  bundle.bdacb#name can be given
+#                            anywhere a .bdac file is.
+#   bdac --export <syncdir> [station]  Add new snapshots and log to a sync
+#                            directory.
+#   bdac --import <syncdir> [station]  Take other stations' ones from it.
+#   bdac --daemon [socket]   Run bdacd, hold the serial port and serve it to
+#                            other bdac processes over a UNIX socket.
+#   bdac --soak <cycles> [rate] [file]  Soak test against the stand-in.
+#   bdac --telemetry [file]  Log telemetry bdacd publishes in shared memory,
+#                            with anomaly events as comments.
+#   bdac --metrics <port> ...  Serve serial statistics on localhost:<port>
+#                              while running any of the above.
+#   bdac --trace <file> ...    Save a Chrome trace of any of the above.
+#   bdac --profile ...         Profile any of the above into bdac.prof.
+#   bdac --record <fixture> ...  Record the serial session to a fixture.
+#   bdac --replay <fixture> [--speed <x>] ...  Replay one instead of a port.
+#   bdac --standin ...         Run against a simulated controller.
+#   bdac --bike <id> ...       Save this bike id in the settings files.
 
 # This program is free software: you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -37,25 +71,79 @@
 #                     Show which controller areas are being read
 # v1.7 - 2022/08/09 - Added ability to run report from file on command line
 # v1.7.2            - Fix bug on time stamp file save.
+# v1.8 - 2026/10/19 - Added local validation of all settings before writing
+#                     Added --validate for a file or directory of .bdac files
+#                     Write frames are encoded once and cached by content
+#                     Writes are one transaction with verify and rollback
+#                     Added --ride telemetry analysis, fixed get_speed WD
+#                     Added --energy use and range estimates
+#                     Added --metrics Prometheus endpoint for serial stats
+#                     Added --trace Chrome trace event output
+#                     Added --profile for any mode
+#                     Added --daemon (bdacd), other runs share its port
+#                     Read deadlines calibrated from measured response times
+#                     Added --watch to provision controllers as plugged in
+#                     Added --batch with a journal that can be resumed
+#                     Added PAS simulator, --simulate and in the menu
+#                     Added --optimize for assist level tables
+#                     Added --record and --replay of serial sessions
+#                     Waits go through a clock, added --standin controller
+#                     Flash writes counted in bdac.wear, redundant ones skipped
+#                     Added --ingest and --fleet columnar config store
+#                     Added .bdacb config bundles, --bundle
+#                     Added --export and --import station sync
+#                     bdacd publishes telemetry to a shared memory ring,
+#                     added --telemetry to log it
+#                     Telemetry anomaly events, logged and in the menu
+#                     Added --soak stability harness with fault injection
+#                     GUI works on several controllers at once
+#                     Saved settings name the controller, added --bike
 
 import os
 import sys
 import json
+import math
 import time
 import curses
 import datetime
 sys.path.append('/usr/local/share/bdac')
 from bdac_gui import BdacTerm
-from time import sleep
+from bdac_validate import validate_area, validate_directory, print_validation
+from bdac_frames import check_reply, ReplyError
+from bdac_transaction import write_transaction, resume_transaction, area_values
+from bdac_metrics import metrics, start_metrics_server, command_name
+from bdac_trace import tracer, traced
+from bdac_profile import start_profile
+from bdac_daemon import Bdacd, SOCKET, connect_daemon
+from bdac_timing import timer, response_length
+from bdac_watch import Watcher
+from bdac_batch import run_batch
+from bdac_replay import RecordingSerial, ReplaySerial, ReplayError
+from bdac_clock import Clock, VirtualClock
+from bdac_standin import StandInSerial
+from bdac_wear import wear, snapshot_identity
+from bdac_bundle import Bundle, BundleError, load_config
+from bdac_ring import RingWriter, RingReader, RING
+from bdac_anomaly import Detector
+from bdac_soak import FaultSerial, soak, soak_summary
 from serial import Serial, SerialException
 from collections import OrderedDict
 from binascii import hexlify
 
-VERSION = 'V1.7.2 - Python 3'
-VERSION_DATE = 'Aug 9, 2022'
+VERSION = 'V1.8 - Python 3'
+VERSION_DATE = 'Oct 19, 2026'
 
 PORT = '/dev/ttyUSB0'
 
+# every wait and time stamp goes through clock, a VirtualClock makes a
+# session against the stand-in run without waiting
+clock = Clock()
+
+# saved with the settings in every .bdac file written, the last INFO
+# reply and the bike id given with --bike
+controller_info = None
+bike_id = None
+
 # Config commands
 INFO_CMD = b'\x11\x51\x04\xb0\x05'
 BASIC_CMD = b'\x11\x52'
@@ -92,16 +180,66 @@ dat_dict = {0x00:'MODE_0',0x01:'MODE_1',0x02:'MODE_1',0x03:'MODE_3',0x04:'MODE_4
 #-----------------------------------------------------------------------
 # write command to controller and read response
 #-----------------------------------------------------------------------
-def read_config(cm):
+# length is given for the status commands which have a fixed size reply,
+# those are read as soon as the bytes arrive instead of waiting.  Area
+# reads and writes have a known reply size too and wait at most the
+# deadline bdac_timing has measured for them.  port defaults to the one
+# opened at start up.  Area writes the controller is known to hold
+# already are not sent, see bdac_wear.
+def read_config(cm, length=None, port=None):
+    if port is None:
+        port = ser
+    # bdacd keeps the ledger for the port it holds
+    ledger = wear.enabled and not hasattr(port, 'transact')
+    reply, warning = None, None
+    if ledger and cm[0] == 0x16:
+        if wear.identity(port) is None:
+            read_config(INFO_CMD, port=port)
+        reply, warning = wear.check(port, cm)
     # using with open allows us to not worry about closing the file if we so choose
-    with open("bdac.log", mode='a') as f:
-        t = time.localtime()
-        stamp = time.strftime('%Y%m%d_%H%M%S', t)
+    with tracer.span('serial ' + command_name(cm), 'serial'), open("bdac.log", mode='a') as f:
+        stamp = clock.strftime('%Y%m%d_%H%M%S')
         f.write("{0} -> {1}\n".format(stamp, hexlify(cm,',',1)))
-        ser.write(cm)
-        ser.flush()
-        sleep(1)
-        resp = ser.read(100)
+        if warning:
+            f.write("{0} !! {1}\n".format(stamp, warning))
+        start = clock.monotonic()
+        if reply is not None:
+            resp = reply
+        elif hasattr(port, 'transact'):
+            # bdacd answers a whole command at once
+            resp = port.transact(cm, length)
+        elif length:
+            port.write(cm)
+            port.flush()
+            with tracer.span('serial read', 'serial'):
+                resp = port.read(length)
+        elif response_length(cm):
+            # read until the whole reply is in or the calibrated
+            # deadline for this command passes
+            expected = response_length(cm)
+            timeout = port.timeout
+            port.timeout = timer.deadline(cm, port)
+            try:
+                port.write(cm)
+                port.flush()
+                with tracer.span('serial read', 'serial'):
+                    resp = port.read(expected)
+                    if cm[0] == 0x16 and len(resp) == 2 and resp[1] != cm[2]:
+                        resp += port.read(1)     # error code
+            finally:
+                port.timeout = timeout
+            timer.observe(cm, resp, clock.monotonic() - start, expected, port)
+        else:
+            port.write(cm)
+            port.flush()
+            with tracer.span('sleep', 'sleep'):
+                clock.sleep(1)
+            with tracer.span('serial read', 'serial'):
+                resp = port.read(100)
+        if reply is None:
+            metrics.observe(cm, resp, clock.monotonic() - start)
+            if ledger:
+                wear.observe(port, cm, resp)
         f.write("{0} <- {1}\n".format(stamp, hexlify(resp,',',1)))
         f.close()
         return resp
@@ -119,12 +257,17 @@ def read_config(cm):
 # Byte[16]    - Voltage {0:24,1:36'2:48,3:60,4:24_48,5:24-60}
 # Byte[17]    - Maximum current in amps
 # Byte[18]    - Checksum - no one cares
+@traced('read INFO', 'area')
 def get_info_config():
+    global controller_info
     volts_list = [24,36,48,60]
     if test_data:
         resp = b'\x51\x10\x48\x5a\x58\x54\x53\x5a\x5a\x39\x31\x31\x32\x30\x31\x31\x02\x19\x22'
     else:
         resp = read_config(INFO_CMD)
+    if len(resp) < 19 or resp[0] != 0x51:
+        raise ReplyError('No INFO reply from the controller')
+    controller_info = resp
     # convert bytes 2-15 to ascii list
     l = [20,20] # make l the same index as resp
     for i in range(2, len(resp)-3): #start loop at 3rd byte
@@ -148,19 +291,21 @@ def get_info_config():
 # Byte[14-23] - ALBP0-ALBP9, Assit Level Speed Limit in %
 # Byte[24]    - WD,          Wheel Diameter * 2 - list
 # Byte[25]    - SMM,SMS      Speedometer Model and Speed signals, bit field see below
-# Byte[26]    - Checksum - no one cares
+# Byte[26]    - Checksum, sum of bytes 0-25, checked by check_reply
 
 # Speedmeter_Model last 2 bits of resp[25]
 #  EXTERNAL = 0b00,     
 #  INTERNAL = 0b01,
 #  MOTORPHASE = 0b10
 # Speed Signals per wheel revolution, lowest 6 bits of resp[25]
+@traced('read BASIC', 'area')
 def get_basic_config():
     if test_data:
-        resp = b'\x52\x18\x29\x0f\x00\x34\x3a\x40\x46\x4c\x52\x58\x5e\x64\x00\x24\x2c\x34\x3c\x44\x4c\x54\x5c\x64\x38\x01\xd5'
+        resp = b'\x52\x18\x29\x0f\x00\x34\x3a\x40\x46\x4c\x52\x58\x5e\x64\x00\x24\x2c\x34\x3c\x44\x4c\x54\x5c\x64\x38\x01\xeb'
     else:
         resp = read_config(BASIC_CMD)
-    
+    check_reply('basic', resp)
+
     basic_dict['LBP'] = [resp[2], 'Low battery protection, voltage where the motor will quit']
     basic_dict['LC'] = [resp[3], 'Current limit, Maximum current allowed to flow to motor']
 
@@ -188,7 +333,7 @@ def get_basic_config():
 
     basic_dict['WD'] = [resp[24], 'Wheel diameter in inches / 2 - ({0} inches)'.format(resp[24]/2)]
     basic_dict['SM'] = [1, 'Speed meter type, and signals, BBS kits type is 0 or EXTERNAL']
-    return basic_dict    
+    return basic_dict
 
 #-----------------------------------------------------------------------
 # Get PAS config (b'\x11\x53')
@@ -207,12 +352,14 @@ def get_basic_config():
 # Byte[10]    - CD,         Current Decay, (1..8)
 # Byte[11]    - TS,         Time of Stop, Time in 10's of milliseconds
 # Byte[12]    - KC,         Keep Current, in %
-# Byte[13]    - Checksum - no one cares
+# Byte[13]    - Checksum, sum of bytes 0-12, checked by check_reply
+@traced('read PAS', 'area')
 def get_pas_config():
     if test_data:
-        resp = b'\x53\x0b\x03\xff\xff\x32\x04\x04\xff\x19\x08\x00\x3c\xec'
+        resp = b'\x53\x0b\x03\xff\xff\x32\x04\x04\xff\x19\x08\x00\x3c\xf5'
     else:
         resp = read_config(PAS_CMD)
+    check_reply('pas', resp)
     pas_dict['PT'] = [resp[2], 'Pedal sensor type, set by manufacturer, don\'t change']
     pas_dict['DA'] = [resp[3], 'Designated assist level - by display or 0-9']
     pas_dict['SL'] = [resp[4], 'Maximum speed limit which motor will assist to']
@@ -238,12 +385,14 @@ def get_pas_config():
 # Byte[5]     - Designated Assist Level
 # Byte[6]     - Speed Limited km/h
 # Byte[7]     - Start Current %
-# Byte[8]     - Checksum
+# Byte[8]     - Checksum, sum of bytes 0-7, checked by check_reply
+@traced('read THROTTLE', 'area')
 def get_throttle_config():
     if test_data:
-        resp = b'\x54\x06\x0b\x24\x01\xff\x28\x0a\xb7'
+        resp = b'\x54\x06\x0b\x24\x01\xff\x28\x0a\xbb'
     else:
-        resp = read_config(THROTTLE_CMD)    
+        resp = read_config(THROTTLE_CMD)
+    check_reply('throttle', resp)
     throttle_dict['SV'] = [resp[2], 'Start voltage * 100mV, Throttle handle voltage when motor starts']
     throttle_dict['EV'] = [resp[3], 'End voltage * 100mV, Throttle handle voltage when motor is at max power']
     throttle_dict['MODE'] = [resp[4], "Mode of throttle handle, 0=\"speed\", 1=\"current\""]
@@ -252,120 +401,6 @@ def get_throttle_config():
     throttle_dict['SC'] = [resp[7], 'Start current % for minimum throttle']
     return throttle_dict
     
-#-----------------------------------------------------------------------
-# Set BASIC config (b'\x16\x52' + data + checksum)
-#-----------------------------------------------------------------------
-def set_basic_config():
-    frame = bytearray()
-    frame.append(0x16)  # write command
-    frame.append(0x52)  # section
-    frame.append(0x18)  # packet length (24)
-    c = 0x52 + 0x18
-    for key in basic_dict:
-        frame.append(basic_dict[key][0])
-        c = c + basic_dict[key][0]
-    checksum = c % 256
-    print("Writing BASIC configs to controller...")
-    frame.append(checksum)
-    print("Sending -> {0}".format(hexlify(frame,',',1)))
-    resp = read_config(frame)
-    print("Response -> {0}".format(hexlify(resp,',',1)))
-    if resp[1] != 0x18:
-        print("Received error code {0} when writing to BASIC config".format(resp[2]))
-        print("Error codes are:")
-        print("  0) Low Battery Protection out of range")
-        print("  1) Current Limit out of range")
-        print("  2) Current Limit for PAS0 out of range")
-        print("  3) Speed Limit for PAS0 out of range")
-        print("  4) Current Limit for PAS1 out of range")
-        print("  5) Speed Limit for PAS1 out of range")
-        print("  6) Current Limit for PAS2 out of range")
-        print("  7) Speed Limit for PAS2 out of range")
-        print("  8) Current Limit for PAS3 out of range")
-        print("  9) Speed Limit for PAS3 out of range")
-        print("  10) Current Limit for PAS4 out of range")
-        print("  11) Speed Limit for PAS4 out of range")
-        print("  12) Current Limit for PAS5 out of range")
-        print("  13) Speed Limit for PAS5 out of range")
-        print("  14) Current Limit for PAS6 out of range")
-        print("  15) Speed Limit for PAS6 out of range")
-        print("  16) Current Limit for PAS7 out of range")
-        print("  17) Speed Limit for PAS7 out of range")
-        print("  18) Current Limit for PAS8 out of range")
-        print("  19) Speed Limit for PAS8 out of range")
-        print("  20) Current Limit for PAS9 out of range")
-        print("  21) Speed Limit for PAS9 out of range")
-        print("  22) Wheel Diameter out of range")
-        print("  23) Speed Meter Signals out of range")
-    else:
-        print("Successfully written to BASIC controller config area...")
-
-#-----------------------------------------------------------------------
-# Set PAS config (b'\x16\x53' + data + checksum)
-#-----------------------------------------------------------------------
-def set_pas_config():
-    frame = bytearray()
-    frame.append(0x16)  # write command
-    frame.append(0x53)  # section
-    frame.append(0x0b)  # packet length (11)
-    c = 0x53 + 0x0b
-    for key in pas_dict:
-        frame.append(pas_dict[key][0])
-        c = c + pas_dict[key][0]
-    checksum = c % 256
-    print("Writing PAS configs to controller...")
-    frame.append(checksum)
-    print("Sending -> {0}".format(hexlify(frame,',',1)))
-    resp = read_config(frame)
-    print("Response -> {0}".format(hexlify(resp,',',1)))
-    if resp[1] != 0x0b:
-        print("Received error code {0} when writing to PAS config".format(resp[2]))
-        print("Error codes are:")
-        print("  0) Pedal Sensor Type error")
-        print("  1) Designated Assist Level error")
-        print("  2) Speed Limit error")
-        print("  3) Start Current out of range")
-        print("  4) Slow-start Mode error")
-        print("  5) Start Degree out of range")
-        print("  6) Work Mode error")
-        print("  7) Stop Delay out of range")
-        print("  8) Current Decay out of range")
-        print("  9) Stop Decay out of range")
-        print("  10) Keep Current out of range")
-    else:
-        print("Successfully written to PAS controller config area...")
-
-#-----------------------------------------------------------------------
-# Set THROTTLE config (b'\x16\x54' + data + checksum)
-#-----------------------------------------------------------------------
-def set_throttle_config():
-    frame = bytearray()
-    frame.append(0x16)  # write command
-    frame.append(0x54)  # section
-    frame.append(0x06)  # packet length
-    c = 0x54 + 0x06
-    for key in throttle_dict:
-        frame.append(throttle_dict[key][0])
-        c = c + throttle_dict[key][0]
-    checksum = c % 256
-    frame.append(checksum)
-    print("Writing THROTTLE configs to controller...")
-    print("Sending -> {0}".format(hexlify(frame,',',1)))
-    resp = read_config(frame)
-    print("Response -> {0}".format(hexlify(resp,',',1)))
-    if resp[1] != 0x06:
-        print("Received error code {0} when writing to THROTTLE config".format(resp[2]))
-        print("Error codes are:")
-        print("  0) Start voltage out of range")
-        print("  1) End voltage out of range")
-        print("  2) Mode error")
-        print("  3) Designated Assist error")
-        print("  4) Speed limit error")
-        print("  5) Start current out of range ")
-    else:
-        print("Successfully written to THROTTLE controller config are...")
-    #b'\x54\x06\x0b\x24\x01\xff\x28\x0a\xbb'
-
 #-----------------------------------------------------------------------
 # Get SPEED command (b'\x11\x20')
 #-----------------------------------------------------------------------
@@ -377,13 +412,13 @@ def set_throttle_config():
 # The third byte is a checksum (2nd byte + 20). 
 
 # From these values, the speed (in km/h) of the bike can be calculated:
-# rpm * wheelsize_in_meters * 60 / 1000
-# ([byte 2] + ([byte 1]*256)) * wheelsize_in_meters * 60 / 1000)
+# rpm * wheel_circumference_in_meters * 60 / 1000
+# ([byte 2] + ([byte 1]*256)) * pi * wheel_diameter_in_meters * 60 / 1000)
 #
-# Example: a 28" inch wheel is 711mm
+# Example: a 28" inch wheel is 711mm, WD is 56
 # Returned bytes: 0x00 0x3e 0x5e, 0x3e is 62.
 # 62 + (0*256) = 62
-# 62 *.711 * 60 / 1000 = 2.64 km/h
+# 62 * 3.1416 * .711 * 60 / 1000 = 8.31 km/h
 #
 # The interval at which this message is sent is irregular 
 # (ranging from .8 to a couple of seconds). So if you want to use speed 
@@ -394,8 +429,8 @@ def get_speed():
     ser.flush()
     resp = ser.read(100)
     #print(hexlify(resp,',',1))
-    wd_in_meters = basic_dict['WD'] * 25.4 / 1000
-    print("Speed is {0}km/h".format((resp[1] + (resp[0]*256)) * wd_in_meters * 60 / 1000))
+    wd_in_meters = basic_dict['WD'][0] / 2 * 25.4 / 1000
+    print("Speed is {0}km/h".format((resp[1] + (resp[0]*256)) * math.pi * wd_in_meters * 60 / 1000))
 
 #-----------------------------------------------------------------------
 # Get STATUS command (b'\x11\x08')
@@ -442,47 +477,92 @@ def get_power():
     #print(hexlify(resp,',',1))
     print("POWER in Amps -> {0}A...".format(resp[0]/2))
 
+#-----------------------------------------------------------------------
+# Read SPEED, STATUS, POWER and BATTERY in one go
+#-----------------------------------------------------------------------
+# Returns wheel rpm, status byte, amps requested and battery percent,
+# None for anything that did not answer.
+def get_telemetry():
+    telemetry = OrderedDict()
+    if test_data:
+        telemetry['rpm'] = 62
+        telemetry['status'] = 1
+        telemetry['amps'] = 5.0
+        telemetry['battery'] = 80
+        return telemetry
+    resp = read_config(SPEED_CMD, 3)
+    telemetry['rpm'] = resp[1] + (resp[0]*256) if len(resp) >= 2 else None
+    resp = read_config(STATUS_CMD, 1)
+    telemetry['status'] = resp[0] if len(resp) >= 1 else None
+    resp = read_config(POWER_CMD, 2)
+    telemetry['amps'] = resp[0]/2 if len(resp) >= 1 else None
+    resp = read_config(BATTERY_CMD, 2)
+    telemetry['battery'] = resp[0] if len(resp) >= 1 else None
+    return telemetry
+
+#-----------------------------------------------------------------------
+# Anomaly events from bdac_anomaly go in bdac.log with the serial traffic
+#-----------------------------------------------------------------------
+def log_event(event):
+    with open("bdac.log", mode='a') as f:
+        f.write("{0} !! {1}\n".format(time.strftime('%Y%m%d_%H%M%S', time.localtime(event['time'])),
+                                      event['text']))
+
 #-----------------------------------------------------------------------
 # Read a .bdac' config file into dictionaries and program flash
 #-----------------------------------------------------------------------
+# A file that can not be read or written raises ConfigFileError, the
+# command line exits on it (cli_config_file), --watch fails the job.
+class ConfigFileError(Exception):
+    pass
+
+@traced('read file', 'file')
 def read_config_file(filename):
     global basic_dict, pas_dict, throttle_dict
-    try:
-        f = open(filename, 'r')
-    except:
-        print("Could not open {0}, exiting...".format(filename))
-        sys.exit(0)
     # build one dictionary to hold the other 3
     fd = OrderedDict()
-    # read it from the json file
-    fd = json.load(f)
+    # read it from the json file, or bundle.bdacb#name
+    try:
+        with tracer.span('json load', 'file'):
+            fd = load_config(filename)
+        areas = fd['basic'], fd['pas'], fd['throttle']
+    except (OSError, ValueError, KeyError, TypeError, BundleError) as e:
+        raise ConfigFileError('Could not open {0} - {1}'.format(filename, e))
 
     # add them
-    basic_dict =  fd['basic']
-    pas_dict = fd['pas']
-    throttle_dict = fd['throttle']
+    basic_dict, pas_dict, throttle_dict = areas
 
     print('{0} file successfully read...'.format(filename))
 
 #-----------------------------------------------------------------------
 # Write a .bdac config file (json format)
 #-----------------------------------------------------------------------
+@traced('write file', 'file')
 def write_config_file(filename):
     try:
         f = open(filename, 'w')
-    except:
-        print('Could not open {0} for writing...'.format(filename))
-        sys.exit(0)
+    except OSError as e:
+        raise ConfigFileError('Could not open {0} for writing - {1}'.format(filename, e))
     # build one dictionary to hold the other 3
     fd = OrderedDict()
     # add them
     fd['basic'] = basic_dict
     fd['pas'] = pas_dict
     fd['throttle'] = throttle_dict
+    fd['controller'] = snapshot_identity(controller_info, bike_id)
     #write them to a json file
-    json.dump(fd, f)
+    with tracer.span('json dump', 'file'):
+        json.dump(fd, f)
     f.close()
 
+# the command line gives up on a file it can not read or write
+def cli_config_file(func, filename):
+    try:
+        func(filename)
+    except ConfigFileError as e:
+        print('{0}, exiting...'.format(e))
+        sys.exit(1)
+
 #-----------------------------------------------------------------------
 # Read all configuration data from controller
 #-----------------------------------------------------------------------
@@ -497,10 +577,89 @@ def read_flash():
 #-----------------------------------------------------------------------
 # Write all configuration data to controller
 #-----------------------------------------------------------------------
+# Only changed areas are written, everything written is verified and
+# the controller is rolled back if any area fails, see bdac_transaction.
 def write_flash():
-    set_basic_config()
-    set_pas_config()
-    set_throttle_config()
+    targets = OrderedDict()
+    targets['basic'] = basic_dict
+    targets['pas'] = pas_dict
+    targets['throttle'] = throttle_dict
+    return write_transaction(targets, get_config, read_config)
+
+get_config = {'basic': get_basic_config,
+              'pas': get_pas_config,
+              'throttle': get_throttle_config}
+
+#-----------------------------------------------------------------------
+# Run a bench job on a newly plugged in controller (bdac --watch)
+#-----------------------------------------------------------------------
+# job is "report" to just read and archive the settings, otherwise a
+# .bdac file to write.  The settings read back are saved to a time
+# stamped file named after the adapter, like the GUI does after writing.
+def provision(device, job):
+    global ser, controller_info
+    try:
+        ser = Serial(device, 1200, timeout=1)
+    except Exception as e:
+        return False, 'could not open port - {0}'.format(e)
+    try:
+        resp = read_config(INFO_CMD)
+        if len(resp) < 18 or resp[0] != 0x51:
+            return False, 'no controller answered'
+        controller_info = resp
+        model = resp[6:10].decode('ascii', 'replace')
+        if job == 'report':
+            get_basic_config()
+            get_pas_config()
+            get_throttle_config()
+            text = 'read'
+        else:
+            try:
+                read_config_file(job)
+            except ConfigFileError as e:
+                return False, str(e)
+            if not write_flash():
+                return False, 'write failed, see bdac.journal'
+            text = 'written'
+        filename = '{0}-{1}-config.bdac'.format(clock.strftime('%b-%d-%Y-%H:%M:%S'),
+                                               os.path.basename(device))
+        try:
+            write_config_file(filename)
+        except ConfigFileError as e:
+            return False, '{0} {1}, {2}'.format(model, text, e)
+        return True, '{0} {1}, saved {2}'.format(model, text, filename)
+    finally:
+        ser.close()
+
+#-----------------------------------------------------------------------
+# Cycles for the soak harness (bdac --soak), standin is the controller
+# stand-in behind the port
+#-----------------------------------------------------------------------
+# A read checks the area against what the stand-in holds, wrong values
+# taken as right are a bug.  A write changes LBP back and forth through
+# write_transaction and saves a time stamped snapshot as --watch does.
+def soak_ops(standin):
+    areas = list(get_config)
+
+    def read(n):
+        area = areas[n % len(areas)]
+        if area_values(get_config[area]()) != list(standin.areas[area]):
+            raise ValueError('{0} area read back wrong values'.format(area))
+        return True
+
+    def write(n):
+        target = get_basic_config().copy()
+        target['LBP'] = [42 if target['LBP'][0] == 41 else 41, target['LBP'][1]]
+        if not write_transaction(OrderedDict([('basic', target)]), get_config, read_config,
+                                 report=lambda text: None):
+            return False
+        write_config_file('{0}-soak-config.bdac'.format(clock.strftime('%b-%d-%Y-%H:%M:%S')))
+        return True
+
+    def telemetry(n):
+        return None not in get_telemetry().values()
+
+    return OrderedDict([('read', read), ('write', write), ('telemetry', telemetry)])
 
 #-----------------------------------------------------------------------
 # Print all configuration data from controller
@@ -530,17 +689,168 @@ def print_report(file=None):
 #=======================================================================
 if __name__ == '__main__':
     test_data = False   # set to true to use test resp data
+    status = 0
     help_text = """
  Usage:
 
     bdac                     Normal use, must have serial connection established.
+                             "Add Controller" in the menu opens another
+                             port, <Tab> or its number switches to it and
+                             "Copy Config To All Controllers" writes the
+                             settings shown to every one at once.
     bdac --help              Print this help.
     bdac --test              Run bdac with test data.
     bdac --report            Retrieve controller settings and print report.
     bdac --report <filename> Retrieve settings from file and report.
+    bdac --validate <path>   Check a .bdac file or directory of them.
+    bdac --write <filename>  Write settings from file to the controller.
+    bdac --write --resume    Finish an interrupted write from bdac.journal.
+    bdac --ride <log> <file> Speed and distance from a telemetry log (.csv)
+                             using the wheel diameter from a .bdac file.
+    bdac --energy <log|dir> <file>
+                             Energy use and range for each assist level from
+                             a log or directory of logs and a .bdac file.
+    bdac --simulate <file|dir> [log]
+                             Simulated motor current for each assist level of
+                             a .bdac file or every one in a directory, over a
+                             standard start and stop or a log (.csv) with
+                             time, cadence and speed (or rpm) columns.
+    bdac --optimize <in> <out> <target> [amps]
+                             Fit the ALC1-9 and ALSL1-9 levels of a .bdac file
+                             to a target, "linear" or "smooth" steps, or nine
+                             current percentages, capped at amps, and save the
+                             result as a new .bdac file.
+    bdac --watch <job>       Wait for controllers to be plugged in and run the
+                             job on each, job is "report" or a .bdac file to
+                             write.  Settings are saved to a time stamped file.
+    bdac --batch <jobfile> [--resume]
+                             Write a .bdac file to each port listed in the job
+                             file (lines of: port target.bdac), several ports
+                             at once.  Every step goes to <jobfile>.journal,
+                             --resume skips the jobs already finished.
+    bdac --wear              Report the flash writes made to each controller
+                             and area from bdac.wear, with the writes skipped
+                             because the controller already held the frame.
+    bdac --ingest <store> <file|dir> ...
+                             Add .bdac files, or every one in a directory, to
+                             a fleet store directory for --fleet queries.
+    bdac --fleet <store> [query ...]
+                             Count configs in the store matching conditions
+                             like LC>25 or pas.SL==255, add dist:WD for the
+                             spread of a field, stats:LC for its min, mean and
+                             max, list for the files, latest for only the
+                             newest config of each bike.
+    bdac --bundle <bundle> [file|dir ...]
+                             Add .bdac files, or every one in a directory, to
+                             a bundle (.bdacb) named after each file, or list
+                             the configs in it.  A config in a bundle is given
+                             as bundle.bdacb#name anywhere a .bdac file can be,
+                             and a bundle can be given to --validate.
+    bdac --export <syncdir> [station]
+                             Add the time stamped -config.bdac snapshots and
+                             bdac.log of this directory to a sync directory
+                             (shared or on a USB stick) as a delta bundle,
+                             only what the bundles there do not hold yet.
+    bdac --import <syncdir> [station]
+                             Copy snapshots from other stations' bundles in
+                             the sync directory here, their logs go to
+                             sync-logs/<station>-bdac.log.  The station name
+                             defaults to the host name.
+    bdac --daemon [socket]   Run bdacd, it holds the serial port open and keeps
+                             the controller settings cached.  While it runs
+                             every other bdac uses the port through it.
+                             The socket defaults to /tmp/bdacd.sock.
+                             Telemetry is published every second to a ring
+                             in shared memory any local program can read.
+    bdac --soak <cycles> [rate] [file]
+                             Run cycles of area reads, writes and telemetry
+                             polls through the serial code against the
+                             stand-in, with rate (default 0.02) of replies
+                             lost, cut short or garbled.  Throughput,
+                             latency, memory, open files and disk use are
+                             sampled as it goes, and saved to file (.csv)
+                             if given, anything that keeps growing is
+                             reported at the end.  Runs in a new soak-*
+                             directory.
+    bdac --telemetry [file]  Print the telemetry bdacd publishes as it comes
+                             in, or add it to a log (.csv) for --ride and
+                             --energy.  Records missed are counted.
+                             Status errors, current spikes and battery
+                             drops are added as # lines, bdacd also logs
+                             them in bdac.log.  "Live Telemetry" in the
+                             menu shows the same.
+
+    bdac --metrics <port> ...  Serve serial statistics in Prometheus format on
+                               http://localhost:<port>/metrics while running
+                               any of the above.
+    bdac --trace <file> ...    Save timing of serial commands, area reads and
+                               writes, file operations and screen refreshes
+                               of any of the above as a Chrome trace (json).
+    bdac --profile ...         Profile any of the above, saves bdac.prof and a
+                               hot function summary in bdac.prof.txt.
+    bdac --record <fixture> ...
+                               Record every command, response and its timing
+                               of the GUI, --report or --write to a fixture.
+    bdac --replay <fixture> [--speed <x>] ...
+                               Use a recorded fixture in place of the serial
+                               port, --speed 10 replays ten times faster and
+                               --speed 0 does not wait at all.
+    bdac --standin ...         Use a simulated controller in place of the
+                               serial port, it starts with the test data
+                               settings and keeps what is written to it.
+                               --report and --write do not wait for it.
+    bdac --bike <id> ...       Save id as the bike in every settings file
+                               written, the GUI's snapshots included.
+                               --ingest takes the bike from it, or from the
+                               controller's INFO when not given.
 
  """
 
+    # options that can be added to any of the modes above
+    if '--metrics' in sys.argv[:-1]:
+        i = sys.argv.index('--metrics')
+        try:
+            start_metrics_server(int(sys.argv[i + 1]))
+        except (ValueError, OSError) as e:
+            print('Could not start metrics server on port {0} - {1}'.format(sys.argv[i + 1], e))
+            sys.exit(1)
+        del sys.argv[i:i + 2]
+    if '--trace' in sys.argv[:-1]:
+        i = sys.argv.index('--trace')
+        tracer.start(sys.argv[i + 1])
+        del sys.argv[i:i + 2]
+    if '--profile' in sys.argv:
+        sys.argv.remove('--profile')
+        start_profile()
+    record_file = None
+    if '--record' in sys.argv[:-1]:
+        i = sys.argv.index('--record')
+        record_file = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+    replay_file = None
+    replay_speed = 1.0
+    if '--replay' in sys.argv[:-1]:
+        i = sys.argv.index('--replay')
+        replay_file = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+    if '--speed' in sys.argv[:-1]:
+        i = sys.argv.index('--speed')
+        try:
+            replay_speed = float(sys.argv[i + 1])
+        except ValueError:
+            print('--speed needs a number, not {0}'.format(sys.argv[i + 1]))
+            sys.exit(1)
+        del sys.argv[i:i + 2]
+
+    if '--bike' in sys.argv[:-1]:
+        i = sys.argv.index('--bike')
+        bike_id = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+
+    standin = '--standin' in sys.argv
+    if standin:
+        sys.argv.remove('--standin')
+
     if len(sys.argv) == 2 and str(sys.argv[1]) == "--help":
         print(help_text)
         sys.exit(0)
@@ -548,20 +858,289 @@ if __name__ == '__main__':
         print("Using test data...")
         test_data = True   # set to true to use test resp data
     elif len(sys.argv) == 3 and str(sys.argv[1]) == "--report":
-        print_report(file = str(sys.argv[2]))
+        cli_config_file(read_config_file, str(sys.argv[2]))
+        print_report()
         sys.exit()
-    
-    try:
-        ser = Serial(PORT, 1200, timeout=1)
-    except:
-        print('Could not open serial port, using test data...')
-        if test_data == False:
+    elif len(sys.argv) == 3 and str(sys.argv[1]) == "--validate":
+        if print_validation(validate_directory(str(sys.argv[2]))):
+            sys.exit(1)
+        sys.exit(0)
+    elif len(sys.argv) == 4 and str(sys.argv[1]) == "--ride":
+        # numpy is only needed for telemetry analysis
+        from bdac_analytics import load_series, columns, ride_summary, print_ride_summary
+        cli_config_file(read_config_file, str(sys.argv[3]))
+        wd = basic_dict['WD'][0]
+        try:
+            t, rpm = columns(load_series(str(sys.argv[2])), 'time', 'rpm')
+        except (OSError, ValueError) as e:
+            print('Could not read log {0} - {1}'.format(sys.argv[2], e))
+            sys.exit(1)
+        print_ride_summary(ride_summary(t, rpm, wd), wd)
+        sys.exit(0)
+    elif len(sys.argv) == 4 and str(sys.argv[1]) == "--energy":
+        from bdac_analytics import energy_stream, print_energy_summary
+        cli_config_file(read_config_file, str(sys.argv[3]))
+        logs = [str(sys.argv[2])]
+        if os.path.isdir(logs[0]):
+            logs = sorted(os.path.join(logs[0], f) for f in os.listdir(logs[0])
+                          if f.endswith('.csv'))
+        total_wh = 0.0
+        total_km = 0.0
+        for filename, summary in energy_stream(logs, basic_dict):
+            print_energy_summary(filename, summary)
+            total_wh += summary.get('wh', 0.0)
+            total_km += summary.get('km', 0.0)
+        print('{0} logs, {1:.1f}Wh over {2:.2f}km...'.format(len(logs), total_wh, total_km))
+        sys.exit(0)
+    elif len(sys.argv) in (3, 4) and str(sys.argv[1]) == "--simulate":
+        from bdac_simulate import default_input, load_input, simulation_report
+        path = str(sys.argv[2])
+        if os.path.isdir(path):
+            names = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.bdac'))
+        else:
+            names = [path]
+        if not names:
+            print('No .bdac files in {0}, exiting...'.format(path))
+            sys.exit(1)
+        configs = []
+        for name in names:
+            cli_config_file(read_config_file, name)
+            configs.append((basic_dict, pas_dict))
+        if len(sys.argv) == 4:
+            try:
+                t, cadence, speed = load_input(str(sys.argv[3]), basic_dict['WD'][0])
+            except (OSError, ValueError) as e:
+                print('Could not read log {0} - {1}'.format(sys.argv[3], e))
+                sys.exit(1)
+        else:
+            t, cadence, speed = default_input()
+        print('\n'.join(simulation_report(names, configs, t, cadence, speed)))
+        sys.exit(0)
+    elif len(sys.argv) in (5, 6) and str(sys.argv[1]) == "--optimize":
+        from bdac_optimize import optimize_levels
+        cli_config_file(read_config_file, str(sys.argv[2]))
+        target = str(sys.argv[4])
+        speed = target if target in ('linear', 'smooth') else 'linear'
+        try:
+            max_amps = float(sys.argv[5]) if len(sys.argv) == 6 else None
+            basic_dict, report = optimize_levels(basic_dict, target, speed, max_amps)
+        except ValueError as e:
+            print('Could not optimize - {0}'.format(e))
+            sys.exit(1)
+        print('\n'.join(report))
+        errors = validate_area('basic', basic_dict)
+        if errors:
+            print('\n'.join(errors))
+            sys.exit(1)
+        cli_config_file(write_config_file, str(sys.argv[3]))
+        print('Saved {0}...'.format(sys.argv[3]))
+        sys.exit(0)
+    elif len(sys.argv) == 3 and str(sys.argv[1]) == "--watch":
+        job = str(sys.argv[2])
+        if job != 'report':
+            if print_validation(validate_directory(job)):
+                sys.exit(1)
+        watcher = Watcher(lambda device: provision(device, job))
+        try:
+            watcher.watch()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    elif len(sys.argv) in (3, 4) and str(sys.argv[1]) == "--batch":
+        resume = len(sys.argv) == 4 and str(sys.argv[3]) == "--resume"
+        try:
+            done, skipped, failed = run_batch(str(sys.argv[2]),
+                                              lambda port: Serial(port, 1200, timeout=1),
+                                              read_config, resume=resume)
+        except (OSError, ValueError) as e:
+            print('Could not run batch {0} - {1}'.format(sys.argv[2], e))
+            sys.exit(1)
+        print('{0} written, {1} already done, {2} failed...'.format(done, skipped, failed))
+        sys.exit(1 if failed else 0)
+    elif len(sys.argv) >= 4 and str(sys.argv[1]) == "--ingest":
+        from bdac_fleet import FleetStore, ingest
+        added, skipped, bad = ingest(FleetStore(str(sys.argv[2])), sys.argv[3:])
+        print('{0} configs added, {1} already in the store, {2} unreadable...'.format(
+              added, skipped, bad))
+        sys.exit(1 if bad else 0)
+    elif len(sys.argv) >= 3 and str(sys.argv[1]) == "--fleet":
+        from bdac_fleet import FleetStore, query_lines
+        try:
+            print('\n'.join(query_lines(FleetStore(str(sys.argv[2])), sys.argv[3:])))
+        except (KeyError, ValueError) as e:
+            print('Could not query {0} - {1}'.format(sys.argv[2], e))
+            sys.exit(1)
+        sys.exit(0)
+    elif len(sys.argv) >= 3 and str(sys.argv[1]) == "--bundle":
+        bundle = Bundle(str(sys.argv[2]))
+        try:
+            if len(sys.argv) == 3:
+                for name in bundle.names():
+                    print('{0:<40} {1}'.format(name, time.strftime(
+                          '%Y-%m-%d %H:%M:%S', time.localtime(bundle.stamp(name)))))
+                print('{0} configs in {1}...'.format(len(bundle.names()), sys.argv[2]))
+                sys.exit(0)
+            items = []
+            for path in sys.argv[3:]:
+                if os.path.isdir(path):
+                    files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                                   if f.endswith('.bdac'))
+                else:
+                    files = [path]
+                for filename in files:
+                    items.append((os.path.splitext(os.path.basename(filename))[0],
+                                  load_config(filename), os.path.getmtime(filename)))
+            bundle.add(items)
+        except (OSError, ValueError, BundleError) as e:
+            print('Could not update bundle {0} - {1}'.format(sys.argv[2], e))
+            sys.exit(1)
+        print('{0} configs added to {1}, {2} in it...'.format(
+              len(items), sys.argv[2], len(bundle.names())))
+        sys.exit(0)
+    elif len(sys.argv) in (3, 4) and str(sys.argv[1]) in ("--export", "--import"):
+        from bdac_sync import export_delta, import_deltas
+        station = str(sys.argv[3]) if len(sys.argv) == 4 else None
+        try:
+            if str(sys.argv[1]) == "--export":
+                count, size, filename = export_delta(str(sys.argv[2]), station=station)
+                if filename is None:
+                    print('Nothing new to export...')
+                else:
+                    print('{0} records, {1} bytes exported to {2}...'.format(count, size, filename))
+            else:
+                snapshots, logs = import_deltas(str(sys.argv[2]), station=station)
+                print('{0} snapshots and {1} log pieces imported...'.format(snapshots, logs))
+        except (OSError, ValueError, BundleError) as e:
+            print('Could not sync with {0} - {1}'.format(sys.argv[2], e))
+            sys.exit(1)
+        sys.exit(0)
+    elif len(sys.argv) in (3, 4, 5) and str(sys.argv[1]) == "--soak":
+        try:
+            cycles = int(sys.argv[2])
+            rate = float(sys.argv[3]) if len(sys.argv) >= 4 else 0.02
+        except ValueError:
             print(help_text)
-            #print('Exiting...')
-            #sys.exit(0)
-            test_data = True
-            sys.argv = ['bdac.py', '--test']
+            sys.exit(1)
+        out = open(str(sys.argv[4]), 'w') if len(sys.argv) == 5 else None
+        # the run gets a directory of its own, what is left in it is
+        # what a station would pile up
+        rundir = os.path.abspath('soak-{0}'.format(time.strftime('%Y%m%d_%H%M%S')))
+        os.makedirs(rundir, exist_ok=True)
+        os.chdir(rundir)
+        clock = VirtualClock()
+        standin = StandInSerial(clock=clock)
+        ser = FaultSerial(standin, rate, seed=cycles, clock=clock)
+        wear.report = None
+        timer.enabled = False
+        print('Soaking {0} cycles, {1:.0%} faults, in {2}...'.format(cycles, rate, rundir))
+        samples, errors = soak(soak_ops(standin), cycles, rundir, clock, csv=out,
+                               expected=(ReplyError,))
+        lines, warnings = soak_summary(samples, errors, ser.faults)
+        print('\n'.join([''] + lines))
+        for warning in warnings:
+            print('!! ' + warning)
+        sys.exit(1 if warnings else 0)
+    elif len(sys.argv) in (2, 3) and str(sys.argv[1]) == "--telemetry":
+        try:
+            reader = RingReader()
+        except (OSError, ValueError) as e:
+            print('No telemetry to read, is bdacd running? - {0}'.format(e))
+            sys.exit(1)
+        out = open(str(sys.argv[2]), 'a') if len(sys.argv) == 3 else sys.stdout
+        if out is sys.stdout or out.tell() == 0:
+            out.write('time,rpm,status,amps,battery\n')
+        lost = 0
+        detector = Detector(report=lambda e: out.write('# {0}\n'.format(e['text'])))
+        try:
+            for t in reader.follow():
+                if reader.lost != lost:
+                    out.write('# {0} records lost\n'.format(reader.lost - lost))
+                    lost = reader.lost
+                detector.observe(t)
+                out.write(','.join('' if t[k] is None else str(t[k])
+                                   for k in ('time', 'rpm', 'status', 'amps', 'battery')) + '\n')
+                out.flush()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    elif len(sys.argv) == 2 and str(sys.argv[1]) == "--wear":
+        print('\n'.join(wear.report_lines()))
+        sys.exit(0)
+    elif len(sys.argv) in (2, 3) and str(sys.argv[1]) == "--daemon":
+        socket_path = str(sys.argv[2]) if len(sys.argv) == 3 else SOCKET
+        # checked before the port and the ring are touched, they are the
+        # running bdacd's
+        other = connect_daemon(socket_path)
+        if other is not None:
+            other.close()
+            print('bdacd is already serving {0}, not started...'.format(socket_path))
+            sys.exit(1)
+        try:
+            ser = Serial(PORT, 1200, timeout=1)
+        except:
+            print('Could not open serial port {0}, bdacd not started...'.format(PORT))
+            sys.exit(1)
+        print('bdacd serving {0} on {1}...'.format(PORT, socket_path))
+        try:
+            ring = RingWriter()
+        except OSError as e:
+            print('Could not create telemetry ring {0} - {1}'.format(RING, e))
+            ring = None
+        daemon = Bdacd(get_config, read_config, get_telemetry, socket_path, ring,
+                       detector=Detector(report=log_event))
+        try:
+            daemon.serve()
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            print('bdacd not started - {0}'.format(e))
+            ser.close()
+            sys.exit(1)
+        ser.close()
+        sys.exit(0)
+
+    # a running bdacd owns the port, go through it instead
+    ser = connect_daemon() if replay_file is None and not standin else None
+    if standin or replay_file is not None:
+        wear.enabled = False    # not a real controller
+        timer.enabled = False
+    if standin:
+        # the GUI keeps real time so its idle loop does not spin
+        if len(sys.argv) >= 2 and str(sys.argv[1]) != "--test":
+            clock = VirtualClock()
+        ser = StandInSerial(clock=clock)
+        print('Using the controller stand-in...')
+    elif replay_file is not None:
+        try:
+            ser = ReplaySerial(replay_file, replay_speed)
+        except (OSError, ValueError, KeyError, ReplayError) as e:
+            print('Could not replay {0} - {1}'.format(replay_file, e))
+            sys.exit(1)
+        print('Replaying {0}...'.format(replay_file))
+    elif ser is not None:
+        print('Using bdacd on {0}...'.format(SOCKET))
+    else:
+        try:
+            ser = Serial(PORT, 1200, timeout=1)
+        except:
+            if len(sys.argv) >= 2 and str(sys.argv[1]) == "--write":
+                print('Could not open serial port {0}, nothing written...'.format(PORT))
+                sys.exit(1)
+            print('Could not open serial port, using test data...')
+            if test_data == False:
+                print(help_text)
+                #print('Exiting...')
+                #sys.exit(0)
+                test_data = True
+                sys.argv = ['bdac.py', '--test']
+    if record_file is not None and not test_data:
+        ser = RecordingSerial(ser, record_file, PORT)
     if len(sys.argv) == 1 or (len(sys.argv) >= 2 and str(sys.argv[1]) == "--test"):
+        # more controllers opened from the menu
+        def open_port(device):
+            if standin:
+                return StandInSerial(clock=clock)
+            return Serial(device, 1200, timeout=1)
         term = BdacTerm(get_basic_config, 
                         get_pas_config,
                         get_throttle_config,
@@ -572,14 +1151,32 @@ if __name__ == '__main__':
                         test_data,
                         PORT,
                         VERSION,
-                        VERSION_DATE)
+                        VERSION_DATE,
+                        clock=clock,
+                        get_telemetry=get_telemetry,
+                        log_event=log_event,
+                        open_port=open_port,
+                        bike=bike_id)
+        wear.report = None      # warnings would land on the curses screen
         curses.wrapper(term.gui_main, term)
     elif len(sys.argv) == 2 and str(sys.argv[1]) == "--report":
-        read_flash()
+        try:
+            read_flash()
+        except ReplyError as e:
+            print('Could not read the controller - {0}'.format(e))
+            sys.exit(1)
         print_report()
+    elif len(sys.argv) == 3 and str(sys.argv[1]) == "--write":
+        if str(sys.argv[2]) == "--resume":
+            written = resume_transaction(get_config, read_config)
+        else:
+            cli_config_file(read_config_file, str(sys.argv[2]))
+            written = write_flash()
+        if not written:
+            status = 1
 
     try:
         ser.close()
     except:
         pass
-    sys.exit(0)
+    sys.exit(status)
@@ -0,0 +1,314 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Bulk analysis of recorded telemetry.  Everything works on whole NumPy
+# arrays at once so a ride, or a month of rides from the whole fleet,
+# is one call rather than one sample at a time.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from collections import OrderedDict
+
+#-----------------------------------------------------------------------
+# Telemetry log files
+#-----------------------------------------------------------------------
+# Comma separated with a header line, times in seconds, for example:
+#   time,rpm
+#   0.0,0
+#   0.9,62
+# Extra columns (power, battery...) are kept and used by later analysis.
+# An empty field, a poll the controller did not answer, reads as NaN.
+def load_series(filename):
+    data = np.genfromtxt(filename, delimiter=',', names=True)
+    if data.dtype.names is None:
+        raise ValueError('no header line')
+    series = OrderedDict()
+    for name in data.dtype.names:
+        series[name] = np.atleast_1d(data[name]).astype(np.float64)
+    return series
+
+# The named columns of a series, a ValueError names those missing
+def columns(series, *names):
+    missing = [name for name in names if name not in series]
+    if missing:
+        raise ValueError('no {0} column in the log'.format(', '.join(missing)))
+    return [series[name] for name in names]
+
+#-----------------------------------------------------------------------
+# Rows where every array given has a reading, so NaNs never reach a sum
+#-----------------------------------------------------------------------
+# Arrays are taken at the rows kept, a single number is left as it is.
+# The intervals either side of a row dropped become one interval.
+def finite_rows(*arrays):
+    keep = np.ones(len(arrays[0]), dtype=bool)
+    for a in arrays:
+        if np.ndim(a):
+            keep &= np.isfinite(np.asarray(a, dtype=np.float64))
+    return [np.asarray(a, dtype=np.float64)[keep] if np.ndim(a) else a for a in arrays]
+
+#-----------------------------------------------------------------------
+# Wheel RPM from the two SPEED_CMD bytes, arrays of any length
+#-----------------------------------------------------------------------
+def rpm_from_bytes(high, low):
+    return np.asarray(low, dtype=np.float64) + np.asarray(high, dtype=np.float64) * 256
+
+#-----------------------------------------------------------------------
+# Wheel circumference in meters from the controller WD setting
+#-----------------------------------------------------------------------
+# WD is the wheel diameter in inches * 2, so 56 is a 28" wheel.
+def wheel_circumference(wd):
+    return np.pi * (wd / 2.0) * 25.4 / 1000
+
+#-----------------------------------------------------------------------
+# Speed in km/h from wheel RPM
+#-----------------------------------------------------------------------
+def speed_kmh(rpm, wd):
+    return np.asarray(rpm, dtype=np.float64) * wheel_circumference(wd) * 60 / 1000
+
+#-----------------------------------------------------------------------
+# Distance in km, trapezoid integration over the real sample times
+#-----------------------------------------------------------------------
+# Samples arrive every 0.8 to 2 seconds so the time of every sample is
+# used rather than a fixed interval.  Returns the running distance, the
+# last element is the total.
+def distance_km(t, speed):
+    t = np.asarray(t, dtype=np.float64)
+    speed = np.asarray(speed, dtype=np.float64)
+    dist = np.zeros(len(t))
+    if len(t) > 1:
+        np.cumsum((speed[1:] + speed[:-1]) / 2 * np.diff(t) / 3600, out=dist[1:])
+    return dist
+
+#-----------------------------------------------------------------------
+# Acceleration in m/s^2, handles uneven sample spacing
+#-----------------------------------------------------------------------
+def acceleration(t, speed):
+    t = np.asarray(t, dtype=np.float64)
+    if len(t) < 2:
+        return np.zeros(len(t))
+    return np.gradient(np.asarray(speed, dtype=np.float64) / 3.6, t)
+
+#-----------------------------------------------------------------------
+# Time weighted moving average over the last window seconds
+#-----------------------------------------------------------------------
+# Uses the running integral of x so the whole series is done at once
+# whatever the window size.  The first samples average over what is
+# available.
+def moving_average(t, x, window):
+    t = np.asarray(t, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    if len(t) < 2:
+        return x.copy()
+    integral = np.zeros(len(t))
+    np.cumsum((x[1:] + x[:-1]) / 2 * np.diff(t), out=integral[1:])
+    start = np.maximum(t - window, t[0])
+    span = t - start
+    avg = x.copy()
+    nz = span > 0
+    avg[nz] = (integral[nz] - np.interp(start[nz], t, integral)) / span[nz]
+    return avg
+
+#-----------------------------------------------------------------------
+# Speed, distance, acceleration and smoothed speed for a whole series
+#-----------------------------------------------------------------------
+def ride_series(t, rpm, wd, window=10.0):
+    t, rpm = finite_rows(t, rpm)
+    series = OrderedDict()
+    series['time'] = t
+    series['speed'] = speed_kmh(rpm, wd)
+    series['distance'] = distance_km(series['time'], series['speed'])
+    series['accel'] = acceleration(series['time'], series['speed'])
+    series['speed_avg'] = moving_average(series['time'], series['speed'], window)
+    return series
+
+def ride_summary(t, rpm, wd, window=10.0):
+    s = ride_series(t, rpm, wd, window)
+    summary = OrderedDict()
+    summary['samples'] = len(s['time'])
+    if summary['samples'] == 0:
+        return summary
+    duration = s['time'][-1] - s['time'][0]
+    summary['duration_s'] = duration
+    summary['distance_km'] = s['distance'][-1]
+    summary['avg_kmh'] = s['distance'][-1] / duration * 3600 if duration > 0 else 0.0
+    summary['max_kmh'] = s['speed'].max()
+    summary['max_avg_kmh'] = s['speed_avg'].max()
+    summary['max_accel'] = s['accel'].max()
+    summary['max_decel'] = s['accel'].min()
+    return summary
+
+def print_ride_summary(summary, wd):
+    print('Wheel diameter:   -> {0} inches (WD {1})'.format(wd / 2, wd))
+    print('Samples:          -> {0}'.format(summary['samples']))
+    if summary['samples'] == 0:
+        return
+    print('Duration:         -> {0:.0f}s'.format(summary['duration_s']))
+    print('Distance:         -> {0:.3f}km'.format(summary['distance_km']))
+    print('Average speed:    -> {0:.1f}km/h'.format(summary['avg_kmh']))
+    print('Maximum speed:    -> {0:.1f}km/h'.format(summary['max_kmh']))
+    print('Max smoothed:     -> {0:.1f}km/h'.format(summary['max_avg_kmh']))
+    print('Max acceleration: -> {0:.2f}m/s^2'.format(summary['max_accel']))
+    print('Max braking:      -> {0:.2f}m/s^2'.format(summary['max_decel']))
+
+#-----------------------------------------------------------------------
+# ENERGY AND RANGE
+#-----------------------------------------------------------------------
+# Telemetry logs for energy analysis carry these extra columns:
+#   amps    - current requested by the controller (POWER_CMD byte / 2)
+#   battery - battery percentage (BATTERY_CMD)
+#   volts   - optional, battery voltage
+#   level   - optional, assist level 0-9 selected on the display
+# Without a volts column the nominal pack voltage is estimated from the
+# LBP setting, 41V cut off is a 48V pack.
+def nominal_volts(basic_dict):
+    return basic_dict['LBP'][0] * 48.0 / 41.0
+
+def amps_from_power_byte(power):
+    return np.asarray(power, dtype=np.float64) / 2
+
+#-----------------------------------------------------------------------
+# Energy of each sample interval in Wh, trapezoid over real times
+#-----------------------------------------------------------------------
+def interval_wh(t, amps, volts):
+    watts = np.asarray(amps, dtype=np.float64) * volts
+    return (watts[1:] + watts[:-1]) / 2 * np.diff(t) / 3600
+
+def interval_km(t, speed):
+    speed = np.asarray(speed, dtype=np.float64)
+    return (speed[1:] + speed[:-1]) / 2 * np.diff(t) / 3600
+
+#-----------------------------------------------------------------------
+# Current and speed limit of each assist level from the BASIC settings
+#-----------------------------------------------------------------------
+# ALCn is a percentage of LC, ALSLn a percentage of the speed limit.
+def level_limits(basic_dict):
+    lc = basic_dict['LC'][0]
+    amps = np.array([basic_dict['ALC{0}'.format(i)][0] for i in range(10)], dtype=np.float64) * lc / 100
+    speed = np.array([basic_dict['ALSL{0}'.format(i)][0] for i in range(10)], dtype=np.float64)
+    return amps, speed
+
+#-----------------------------------------------------------------------
+# Wh used, Wh/km and range left for each assist level
+#-----------------------------------------------------------------------
+# With a level column the figures for each level are measured from the
+# intervals ridden at that level.  Without one they are projected by
+# capping the recorded current at each level's current limit.  The range
+# uses the energy per battery percent seen in the log, or battery_wh
+# (pack capacity) when the percentage did not drop.
+def energy_summary(series, basic_dict, battery_wh=None):
+    t, = columns(series, 'time')
+    wd = basic_dict['WD'][0]
+    if 'speed' in series:
+        speed = series['speed']
+    elif 'rpm' in series:
+        speed = speed_kmh(series['rpm'], wd)
+    else:
+        raise ValueError('no speed or rpm column in the log')
+    if 'amps' in series:
+        amps = series['amps']
+    elif 'power' in series:
+        amps = amps_from_power_byte(series['power'])
+    else:
+        raise ValueError('no amps or power column in the log')
+    if 'volts' in series:
+        volts = series['volts']
+    else:
+        volts = nominal_volts(basic_dict)
+    level = series.get('level', 0)
+    t, speed, amps, volts, level = finite_rows(t, speed, amps, volts, level)
+    cap_amps, cap_speed = level_limits(basic_dict)
+
+    summary = OrderedDict()
+    summary['samples'] = len(t)
+    if len(t) < 2:
+        return summary
+    wh = interval_wh(t, amps, volts)
+    km = interval_km(t, speed)
+    summary['wh'] = wh.sum()
+    summary['km'] = km.sum()
+    summary['wh_km'] = summary['wh'] / summary['km'] if summary['km'] > 0 else None
+
+    remaining_wh = None
+    battery = series['battery'] if 'battery' in series else np.empty(0)
+    battery = battery[np.isfinite(battery)]
+    if len(battery):
+        drop = battery[0] - battery[-1]
+        summary['battery_used'] = drop
+        if drop > 0:
+            remaining_wh = battery[-1] * summary['wh'] / drop
+        elif battery_wh:
+            remaining_wh = battery[-1] * battery_wh / 100
+    elif battery_wh:
+        remaining_wh = battery_wh
+    summary['remaining_wh'] = remaining_wh
+
+    if 'level' in series:
+        summary['measured'] = True
+        level = np.clip(level[:-1].astype(np.int64), 0, 9)
+        level_wh = np.bincount(level, weights=wh, minlength=10)
+        level_km = np.bincount(level, weights=km, minlength=10)
+    else:
+        summary['measured'] = False
+        level_km = np.full(10, summary['km'])
+        level_wh = np.array([interval_wh(t, np.minimum(amps, cap), volts).sum()
+                             for cap in cap_amps])
+
+    levels = []
+    for i in range(10):
+        wh_km = level_wh[i] / level_km[i] if level_km[i] > 0 else None
+        if wh_km and remaining_wh is not None:
+            range_km = remaining_wh / wh_km
+        else:
+            range_km = None
+        levels.append([i, cap_amps[i], cap_speed[i], level_wh[i], level_km[i], wh_km, range_km])
+    summary['levels'] = levels
+    return summary
+
+#-----------------------------------------------------------------------
+# Stream energy summaries for any number of logs, one at a time
+#-----------------------------------------------------------------------
+# Only one log is in memory at once, so a month of fleet logs is one job.
+def energy_stream(filenames, basic_dict, battery_wh=None):
+    for filename in filenames:
+        try:
+            summary = energy_summary(load_series(filename), basic_dict, battery_wh)
+        except (OSError, ValueError) as e:
+            yield filename, {'error': str(e)}
+            continue
+        yield filename, summary
+
+def print_energy_summary(filename, summary):
+    print('[{0}]'.format(filename))
+    if 'error' in summary:
+        print('Could not read log - {0}'.format(summary['error']))
+        return
+    if summary['samples'] < 2:
+        print('Not enough samples...')
+        return
+    print('Energy used:      -> {0:.1f}Wh over {1:.2f}km'.format(summary['wh'], summary['km']))
+    if summary['wh_km'] is not None:
+        print('Consumption:      -> {0:.1f}Wh/km'.format(summary['wh_km']))
+    if summary['remaining_wh'] is not None:
+        print('Battery left:     -> {0:.0f}Wh'.format(summary['remaining_wh']))
+    if summary['measured']:
+        print('Level\tMax A\tSpeed%\tWh\tkm\tWh/km\tRange km')
+    else:
+        print('Level\tMax A\tSpeed%\tWh\tkm\tWh/km\tRange km  (projected)')
+    for i, amps, speed, wh, km, wh_km, range_km in summary['levels']:
+        print('{0}\t{1:.1f}\t{2:.0f}\t{3:.1f}\t{4:.2f}\t{5}\t{6}'.format(i, amps, speed, wh, km,
+              '-' if wh_km is None else '{0:.1f}'.format(wh_km),
+              '-' if range_km is None else '{0:.1f}'.format(range_km)))
+    print('')
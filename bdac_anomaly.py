@@ -0,0 +1,142 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Live telemetry anomaly detection.  Every poll is fed to a Detector
+# which keeps an exponentially weighted mean and variance of each signal
+# (about the last 20 polls count) and raises events for:
+#
+#   status     the controller reports anything but normal or braking
+#   current    amps jump well above their recent level, a spike
+#   battery    the battery level falls well below its recent level
+#   reply      the controller stops answering the status commands
+#
+# A signal raises one event when it goes wrong and another when it comes
+# back, not one per poll.  Memory per signal is fixed, the detector can
+# run for days.  bdacd logs the events to bdac.log, --telemetry and the
+# GUI "Live Telemetry" screen show them.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import time
+
+from collections import OrderedDict, deque
+
+ALPHA = 0.1             # weight of the newest poll
+WARMUP = 10             # polls before spikes and drops are judged
+SPIKE_SIGMA = 4.0       # current this many deviations above its mean ...
+SPIKE_AMPS = 2.0        # ... and at least this many amps
+DROP_SIGMA = 4.0        # battery this many deviations below its mean ...
+DROP_PERCENT = 5.0      # ... and at least this many percent
+MISSED = 3              # polls without a reply before it is an event
+EVENTS = 50             # recent events kept for display
+
+STATUS_OK = (1, 3)
+STATUS_TEXT = {1: 'normal', 3: 'braking', 21: 'speed sensor error'}
+
+#-----------------------------------------------------------------------
+# Exponentially weighted mean and variance of one signal
+#-----------------------------------------------------------------------
+class SignalStats():
+
+    def __init__(self, alpha=ALPHA):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def update(self, x):
+        if self.count == 0:
+            self.mean = x
+        else:
+            diff = x - self.mean
+            incr = self.alpha * diff
+            self.mean += incr
+            self.var = (1 - self.alpha) * (self.var + diff * incr)
+        self.count += 1
+
+    def sigma(self):
+        return math.sqrt(self.var)
+
+class Detector():
+
+    def __init__(self, report=None, alpha=ALPHA):
+        self.report = report    # called with each event
+        self.stats = OrderedDict((name, SignalStats(alpha)) for name in ('rpm', 'amps', 'battery'))
+        self.active = dict()    # signal -> True while it is wrong
+        self.status = None
+        self.missed = 0
+        self.events = deque(maxlen=EVENTS)
+        self.count = 0
+
+    def event(self, events, telemetry, signal, kind, value, text):
+        e = OrderedDict([('time', telemetry.get('time', time.time())), ('signal', signal),
+                         ('kind', kind), ('value', value), ('text', text)])
+        events.append(e)
+        self.events.append(e)
+        if self.report is not None:
+            self.report(e)
+
+    # an event when a signal goes wrong and when it is right again
+    def change(self, events, telemetry, signal, wrong, value, text, back):
+        if wrong and not self.active.get(signal):
+            self.event(events, telemetry, signal, 'anomaly', value, text)
+        elif not wrong and self.active.get(signal):
+            self.event(events, telemetry, signal, 'cleared', value, back)
+        self.active[signal] = wrong
+
+    #-------------------------------------------------------------------
+    # Feed one poll, returns the events it raised
+    #-------------------------------------------------------------------
+    def observe(self, telemetry):
+        events = []
+        self.count += 1
+        values = [telemetry.get(k) for k in ('rpm', 'status', 'amps', 'battery')]
+        self.missed = self.missed + 1 if all(v is None for v in values) else 0
+        self.change(events, telemetry, 'reply', self.missed >= MISSED, None,
+                    'No reply from the controller', 'Controller answering again')
+
+        status = telemetry.get('status')
+        if status is not None and status != self.status:
+            text = STATUS_TEXT.get(status, 'error code {0}'.format(status))
+            self.change(events, telemetry, 'status', status not in STATUS_OK, status,
+                        'Status {0}'.format(text), 'Status {0}'.format(text))
+            self.status = status
+
+        amps = telemetry.get('amps')
+        s = self.stats['amps']
+        if amps is not None:
+            if s.count >= WARMUP:
+                limit = s.mean + max(SPIKE_AMPS, SPIKE_SIGMA * s.sigma())
+                self.change(events, telemetry, 'amps', amps > limit, amps,
+                            'Current spike {0:.1f}A, usually {1:.1f}A'.format(amps, s.mean),
+                            'Current back to {0:.1f}A'.format(amps))
+            s.update(float(amps))
+
+        battery = telemetry.get('battery')
+        s = self.stats['battery']
+        if battery is not None:
+            if s.count >= WARMUP:
+                limit = s.mean - max(DROP_PERCENT, DROP_SIGMA * s.sigma())
+                self.change(events, telemetry, 'battery', battery < limit, battery,
+                            'Battery dropped to {0}%, was {1:.0f}%'.format(battery, s.mean),
+                            'Battery level settled at {0}%'.format(battery))
+            s.update(float(battery))
+
+        if telemetry.get('rpm') is not None:
+            self.stats['rpm'].update(float(telemetry['rpm']))
+        return events
+
+    def summary(self):
+        return OrderedDict((name, (s.mean, s.sigma())) for name, s in self.stats.items() if s.count)
@@ -0,0 +1,249 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Batch provisioning (bdac --batch <jobfile> [--resume]).  A job file has
+# one line per bike, the port (a /dev/serial/by-id name identifies the
+# adapter) and the .bdac file to write to it:
+#
+#   # port                                          target
+#   /dev/serial/by-id/usb-FTDI_FT232R_A10K3-if00    commuter.bdac
+#   /dev/ttyUSB1                                    cargo.bdac
+#
+# Ports are worked in parallel by a pool of workers, jobs on the same
+# port one after the other.  Each job is a normal write transaction and
+# every step of it goes to <jobfile>.journal.  Workers hand their entries
+# to one writer thread which syncs whatever has piled up with a single
+# fsync, a worker carries on once its entry is on disk.  If the journal
+# cannot be written the error is raised to every worker waiting on it and
+# the batch stops, nothing is written unjournaled.  --resume skips
+# jobs that finished since the last fresh start; an interrupted job is
+# run again and areas the controller already holds are not rewritten.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from bdac_frames import area_dict, decode_frame, content_hash, check_reply
+from bdac_validate import validate_config
+from bdac_transaction import write_transaction, read_journal
+from bdac_bundle import load_config, BundleError
+
+WORKERS = 4
+READ_CMD = 0x11
+
+#-----------------------------------------------------------------------
+# Journal shared by all workers, entries are synced in groups
+#-----------------------------------------------------------------------
+class BatchJournal():
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, mode='a')
+        self.cond = threading.Condition()
+        self.pending = []
+        self.queued = 0         # entries handed in
+        self.synced = 0         # entries on disk
+        self.syncs = 0
+        self.error = None       # what stopped the writer
+        self.running = True
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def write(self, entry):
+        entry.setdefault('stamp', time.strftime('%Y%m%d_%H%M%S', time.localtime()))
+        with self.cond:
+            if self.error is not None:
+                raise self.error
+            self.pending.append(json.dumps(entry) + '\n')
+            self.queued += 1
+            mine = self.queued
+            self.cond.notify_all()
+            while self.synced < mine and self.error is None:
+                self.cond.wait()
+            if self.synced < mine:
+                raise self.error
+
+    def writer(self):
+        while True:
+            with self.cond:
+                while not self.pending and self.running:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                lines = self.pending
+                self.pending = []
+                last = self.queued
+            # more entries pile up while this sync runs
+            try:
+                self.f.write(''.join(lines))
+                self.f.flush()
+                os.fsync(self.f.fileno())
+            except (OSError, ValueError) as e:
+                with self.cond:
+                    self.error = e
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                self.synced = last
+                self.syncs += 1
+                self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+        self.f.close()
+
+class JobJournal():
+
+    def __init__(self, journal, key):
+        self.journal = journal
+        self.key = key
+
+    def write(self, entry):
+        entry['job'] = self.key
+        self.journal.write(entry)
+
+#-----------------------------------------------------------------------
+# Read a job file into a list of [port, target filename]
+#-----------------------------------------------------------------------
+def read_jobs(filename):
+    jobs = []
+    base = os.path.dirname(filename)
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if len(line) == 2:
+                jobs.append([line[0], os.path.join(base, line[1])])
+            elif line:
+                raise ValueError('Bad job line: {0}'.format(' '.join(line)))
+    return jobs
+
+def load_targets(filename):
+    fd = load_config(filename)
+    return OrderedDict((area, OrderedDict(fd[area])) for area in area_dict)
+
+# A job is its port and the content of its target, editing the target
+# makes it a new job
+def job_key(port, targets):
+    h = hashlib.sha1()
+    for area, dic in targets.items():
+        h.update(content_hash(area, dic).encode())
+    return '{0}|{1}'.format(port, h.hexdigest()[:12])
+
+#-----------------------------------------------------------------------
+# Jobs finished since the batch was last started without --resume
+#-----------------------------------------------------------------------
+def finished_jobs(journal):
+    done = set()
+    for entry in read_journal(journal):
+        if entry.get('state') == 'batch_start':
+            done = set()
+        elif entry.get('state') == 'job_done':
+            done.add(entry['job'])
+    return done
+
+#-----------------------------------------------------------------------
+# Area readers for one open port, same use as bdac.get_config
+#-----------------------------------------------------------------------
+def port_config(send, templates):
+    def reader(area):
+        def get():
+            resp = check_reply(area, send(bytes((READ_CMD, area_dict[area][0]))))
+            return decode_frame(area, resp, templates[area])
+        return get
+    return dict((area, reader(area)) for area in area_dict)
+
+#-----------------------------------------------------------------------
+# Run a batch
+#-----------------------------------------------------------------------
+# open_port(port) opens a serial port, read_config(cm, port=...) sends a
+# frame on it.  Returns the number of jobs done, skipped and failed.
+def run_batch(jobfile, open_port, read_config, report=print,
+              resume=False, workers=WORKERS):
+    journal_name = jobfile + '.journal'
+    done = finished_jobs(journal_name) if resume else set()
+    journal = BatchJournal(journal_name)
+    journal.write({'state': 'batch_resume' if resume else 'batch_start', 'jobfile': jobfile})
+    counts = {'done': 0, 'skipped': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def finish(key, state, text):
+        with lock:
+            counts[state] += 1
+        if state != 'skipped':
+            journal.write({'job': key, 'state': 'job_' + state, 'result': text})
+        report('{0} - {1}'.format(key.split('|')[0], text))
+
+    # load and check every target before touching a controller
+    ports = OrderedDict()
+    for port, target in read_jobs(jobfile):
+        try:
+            targets = load_targets(target)
+        except (OSError, ValueError, KeyError, TypeError, BundleError) as e:
+            finish(port + '|' + target, 'failed', 'could not load {0} - {1}'.format(target, e))
+            continue
+        key = job_key(port, targets)
+        errors = validate_config(targets['basic'], targets['pas'], targets['throttle'])
+        if errors:
+            finish(key, 'failed', '{0} failed validation'.format(target))
+        elif key in done:
+            finish(key, 'skipped', '{0} already written'.format(target))
+        else:
+            ports.setdefault(port, []).append([key, target, targets])
+
+    def run_port(port):
+        try:
+            ser = open_port(port)
+        except Exception as e:
+            for key, target, targets in ports[port]:
+                finish(key, 'failed', 'could not open port - {0}'.format(e))
+            return
+        try:
+            send = lambda cm, length=None: read_config(cm, length, port=ser)
+            get_config = port_config(send, ports[port][0][2])
+            for key, target, targets in ports[port]:
+                journal.write({'job': key, 'state': 'job_start', 'target': target})
+                try:
+                    ok = write_transaction(targets, get_config, send,
+                                           lambda text: report('{0} - {1}'.format(port, text)),
+                                           JobJournal(journal, key), key)
+                except Exception as e:
+                    ok = False
+                    report('{0} - {1}'.format(port, e))
+                if ok:
+                    finish(key, 'done', '{0} written'.format(target))
+                else:
+                    finish(key, 'failed', '{0} not written'.format(target))
+        finally:
+            ser.close()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(ports)))) as pool:
+            list(pool.map(run_port, ports))
+    finally:
+        try:
+            journal.write({'state': 'batch_end', 'done': counts['done'],
+                           'skipped': counts['skipped'], 'failed': counts['failed']})
+            report('{0} journal entries in {1} syncs...'.format(journal.queued, journal.syncs))
+        finally:
+            journal.close()
+    return counts['done'], counts['skipped'], counts['failed']
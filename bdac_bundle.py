@@ -0,0 +1,276 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Config bundles (.bdacb), many named configs in one file.  Anywhere bdac
+# takes a .bdac file it also takes bundle.bdacb#name, --report, --write,
+# --watch, --batch job files and the GUI "Read File".
+#
+# A bundle is only ever appended to:
+#
+#   header   b'BDACB\x00\x01\n'
+#   dict     b'BDIC', length, crc32, json of the first config added
+#   record   b'BREC', name length, data length, crc32, stamp, name, data
+#   ...      data is the config's json, zlib compressed on its own with
+#            the first config as preset dictionary, the descriptions
+#            every config repeats then cost next to nothing
+#   index    b'BIDX', length, crc32, zlib json {name: [offset, stamp]}
+#   trailer  b'BEND', index offset
+#
+# Adding configs writes their records after the old index, then a new
+# index and trailer, the old index is left in place.  A later record of
+# the same name replaces the earlier one.  Opening reads the trailer and
+# the index, after that a config is found by name with one dictionary
+# lookup and one read.  A bundle whose trailer is missing or torn, from
+# a crash while adding, is opened by scanning its records instead.
+#
+# The index is read again whenever the file's size or modification time
+# changed, another process added to it.  Adding holds an exclusive flock
+# on the file, so two processes adding at once take turns.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import zlib
+import fcntl
+import struct
+
+from collections import OrderedDict
+
+EXTENSION = '.bdacb'
+HEADER = b'BDACB\x00\x01\n'
+RECORD = struct.Struct('<4sHIId')       # magic, name len, data len, crc, stamp
+INDEX = struct.Struct('<4sII')          # magic, length, crc of a block
+TRAILER = struct.Struct('<4sQ')         # magic, index offset
+
+class BundleError(Exception):
+    pass
+
+#-----------------------------------------------------------------------
+# "bundle.bdacb#name" -> (bundle, name), anything else -> (None, source)
+#-----------------------------------------------------------------------
+def split_source(source):
+    bundle, sep, name = source.rpartition('#')
+    if sep and bundle.endswith(EXTENSION):
+        return bundle, name
+    return None, source
+
+def encode_config(fd, zdict=None):
+    c = zlib.compressobj(9, zdict=zdict) if zdict else zlib.compressobj(9)
+    return c.compress(json.dumps(fd).encode()) + c.flush()
+
+def decode_config(data, zdict=None):
+    d = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+    return json.loads((d.decompress(data) + d.flush()).decode(), object_pairs_hook=OrderedDict)
+
+class Bundle():
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = None       # name -> [record offset, stamp]
+        self.end = None         # where the next record goes
+        self.zdict = None
+        self.state = None       # size and modification time when loaded
+
+    def stat(self):
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    # load, or load again when the file changed since
+    def refresh(self):
+        if self.index is None or self.stat() != self.state:
+            self.load()
+
+    #-------------------------------------------------------------------
+    # Read the index from the trailer, or rebuild it from the records
+    #-------------------------------------------------------------------
+    def load(self):
+        self.index = OrderedDict()
+        self.state = self.stat()
+        try:
+            f = open(self.filename, 'rb')
+        except FileNotFoundError:
+            self.end = None
+            return
+        with f:
+            head = f.read(len(HEADER))
+            if not head:
+                self.end = None     # created by an add that did not get far
+                return
+            if head != HEADER:
+                raise BundleError('{0} is not a config bundle'.format(self.filename))
+            self.zdict = self.read_block(f, b'BDIC')
+            if self.zdict is None:
+                raise BundleError('{0} has no dictionary'.format(self.filename))
+            size = f.seek(0, os.SEEK_END)
+            if size >= len(HEADER) + TRAILER.size:
+                f.seek(size - TRAILER.size)
+                magic, offset = TRAILER.unpack(f.read(TRAILER.size))
+                if magic == b'BEND' and len(HEADER) <= offset < size:
+                    f.seek(offset)
+                    index = self.read_block(f, b'BIDX')
+                    if index is not None:
+                        self.index = decode_config(index)
+                        self.end = size
+                        return
+            for name, offset, stamp, data in self.scan(f):
+                self.index[name] = [offset, stamp]
+            self.end = f.tell()
+
+    def read_block(self, f, want):
+        head = f.read(INDEX.size)
+        if len(head) < INDEX.size:
+            return None
+        magic, length, crc = INDEX.unpack(head)
+        data = f.read(length)
+        if magic != want or len(data) < length or zlib.crc32(data) != crc:
+            return None
+        return data
+
+    #-------------------------------------------------------------------
+    # Every good record in file order, stops at the first torn one
+    #-------------------------------------------------------------------
+    def scan(self, f):
+        f.seek(len(HEADER))
+        while True:
+            offset = f.tell()
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                f.seek(offset)
+                return
+            if head[:4] in (b'BIDX', b'BDIC'):
+                magic, length, crc = INDEX.unpack(head[:INDEX.size])
+                f.seek(offset + INDEX.size + length)
+                continue
+            if head[:4] == b'BEND':
+                f.seek(offset + TRAILER.size)
+                continue
+            magic, name_len, data_len, crc, stamp = RECORD.unpack(head)
+            name = f.read(name_len)
+            data = f.read(data_len)
+            if magic != b'BREC' or len(data) < data_len or zlib.crc32(data) != crc:
+                f.seek(offset)
+                return
+            yield name.decode(), offset, stamp, data
+
+    def names(self):
+        self.refresh()
+        return list(self.index)
+
+    def stamp(self, name):
+        self.refresh()
+        return self.index[name][1]
+
+    #-------------------------------------------------------------------
+    # One config by name
+    #-------------------------------------------------------------------
+    def get(self, name):
+        self.refresh()
+        if name not in self.index:
+            raise KeyError('{0} is not in {1}'.format(name, self.filename))
+        with open(self.filename, 'rb') as f:
+            f.seek(self.index[name][0])
+            magic, name_len, data_len, crc, stamp = RECORD.unpack(f.read(RECORD.size))
+            f.seek(name_len, os.SEEK_CUR)
+            data = f.read(data_len)
+        if magic != b'BREC' or zlib.crc32(data) != crc:
+            raise BundleError('{0} is damaged in {1}'.format(name, self.filename))
+        return decode_config(data, self.zdict)
+
+    #-------------------------------------------------------------------
+    # Stream (name, stamp, config) for the current version of every
+    # config, in the order they were added
+    #-------------------------------------------------------------------
+    def records(self):
+        self.refresh()
+        current = set(offset for offset, stamp in self.index.values())
+        try:
+            f = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            for name, offset, stamp, data in self.scan(f):
+                if offset in current:
+                    yield name, stamp, decode_config(data, self.zdict)
+
+    #-------------------------------------------------------------------
+    # Append (name, config) or (name, config, stamp) items
+    #-------------------------------------------------------------------
+    def add(self, items):
+        items = list(items)
+        if not items:
+            return
+        with open(os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            # what was added before the lock was ours counts
+            self.refresh()
+            if self.end is None:
+                self.zdict = json.dumps(items[0][1]).encode()
+                f.write(HEADER)
+                f.write(INDEX.pack(b'BDIC', len(self.zdict), zlib.crc32(self.zdict)))
+                f.write(self.zdict)
+                self.end = f.tell()
+            # anything after the last good record is a torn append
+            f.seek(self.end)
+            f.truncate()
+            index = OrderedDict(self.index)
+            for item in items:
+                name, fd = item[0], item[1]
+                stamp = item[2] if len(item) > 2 else time.time()
+                data = encode_config(fd, self.zdict)
+                raw = name.encode()
+                index[name] = [f.tell(), stamp]
+                f.write(RECORD.pack(b'BREC', len(raw), len(data), zlib.crc32(data), stamp))
+                f.write(raw)
+                f.write(data)
+            offset = f.tell()
+            data = encode_config(index)
+            f.write(INDEX.pack(b'BIDX', len(data), zlib.crc32(data)))
+            f.write(data)
+            f.write(TRAILER.pack(b'BEND', offset))
+            f.flush()
+            os.fsync(f.fileno())
+            self.end = f.tell()
+            self.index = index
+            self.state = self.stat()
+
+#-----------------------------------------------------------------------
+# Load a config from a .bdac file or bundle.bdacb#name
+#-----------------------------------------------------------------------
+# Bundles stay open between calls so provisioning from one only reads
+# its index again when the file changed.
+bundles = dict()
+
+def open_bundle(filename):
+    bundle = bundles.get(filename)
+    if bundle is None:
+        bundle = bundles[filename] = Bundle(filename)
+    return bundle
+
+def load_config(source):
+    bundle, name = split_source(source)
+    if bundle is not None:
+        return open_bundle(bundle).get(name)
+    with open(source, 'r') as f:
+        return json.load(f)
+
+# A bundle as the list of sources in it, anything else as it is
+def expand_source(path):
+    if path.endswith(EXTENSION) and os.path.isfile(path):
+        return ['{0}#{1}'.format(path, name) for name in open_bundle(path).names()]
+    return [path]
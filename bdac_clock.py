@@ -0,0 +1,83 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Clocks.  bdac and the GUI do their waiting and time stamping through a
+# clock object instead of calling time directly.  Clock is the real one,
+# VirtualClock keeps its own time which sleep() moves forward at once, so
+# a whole read, edit and write session against bdac_standin runs without
+# waiting.  Time stamps follow the virtual time.
+#
+# Only waits go through the clock.  How long the serial port took to
+# answer (bdac_metrics, bdac_timing) is still measured on the real clock.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import datetime
+import threading
+
+class Clock():
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def localtime(self):
+        return time.localtime(self.time())
+
+    def strftime(self, fmt):
+        return time.strftime(fmt, self.localtime())
+
+    def today(self):
+        return datetime.datetime.fromtimestamp(self.time())
+
+#-----------------------------------------------------------------------
+# Clock that only moves when something sleeps on it
+#-----------------------------------------------------------------------
+# start is the wall time to begin at, now if not given.  slept is the
+# total time skipped, sleeps counts the calls.
+class VirtualClock(Clock):
+
+    def __init__(self, start=None):
+        self.lock = threading.Lock()
+        self.start = time.time() if start is None else start
+        self.elapsed = 0.0
+        self.slept = 0.0
+        self.sleeps = 0
+
+    def time(self):
+        with self.lock:
+            return self.start + self.elapsed
+
+    def monotonic(self):
+        with self.lock:
+            return self.elapsed
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.sleeps += 1
+            if seconds > 0:
+                self.elapsed += seconds
+                self.slept += seconds
+
+    def advance(self, seconds):
+        with self.lock:
+            self.elapsed += seconds
+
+clock = Clock()
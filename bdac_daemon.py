@@ -0,0 +1,371 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# bdacd - keeps the serial port open and the controller areas cached and
+# serves them to any number of local clients over a UNIX socket.  Only
+# the serial thread ever touches the port, every client request goes
+# through the command scheduler (bdac_scheduler.py) so writes go first,
+# then config reads, and telemetry polls only use the idle line.
+#
+# Requests and replies are one JSON object per line:
+#   {"cmd": "info"}                          controller INFO fields
+#   {"cmd": "read", "area": "pas"}           cached area, "refresh": true re-reads
+#   {"cmd": "write", "area": "pas", "values": {"SC": 20}}
+#   {"cmd": "send", "frame": "1152", "length": null}   raw command, hex
+#   {"cmd": "subscribe", "interval": 1.0}    telemetry lines until disconnect
+#   {"cmd": "stats"}                         scheduler runs and queue waits
+# Every reply has "ok" and, when it is false, "error".
+#
+# Cached areas are dropped after CACHE_TIME seconds and whenever the INFO
+# reply changes, another controller on the port.  A raw area read or INFO
+# always goes to the controller, that is how a client's write transaction
+# takes its snapshot, and a raw area write is validated like a "write".
+# Only one bdacd serves a socket, a second one started on it refuses.
+#
+# Given a telemetry ring (bdac_ring.py) bdacd also polls telemetry every
+# ring_interval seconds and publishes each poll into it for local readers.
+# Given a detector (bdac_anomaly.py) every poll is also checked for
+# anomalies, the detector reports its own events.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import socketserver
+
+from collections import OrderedDict
+from bdac_frames import area_dict, build_frame, decode_frame
+from bdac_validate import validate_area
+from bdac_scheduler import Scheduler, WRITE, CONFIG, TELEMETRY
+
+SOCKET = '/tmp/bdacd.sock'
+CACHE_TIME = 30.0       # seconds an area read is served from the cache
+
+INFO_CMD = b'\x11\x51\x04\xb0\x05'
+READ_CMD = 0x11
+WRITE_CMD = 0x16
+
+section_area = dict((v[0], k) for k, v in area_dict.items())
+
+#-----------------------------------------------------------------------
+# Decode the INFO response, see get_info_config in bdac.py
+#-----------------------------------------------------------------------
+def info_fields(resp):
+    volts_list = [24, 36, 48, 60]
+    info = OrderedDict()
+    if len(resp) < 18:
+        return info
+    text = resp[2:16].decode('ascii', 'replace')
+    info['manufacturer'] = text[0:4]
+    info['model'] = text[4:8]
+    info['hardware'] = '{0}.{1}'.format(text[8], text[9])
+    info['firmware'] = '.'.join(text[10:14])
+    info['voltage'] = volts_list[resp[16]] if resp[16] < len(volts_list) else resp[16]
+    info['max_current'] = resp[17]
+    return info
+
+#-----------------------------------------------------------------------
+# Scheduler priority of a raw frame, and the key that lets identical
+# status polls from several clients share one serial command
+#-----------------------------------------------------------------------
+def send_priority(frame, length):
+    if len(frame) > 2 and frame[0] == WRITE_CMD:
+        return WRITE, None
+    if len(frame) >= 2 and frame[0] == READ_CMD and (frame[1] in section_area or frame == INFO_CMD):
+        return CONFIG, None
+    return TELEMETRY, (frame.hex(), length)
+
+class Bdacd():
+
+    def __init__(self, get_config, read_config, get_telemetry, socket_path=SOCKET,
+                 ring=None, ring_interval=1.0, detector=None):
+        self.get_config = get_config
+        self.read_config = read_config
+        self.get_telemetry = get_telemetry
+        self.socket_path = socket_path
+        self.scheduler = Scheduler()
+        self.telemetry_job = None
+        self.state = dict()         # area -> cached [value, description] dictionary
+        self.stamps = dict()        # area -> when it was read
+        self.info = None
+        self.info_stamp = 0.0
+        self.lock = threading.Lock()
+        self.subscribers = []       # [queue, interval, last poll]
+        self.ring = ring
+        self.ring_interval = ring_interval
+        self.ring_poll = 0.0
+        self.detector = detector
+        self.running = False
+        self.server = None
+
+    #-------------------------------------------------------------------
+    # Run func on the serial thread and wait for its result
+    #-------------------------------------------------------------------
+    def call(self, priority, func, *args, key=None):
+        return self.scheduler.call(priority, func, *args, key=key)
+
+    def serial_loop(self):
+        while self.running:
+            self.poll_telemetry()
+            job = self.scheduler.next(0.1)
+            if job is not None:
+                self.scheduler.run(job)
+
+    #-------------------------------------------------------------------
+    # Telemetry is only read while someone is subscribed, one poll
+    # serves every subscriber that is due
+    #-------------------------------------------------------------------
+    def poll_telemetry(self):
+        with self.lock:
+            now = time.monotonic()
+            due = any(now - s[2] >= s[1] for s in self.subscribers)
+            due = due or (self.ring is not None and now - self.ring_poll >= self.ring_interval)
+        if due and (self.telemetry_job is None or self.telemetry_job.done.is_set()):
+            self.telemetry_job = self.scheduler.submit(TELEMETRY, self.do_telemetry, key='telemetry')
+
+    def do_telemetry(self):
+        telemetry = self.get_telemetry()
+        telemetry['time'] = time.time()
+        if self.detector is not None:
+            self.detector.observe(telemetry)
+        with self.lock:
+            now = time.monotonic()
+            if self.ring is not None:
+                self.ring_poll = now
+                self.ring.publish(telemetry)
+            for s in self.subscribers:
+                if now - s[2] >= s[1]:
+                    s[2] = now
+                    if not s[0].full():
+                        s[0].put(telemetry)
+        return telemetry
+
+    #-------------------------------------------------------------------
+    # Operations, these only ever run on the serial thread
+    #-------------------------------------------------------------------
+    def do_read(self, area, refresh=False):
+        if refresh or area not in self.state or time.monotonic() - self.stamps[area] > CACHE_TIME:
+            self.state[area] = self.get_config[area]().copy()
+            self.stamps[area] = time.monotonic()
+        return self.state[area]
+
+    # a different INFO reply is a different controller, nothing cached
+    # for the last one is kept
+    def do_info(self, refresh=False):
+        if refresh or self.info is None or time.monotonic() - self.info_stamp > CACHE_TIME:
+            info = self.read_config(INFO_CMD)
+            if info != self.info:
+                self.state.clear()
+            self.info = info
+            self.info_stamp = time.monotonic()
+        return self.info
+
+    def do_send(self, frame, length=None):
+        # a read response has the same layout as a write frame without
+        # the leading write command
+        if len(frame) == 2 and frame[0] == READ_CMD and frame[1] in section_area:
+            return build_frame(section_area[frame[1]], self.do_read(section_area[frame[1]], True))[1:]
+        if frame == INFO_CMD:
+            return self.do_info(True)
+        if len(frame) > 2 and frame[0] == WRITE_CMD and frame[1] in section_area:
+            area = section_area[frame[1]]
+            dic = decode_frame(area, frame[1:], self.do_read(area))
+            if dic is None or frame[2] != area_dict[area][1]:
+                raise ValueError('Malformed {0} write frame'.format(area_dict[area][2]))
+            errors = validate_area(area, dic)
+            if errors:
+                raise ValueError('; '.join(errors))
+            self.state.pop(area, None)
+        return self.read_config(frame, length)
+
+    def do_write(self, area, values):
+        dic = OrderedDict((k, list(v)) for k, v in self.do_read(area).items())
+        for key, val in values.items():
+            if key not in dic:
+                raise ValueError('{0} is not in the {1} area'.format(key, area_dict[area][2]))
+            dic[key][0] = val
+        errors = validate_area(area, dic)
+        if errors:
+            raise ValueError('; '.join(errors))
+        self.state.pop(area, None)
+        resp = self.read_config(build_frame(area, dic))
+        if len(resp) < 2 or resp[1] != area_dict[area][1]:
+            raise ValueError('Controller refused {0} write, response {1}'.format(
+                area_dict[area][2], resp.hex()))
+        self.state[area] = dic
+        self.stamps[area] = time.monotonic()
+        return dic
+
+    #-------------------------------------------------------------------
+    # One request from a client
+    #-------------------------------------------------------------------
+    def handle(self, request):
+        cmd = request.get('cmd')
+        area = request.get('area')
+        if cmd in ('read', 'write') and area not in area_dict:
+            raise ValueError('Unknown area {0}'.format(area))
+        if cmd == 'info':
+            return {'info': info_fields(self.call(CONFIG, self.do_info))}
+        if cmd == 'read':
+            return {'area': area, 'values': self.call(CONFIG, self.do_read, area, bool(request.get('refresh')))}
+        if cmd == 'write':
+            return {'area': area, 'values': self.call(WRITE, self.do_write, area, request.get('values', {}))}
+        if cmd == 'send':
+            frame = bytes.fromhex(request['frame'])
+            priority, key = send_priority(frame, request.get('length'))
+            return {'resp': self.call(priority, self.do_send, frame, request.get('length'), key=key).hex()}
+        if cmd == 'stats':
+            return {'stats': self.scheduler.stats()}
+        raise ValueError('Unknown command {0}'.format(cmd))
+
+    def subscribe(self, interval):
+        sub = [queue.Queue(maxsize=100), max(float(interval), 0.1), 0.0]
+        with self.lock:
+            self.subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            if sub in self.subscribers:
+                self.subscribers.remove(sub)
+
+    #-------------------------------------------------------------------
+    # Start the serial thread and serve the socket until stopped
+    #-------------------------------------------------------------------
+    def serve(self):
+        # a socket file left by a bdacd that died is removed, one that
+        # still answers belongs to a running bdacd
+        if os.path.exists(self.socket_path):
+            other = connect_daemon(self.socket_path)
+            if other is not None:
+                other.close()
+                raise OSError('another bdacd is serving {0}'.format(self.socket_path))
+            os.unlink(self.socket_path)
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                        if request.get('cmd') == 'subscribe':
+                            daemon.stream(self.wfile, request.get('interval', 1.0))
+                            return
+                        reply = daemon.handle(request)
+                        reply['ok'] = True
+                    except Exception as e:
+                        reply = {'ok': False, 'error': str(e)}
+                    self.wfile.write((json.dumps(reply) + '\n').encode())
+                    self.wfile.flush()
+
+        self.running = True
+        thread = threading.Thread(target=self.serial_loop, daemon=True)
+        thread.start()
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.server.daemon_threads = True
+        os.chmod(self.socket_path, 0o660)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.running = False
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def stream(self, wfile, interval):
+        sub = self.subscribe(interval)
+        try:
+            while True:
+                telemetry = sub[0].get()
+                telemetry['ok'] = True
+                wfile.write((json.dumps(telemetry) + '\n').encode())
+                wfile.flush()
+        except OSError:
+            pass    # client went away
+        finally:
+            self.unsubscribe(sub)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+#-----------------------------------------------------------------------
+# Client, looks enough like a Serial port for bdac.py to use it
+#-----------------------------------------------------------------------
+# read_config() calls transact() directly, write()/read() are there for
+# code that talks to the port itself, --record for one.  timeout is there
+# for them to set as they would a port's, bdacd keeps the controller's
+# deadlines and a request waits for its reply as long as the socket does.
+class DaemonSerial():
+
+    def __init__(self, socket_path=SOCKET, timeout=60):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.file = self.sock.makefile('rwb')
+        self.pending = b''
+        self.timeout = 1
+
+    def request(self, request):
+        self.file.write((json.dumps(request) + '\n').encode())
+        self.file.flush()
+        reply = json.loads(self.file.readline())
+        if not reply.get('ok'):
+            raise IOError(reply.get('error'))
+        return reply
+
+    def transact(self, cm, length=None):
+        return bytes.fromhex(self.request({'cmd': 'send', 'frame': bytes(cm).hex(),
+                                           'length': length})['resp'])
+
+    def write(self, cm):
+        self.pending = bytes(cm)
+        return len(cm)
+
+    def flush(self):
+        pass
+
+    def read(self, size):
+        resp = self.transact(self.pending)
+        self.pending = b''
+        return resp[:size]
+
+    def subscribe(self, interval=1.0):
+        self.file.write((json.dumps({'cmd': 'subscribe', 'interval': interval}) + '\n').encode())
+        self.file.flush()
+        self.sock.settimeout(None)
+        for line in self.file:
+            yield json.loads(line)
+
+    def close(self):
+        try:
+            self.file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+#-----------------------------------------------------------------------
+# Connect to a running bdacd, None if there is not one
+#-----------------------------------------------------------------------
+def connect_daemon(socket_path=SOCKET):
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        return DaemonSerial(socket_path)
+    except OSError:
+        return None
@@ -0,0 +1,297 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Fleet configuration store.  bdac --ingest loads .bdac files, settings
+# files and the time stamped snapshots saved after writing, into a
+# directory with one array per setting, one row per config:
+#
+#   fleet/index.json        rows, columns, bike names and sources
+#   fleet/basic.LC.npy      int16 values, -1 where a file lacks the field
+#   fleet/bike.npy          int32 index into the bike names
+#   fleet/stamp.npy         float64 seconds since the epoch
+#
+# The .npy files are opened memory mapped, a query only touches the
+# columns it names.  bdac --fleet answers with vectorized filters and
+# aggregates over the whole store at once.
+#
+# A bike is the controller identity saved in the file, the bike id given
+# with --bike or else the controller's INFO text.  Files saved before
+# identities were, or made by hand, fall back to the name, the adapter in
+# a snapshot's or the file name, and their bike is "name:" and that name
+# so it can not be taken for a real one.  The stamp is taken from a snapshot's name, otherwise the
+# file's modification time.  A file already ingested, same path and
+# modification time, is skipped.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import json
+import time
+import operator
+import numpy as np
+
+from collections import OrderedDict
+from bdac_validate import constraint_dict
+
+MISSING = -1
+INDEX = 'index.json'
+SNAPSHOT = re.compile(r'^([A-Z][a-z]{2}-\d\d-\d{4}-\d\d:\d\d:\d\d)(?:-(.+))?-config\.bdac$')
+
+# Columns in controller byte order, area.key
+FIELDS = OrderedDict(('{0}.{1}'.format(area, key), (area, key))
+                     for area in constraint_dict for key in constraint_dict[area])
+
+OPS = OrderedDict([('>=', operator.ge), ('<=', operator.le), ('!=', operator.ne),
+                   ('==', operator.eq), ('>', operator.gt), ('<', operator.lt),
+                   ('=', operator.eq)])
+
+#-----------------------------------------------------------------------
+# Bike name and stamp of a .bdac file, fd is its config
+#-----------------------------------------------------------------------
+def file_identity(filename, fd):
+    name = os.path.basename(filename)
+    m = SNAPSHOT.match(name)
+    if m:
+        stamp = time.mktime(time.strptime(m.group(1), '%b-%d-%Y-%H:%M:%S'))
+        fallback = m.group(2) or 'unknown'
+    else:
+        stamp = os.path.getmtime(filename)
+        fallback = os.path.splitext(name)[0]
+    controller = fd.get('controller')
+    if isinstance(controller, dict) and (controller.get('bike') or controller.get('info')):
+        return str(controller.get('bike') or controller.get('info')), stamp
+    return 'name:' + fallback, stamp
+
+def bdac_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for f in sorted(files):
+                    if f.endswith('.bdac'):
+                        yield os.path.join(root, f)
+        else:
+            yield path
+
+class FleetStore():
+
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+        self.columns = dict()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.path, INDEX)) as f:
+                self.index = json.load(f)
+        except OSError:
+            self.index = {'rows': 0, 'columns': list(FIELDS), 'bikes': [], 'sources': []}
+        self.columns = dict()
+
+    def __len__(self):
+        if self.index is None:
+            self.load()
+        return self.index['rows']
+
+    #-------------------------------------------------------------------
+    # A column as a read only array, fields may be given without the
+    # area when the name is only in one area (LC but not SL)
+    #-------------------------------------------------------------------
+    def column(self, name):
+        if self.index is None:
+            self.load()
+        if name not in self.index['columns'] and name not in ('bike', 'stamp', 'source'):
+            found = [c for c in self.index['columns'] if c.split('.')[1] == name]
+            if len(found) != 1:
+                raise KeyError('{0} is {1} column'.format(
+                               name, 'not a' if not found else 'more than one'))
+            name = found[0]
+        if name not in self.columns:
+            filename = os.path.join(self.path, name + '.npy')
+            if os.path.exists(filename):
+                self.columns[name] = np.load(filename, mmap_mode='r')[:len(self)]
+            else:
+                self.columns[name] = np.zeros(0, dtype=np.int16)
+        return self.columns[name]
+
+    #-------------------------------------------------------------------
+    # Rows matching every condition, like "LC>25" or "pas.SL==255"
+    #-------------------------------------------------------------------
+    def where(self, conditions=()):
+        mask = np.ones(len(self), dtype=bool)
+        for cond in conditions:
+            for op in OPS:
+                if op in cond:
+                    name, value = cond.split(op, 1)
+                    col = self.column(name.strip())
+                    mask &= (col != MISSING) & OPS[op](col, int(value, 0))
+                    break
+            else:
+                raise ValueError('{0} is not a condition'.format(cond))
+        return mask
+
+    # only the newest row of each bike
+    def latest(self, mask=None):
+        bike = self.column('bike')
+        stamp = self.column('stamp')
+        order = np.lexsort((stamp, bike))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = bike[order][1:] != bike[order][:-1]
+        newest = np.zeros(len(self), dtype=bool)
+        newest[order[last]] = True
+        return newest if mask is None else newest & mask
+
+    def count(self, mask):
+        return int(mask.sum()), int(len(np.unique(self.column('bike')[mask])))
+
+    def distribution(self, name, mask):
+        col = np.asarray(self.column(name)[mask])
+        values, counts = np.unique(col[col != MISSING], return_counts=True)
+        return OrderedDict((int(v), int(n)) for v, n in zip(values, counts))
+
+    def stats(self, name, mask):
+        col = np.asarray(self.column(name)[mask]).astype(np.float64)
+        col = col[col != MISSING]
+        if not len(col):
+            return None
+        return OrderedDict([('min', col.min()), ('mean', col.mean()),
+                            ('median', np.median(col)), ('max', col.max())])
+
+    def rows(self, mask):
+        bikes = self.index['bikes']
+        sources = self.index['sources']
+        source = self.column('source')
+        return [(bikes[self.column('bike')[i]], self.column('stamp')[i], sources[source[i]])
+                for i in np.flatnonzero(mask)]
+
+    #-------------------------------------------------------------------
+    # Add rows, every column is rewritten and the index last, so a store
+    # is never seen with some columns longer than the index says
+    #-------------------------------------------------------------------
+    def append(self, rows):
+        if not rows:
+            return
+        if self.index is None:
+            self.load()
+        os.makedirs(self.path, exist_ok=True)
+        bikes = self.index['bikes']
+        bike_code = dict((b, i) for i, b in enumerate(bikes))
+        sources = self.index['sources']
+        new = OrderedDict((name, np.full(len(rows), MISSING, dtype=np.int16)) for name in FIELDS)
+        new['bike'] = np.zeros(len(rows), dtype=np.int32)
+        new['stamp'] = np.zeros(len(rows), dtype=np.float64)
+        new['source'] = np.zeros(len(rows), dtype=np.int32)
+        for r, (bike, stamp, source, fd) in enumerate(rows):
+            if bike not in bike_code:
+                bike_code[bike] = len(bikes)
+                bikes.append(bike)
+            new['bike'][r] = bike_code[bike]
+            new['stamp'][r] = stamp
+            new['source'][r] = len(sources)
+            sources.append(source)
+            for name, (area, key) in FIELDS.items():
+                try:
+                    new[name][r] = int(fd[area][key][0])
+                except (KeyError, IndexError, TypeError, ValueError):
+                    pass
+        for name, values in new.items():
+            old = np.asarray(self.column(name))
+            filename = os.path.join(self.path, name + '.npy')
+            np.save(filename + '.tmp.npy', np.concatenate([old, values]))
+            os.replace(filename + '.tmp.npy', filename)
+        self.index['rows'] += len(rows)
+        with open(os.path.join(self.path, INDEX + '.tmp'), 'w') as f:
+            json.dump(self.index, f)
+        os.replace(os.path.join(self.path, INDEX + '.tmp'), os.path.join(self.path, INDEX))
+        self.load()
+
+#-----------------------------------------------------------------------
+# Ingest .bdac files and directories of them, returns the number of
+# configs added, already in the store and unreadable
+#-----------------------------------------------------------------------
+def ingest(store, paths, report=print):
+    if store.index is None:
+        store.load()
+    seen = set(store.index['sources'])
+    rows = []
+    skipped = 0
+    bad = 0
+    named = 0
+    for filename in bdac_files(paths):
+        try:
+            source = '{0}@{1}'.format(os.path.abspath(filename), int(os.path.getmtime(filename)))
+            if source in seen:
+                skipped += 1
+                continue
+            with open(filename) as f:
+                fd = json.load(f)
+            bike, stamp = file_identity(filename, fd)
+        except (OSError, ValueError, AttributeError) as e:
+            report('Could not ingest {0} - {1}'.format(filename, e))
+            bad += 1
+            continue
+        seen.add(source)
+        rows.append((bike, stamp, source, fd))
+        named += bike.startswith('name:')
+    store.append(rows)
+    if named:
+        report('{0} configs have no controller identity, their bike is taken from the file name'.format(named))
+    return len(rows), skipped, bad
+
+#-----------------------------------------------------------------------
+# Answer a query for bdac --fleet
+#-----------------------------------------------------------------------
+# words are conditions (LC>25) and at most one of: count (the default),
+# dist:<field>, stats:<field>, list.  latest keeps each bike's newest
+# config only.
+def query_lines(store, words):
+    action = 'count'
+    conditions = []
+    latest = False
+    for word in words:
+        if word in ('count', 'list') or word.startswith(('dist:', 'stats:')):
+            action = word
+        elif word == 'latest':
+            latest = True
+        else:
+            conditions.append(word)
+    start = time.perf_counter()
+    mask = store.where(conditions)
+    if latest:
+        mask = store.latest(mask)
+    lines = []
+    if action == 'count':
+        configs, bikes = store.count(mask)
+        lines.append('{0} configs from {1} bikes match'.format(configs, bikes))
+    elif action == 'list':
+        for bike, stamp, source in store.rows(mask):
+            lines.append('{0:<24} {1}  {2}'.format(
+                bike, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stamp)),
+                source.rsplit('@', 1)[0]))
+    elif action.startswith('dist:'):
+        dist = store.distribution(action[5:], mask)
+        total = max(sum(dist.values()), 1)
+        for value, n in dist.items():
+            lines.append('{0:>5} {1:>7} {2:5.1f}% {3}'.format(
+                value, n, 100.0 * n / total, '#' * int(round(40.0 * n / total))))
+    else:
+        stats = store.stats(action[6:], mask)
+        if stats is None:
+            lines.append('No values')
+        else:
+            lines.append('  '.join('{0} {1:.1f}'.format(k, v) for k, v in stats.items()))
+    lines.append('{0} of {1} configs in {2:.1f}ms...'.format(
+                 int(mask.sum()), len(store), (time.perf_counter() - start) * 1000))
+    return lines
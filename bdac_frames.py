@@ -0,0 +1,115 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Encoding of BASIC, PAS and THROTTLE write frames with a shared cache,
+# so the same .bdac file sent to many controllers is only encoded once.
+# Cache hits and misses are counted in bdac_metrics.
+# Area read replies are checked here before anything is taken from them.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import threading
+
+from collections import OrderedDict
+from bdac_metrics import metrics
+
+WRITE_CMD = 0x16
+
+# Controller areas - [section byte, data length, display name]
+area_dict = OrderedDict()
+area_dict['basic'] = [0x52, 0x18, 'BASIC']
+area_dict['pas'] = [0x53, 0x0b, 'PAS']
+area_dict['throttle'] = [0x54, 0x06, 'THROTTLE']
+
+#-----------------------------------------------------------------------
+# Build a write frame (b'\x16' + section + length + data + checksum)
+#-----------------------------------------------------------------------
+def encode_frame(area, dic):
+    section, length, name = area_dict[area]
+    data = bytes(dic[key][0] for key in dic)
+    checksum = (section + length + sum(data)) % 256
+    return bytes((WRITE_CMD, section, length)) + data + bytes((checksum,))
+
+#-----------------------------------------------------------------------
+# An area read reply must hold the whole area and add up, the checksum
+# is the sum of every byte before it
+#-----------------------------------------------------------------------
+class ReplyError(IOError):
+    pass
+
+def check_reply(area, resp):
+    section, length, name = area_dict[area]
+    if not resp:
+        raise ReplyError('No response reading {0} area'.format(name))
+    if len(resp) < length + 3 or resp[0] != section or resp[1] != length:
+        raise ReplyError('Short or garbled reply reading {0} area'.format(name))
+    if sum(resp[:length + 2]) % 256 != resp[length + 2]:
+        raise ReplyError('Bad checksum reading {0} area'.format(name))
+    return resp
+
+#-----------------------------------------------------------------------
+# Decode an area read response (section + length + data + checksum)
+#-----------------------------------------------------------------------
+# Values are taken byte for byte in the order of template's keys, the
+# descriptions are kept from template.  None if the response is short.
+def decode_frame(area, resp, template):
+    section, length, name = area_dict[area]
+    if len(resp) < length + 2 or resp[0] != section:
+        return None
+    dic = OrderedDict()
+    for key, val in zip(template, resp[2:2 + length]):
+        dic[key] = [val, template[key][1]]
+    return dic
+
+#-----------------------------------------------------------------------
+# Content hash of an area, only the values count, not the descriptions
+#-----------------------------------------------------------------------
+def content_hash(area, dic):
+    h = hashlib.sha1(area.encode())
+    for key in dic:
+        h.update(key.encode())
+        h.update(bytes((dic[key][0],)))
+    return h.hexdigest()
+
+#-----------------------------------------------------------------------
+# Frame cache shared by every thread in the process
+#-----------------------------------------------------------------------
+# Frames are stored by area and the values that go in them, a dictionary
+# edited in place or read again simply finds another frame or the same.
+class FrameCache():
+
+    def __init__(self, max_frames=256):
+        self.lock = threading.Lock()
+        self.max_frames = max_frames
+        self.frames = OrderedDict()
+
+    def frame(self, area, dic):
+        key = (area, tuple(dic[k][0] for k in dic))
+        with self.lock:
+            frame = self.frames.get(key)
+            hit = frame is not None
+            if hit:
+                self.frames.move_to_end(key)
+            else:
+                frame = self.frames[key] = encode_frame(area, dic)
+                if len(self.frames) > self.max_frames:
+                    self.frames.popitem(last=False)
+        metrics.frame_cache(hit)
+        return frame
+
+frame_cache = FrameCache()
+
+def build_frame(area, dic):
+    return frame_cache.frame(area, dic)
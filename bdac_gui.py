@@ -25,11 +25,18 @@ import datetime
 
 sys.path.append('/usr/local/share/bdac')
 
-from time import sleep
 from serial import Serial, SerialException
 from collections import OrderedDict
 from binascii import hexlify
 from bdac_help import help_dict
+from bdac_validate import check_value, validate_config
+from bdac_trace import tracer, TracedWindow
+from bdac_clock import Clock
+from bdac_bundle import load_config
+from bdac_anomaly import Detector
+from bdac_ring import RingReader
+from bdac_session import Session, open_session, area_copy
+from bdac_wear import snapshot_identity
 
 CURSOR_INVISIBLE = 0    # no cursor
 CURSOR_NORMAL = 1       # Underline cursor
@@ -49,20 +56,65 @@ class BdacTerm():
                        test_data,
                        PORT,
                        VERSION,
-                       VERSION_DATE):
+                       VERSION_DATE,
+                       clock=None,
+                       get_telemetry=None,
+                       log_event=None,
+                       open_port=None,
+                       bike=None):
 
         self.screen = None
         self.port = PORT
         self.version = VERSION
         self.version_date = VERSION_DATE
         self.test_data = test_data
-        self.basic_dict = basic_dict
-        self.pas_dict = pas_dict
-        self.throttle_dict = throttle_dict
+        # the port opened at start up is the first session, more are
+        # added from the menu, open_port(name) opens one
+        dicts = OrderedDict([('basic', basic_dict), ('pas', pas_dict), ('throttle', throttle_dict)])
+        get_config = OrderedDict([('basic', get_basic_config), ('pas', get_pas_config),
+                                  ('throttle', get_throttle_config)])
+        self.sessions = [Session(PORT, get_config, read_config, dicts, test_data=test_data,
+                                 bike=bike)]
+        self.current = 0
+        self.open_port = open_port
         self.get_basic_config = get_basic_config
         self.get_pas_config = get_pas_config
         self.get_throttle_config = get_throttle_config
         self.read_config = read_config
+        self.report_y = 13
+        self.clock = clock if clock is not None else Clock()
+        self.get_telemetry = get_telemetry
+        self.log_event = log_event
+        self.detector = Detector()
+
+    # the dictionaries being edited are the current session's
+    @property
+    def session(self):
+        return self.sessions[self.current]
+
+    @property
+    def basic_dict(self):
+        return self.session.dicts['basic']
+
+    @basic_dict.setter
+    def basic_dict(self, dic):
+        self.session.dicts['basic'] = dic
+
+    @property
+    def pas_dict(self):
+        return self.session.dicts['pas']
+
+    @pas_dict.setter
+    def pas_dict(self, dic):
+        self.session.dicts['pas'] = dic
+
+    @property
+    def throttle_dict(self):
+        return self.session.dicts['throttle']
+
+    @throttle_dict.setter
+    def throttle_dict(self, dic):
+        self.session.dicts['throttle'] = dic
 
     def setup_screen(self):
         self.cur = curses.initscr()  # Initialize curses.
@@ -102,6 +154,8 @@ class BdacTerm():
         curses.nonl()
         self.cur.refresh()
         self.screen = curses.newwin(28,88,self.X0, self.Y0)
+        if tracer.enabled:
+            self.screen = TracedWindow(self.screen)
         self.screen.refresh()
         self.screen.nodelay(1)
         self.screen.keypad(1)
@@ -149,29 +203,32 @@ class BdacTerm():
               'Edit Pedal Assist Configuration', 
               'Edit Throttle Configuration', 
               'Write Controller Flash',
+              'Copy Config To All Controllers',
               'Read File', 
               'Save File',
               'View Report', 
+              'Simulate PAS',
+              'Live Telemetry',
+              'Add Controller',
               'Quit']
 
-        popup = curses.newwin(14, 50, 8, 20)
+        popup = curses.newwin(17, 50, 7, 20)
         popup.attrset(curses.color_pair(0))
         for i in range(len(cl)):
             popup.addstr(i + 3, 9, cl[i], curses.color_pair(0))
-            popup.addstr(12, 11, "<Enter> to select, 'q' quits", curses.color_pair(0) | curses.A_BOLD)
+        if len(self.sessions) > 1:
+            popup.addstr(15, 3, "<Enter> selects, <Tab> controller, 'q' quits", curses.color_pair(0) | curses.A_BOLD)
+        else:
+            popup.addstr(15, 11, "<Enter> to select, 'q' quits", curses.color_pair(0) | curses.A_BOLD)
         #popup.border('|', '|', '-', '-', '+', '+', '+', '+')
         popup.box()
         popup.addstr(0, 16, '[Select Function]', curses.color_pair(0) | curses.A_BOLD)
         popup.nodelay(0)
         popup.keypad(1)
         curses.curs_set(0)
+        self.show_sessions(popup)
         popup.refresh()
 
-        if config_changed:
-            self.screen.addstr(27,2,'Alert:', curses.color_pair(0) | curses.A_BLINK)
-            self.screen.addstr(27,9,'Your Configuration has changed, consider saving or writing to flash...')
-            self.screen.refresh()
-
         # get the index to place the cursor
         idx = 0
         popup.addstr(idx + 3, 9, cl[idx], curses.color_pair(0) | curses.A_REVERSE)
@@ -190,6 +247,15 @@ class BdacTerm():
                     popup.addstr(idx + 3, 9, cl[idx], curses.color_pair(0) | curses.A_REVERSE)
                 popup.refresh()
 
+            elif curses.keyname(c) == b'^I' or (chr(c).isdigit() and 0 < int(chr(c)) <= len(self.sessions)):
+                # another controller, everything it needs is already read
+                if curses.keyname(c) == b'^I':
+                    self.current = (self.current + 1) % len(self.sessions)
+                else:
+                    self.current = int(chr(c)) - 1
+                self.show_sessions(popup)
+                popup.refresh()
+
             elif curses.keyname(c) == b'^M':
                 self.screen.touchwin()
                 self.screen.refresh()
@@ -202,74 +268,126 @@ class BdacTerm():
                 curses.curs_set(1)
                 return (None)
 
+    # tab line of the sessions, the current one highlighted and changed
+    # ones marked, and the alert for the current one
+    def show_sessions(self, popup):
+        if len(self.sessions) > 1:
+            popup.move(1, 1)
+            popup.clrtoeol()
+            x = 2
+            for i, session in enumerate(self.sessions):
+                tab = ' {0}:{1}{2} '.format(i + 1, session.label(), '*' if session.config_changed else '')
+                if x + len(tab) > 48:
+                    break
+                popup.addstr(1, x, tab, curses.A_REVERSE if i == self.current else curses.A_NORMAL)
+                x += len(tab)
+            popup.box()
+            popup.addstr(0, 16, '[Select Function]', curses.color_pair(0) | curses.A_BOLD)
+        self.screen.move(27, 0)
+        self.screen.clrtoeol()
+        if self.session.config_changed:
+            self.screen.addstr(27,2,'Alert:', curses.color_pair(0) | curses.A_BLINK)
+            self.screen.addstr(27,9,'Your Configuration has changed, consider saving or writing to flash...')
+        self.screen.refresh()
+
+    # read controller flash only once per session
+    def read_flash(self):
+        self.screen.erase()
+        self.screen.addstr(12,10, "Reading the controller flash areas.....", curses.A_BLINK)
+        self.screen.refresh()
+        self.report_y = 13
+        if self.wait(self.session.read_all) is None:
+            return False
+        with tracer.span('sleep', 'sleep'):
+            self.clock.sleep(1.5)
+        return True
+
+    # run a session job, its progress lines go on the screen as they
+    # come, returns its result or None when it failed
+    def wait(self, start, session=None):
+        session = session if session is not None else self.session
+        lines = []
+        future = start(lines.append)
+        while True:
+            done = future.done()
+            while lines:
+                self.report_write(lines.pop(0))
+            if done:
+                break
+            self.clock.sleep(0.05)
+        try:
+            return future.result()
+        except Exception as e:
+            self.screen.erase()
+            self.screen.refresh()
+            self.popup_error("{0}:\n{1}".format(session.label(), e)[:200])
+            return None
+
     # Select configuration areas BASIC. PEDAL ASSIST and THROTTLE
     def show_control(self):
-        config_changed = False
-        flash_read = False
-
         while True:
             file_operation = False  # don't continue into up down select if file op
             dic = OrderedDict()
+            area = None
             curses.curs_set(CURSOR_INVISIBLE)
 
-            # read controller flash only once
-            if not flash_read:
-                self.screen.erase()
-                self.screen.addstr(12,10, "Reading the controller flash areas.....", curses.A_BLINK)
-                self.screen.refresh()
-                self.get_basic_config()
-                self.screen.addstr(13,14, "Reading BASIC flash area.....")
-                self.screen.refresh()
-                self.get_pas_config()
-                self.screen.addstr(14,14, "Reading PEDAL ASSIST flash area.....")
-                self.screen.refresh()
-                self.get_throttle_config()
-                self.screen.addstr(15,14, "Reading THROTTLE HANDLE flash area.....")
-                self.screen.refresh()
-                sleep(1.5)
-                flash_read = True
+            if not self.session.flash_read:
+                self.read_flash()
 
             self.screen.erase()
             self.screen.refresh()
 
             # Pop up the function selection screen and get selection
-            resp = self.popup_config_select(config_changed)
+            resp = self.popup_config_select(self.session.config_changed)
 
             if resp == None:
+                self.close_sessions()
                 sys.exit(0)
+            # the controller switched to may not have been read yet
+            if resp not in ('Quit', 'Add Controller', 'Read File') and not self.session.flash_read:
+                if not self.read_flash():
+                    continue
             if resp == 'Edit Basic Configuration':
                 dic = self.basic_dict
+                area = 'basic'
             elif resp == 'Edit Pedal Assist Configuration':
                 dic = self.pas_dict
+                area = 'pas'
             elif resp == 'Edit Throttle Configuration':
                 dic = self.throttle_dict
+                area = 'throttle'
             elif resp == 'View Report':
                 file_operation = True
                 self.show_report()
+            elif resp == 'Simulate PAS':
+                file_operation = True
+                self.show_simulation()
+            elif resp == 'Live Telemetry':
+                file_operation = True
+                self.show_telemetry()
             elif resp == 'Read File':
                 err = False
                 file_operation = True
                 fname = self.popup_filename()
                 if fname != None:
+                    # build one dictionary to hold the other 3
+                    fd = OrderedDict()
                     try:
-                        f = open(fname, 'r')
+                        # read it from the json file, or bundle.bdacb#name
+                        with tracer.span('json load', 'file'):
+                            fd = load_config(fname)
                     except:
                         self.screen.erase()
                         self.screen.refresh()
                         self.popup_error('Could not open\n{0}\nfor reading'.format(fname))
                         err = True           
                     if not err:
-                        # build one dictionary to hold the other 3
-                        fd = OrderedDict()
-                        # read it from the json file
-                        fd = json.load(f)
                         # add them
                         self.basic_dict =  fd['basic']
                         self.pas_dict = fd['pas']
                         self.throttle_dict = fd['throttle']
                         err = False
-                        config_changed = True
-                        f.close()
+                        self.session.config_changed = True
                  
             elif resp == 'Save File':
                 err = False
@@ -290,125 +408,66 @@ class BdacTerm():
                         fd['basic'] = self.basic_dict
                         fd['pas'] = self.pas_dict
                         fd['throttle'] = self.throttle_dict
+                        fd['controller'] = snapshot_identity(self.session.info, self.session.bike)
                         #write them to a json file
-                        json.dump(fd, f)
+                        with tracer.span('json dump', 'file'):
+                            json.dump(fd, f)
                         f.close()
                         err = False
-                        config_changed = False
+                        self.session.config_changed = False
                         self.screen.erase()
                         self.screen.refresh()
 
             elif resp == 'Write Controller Flash':
-                if self.test_data:
+                if self.session.test_data:
                     self.popup_error("Using test data, writing disabled!")
                     continue
                 file_operation = True
 
-                # temp dictionaries to compare to controller              
-                b = self.basic_dict.copy()
-                p = self.pas_dict.copy()
-                t = self.throttle_dict.copy()
+                # check everything locally before any serial traffic
+                errors = validate_config(self.basic_dict, self.pas_dict, self.throttle_dict)
+                if errors:
+                    self.screen.erase()
+                    self.screen.refresh()
+                    self.popup_error("Not written, {0} invalid setting(s):\n{1}".format(
+                                     len(errors), errors[0]))
+                    continue
 
-                self.screen.erase()
-                self.screen.addstr(12,10, "Reading the controller flash areas.....", curses.A_BLINK)
-                self.screen.refresh()
-                sleep(1) # at least show briefly if read is quick
-                
-                # get actual controller data
-                self.basic_dict = self.get_basic_config()
-                self.pas_dict = self.get_pas_config()
-                self.throttle_dict = self.get_throttle_config()
-                flash_read = True
+                # temp dictionaries, the controller reads reuse the originals
+                b = area_copy(self.basic_dict)
+                p = area_copy(self.pas_dict)
+                t = area_copy(self.throttle_dict)
 
                 self.screen.erase()
+                self.screen.addstr(12,10, "Writing the controller flash areas.....", curses.A_BLINK)
                 self.screen.refresh()
+                self.report_y = 13
+
+                # snapshot, write only changed areas, verify, roll back on failure
+                targets = OrderedDict()
+                targets['basic'] = b
+                targets['pas'] = p
+                targets['throttle'] = t
+                session = self.session
+                written = self.wait(lambda report: session.write(targets, report))
+                if written is None:
+                    session.config_changed = True
+                with tracer.span('sleep', 'sleep'):
+                    self.clock.sleep(3)
+                # only what the controller now holds is saved
+                if written:
+                    self.save_snapshot(targets)
+
+            elif resp == 'Copy Config To All Controllers':
+                file_operation = True
+                self.copy_to_sessions()
 
-                # compare data to see if it has changed, only write changed areas
-                if b != self.basic_dict:
-                    self.screen.addstr(12,10, "Writing BASIC controller flash area.....")
-                    self.screen.refresh()
-                    sleep(1) # at least show briefly if read is quick
-                    frame = bytearray()
-                    frame.append(0x16)  # write command
-                    frame.append(0x52)  # section
-                    frame.append(0x18)  # packet length
-                    c = 0x52 + 0x18
-                    for key in b:
-                        frame.append(b[key][0])
-                        c = c + b[key][0]
-                    checksum = c % 256
-                    frame.append(checksum)
-                    resp = self.read_config(frame)
-                    if resp[1] != 0x18:
-                        self.screen.addstr(13,10,"Received error code {0} when writing to BASIC config".format(resp[2]))
-                    else:
-                        self.screen.addstr(13,10,"Successfully written to BASIC controller flash...")
-                    self.screen.refresh()
-                
-                if p != self.pas_dict:
-                    self.screen.addstr(15,10, "Writing PEDAL ASSIST controller flash area.....")
-                    self.screen.refresh()
-                    sleep(1) # at least show briefly if read is quick
-                    frame = bytearray()
-                    frame.append(0x16)  # write command
-                    frame.append(0x53)  # section
-                    frame.append(0x0b)  # packet length (11)
-                    c = 0x53 + 0x0b
-                    for key in p:
-                        frame.append(p[key][0])
-                        c = c + p[key][0]
-                    checksum = c % 256
-                    frame.append(checksum)
-                    resp = self.read_config(frame)
-                    if resp[1] != 0x0b:
-                        self.screen.addstr(16,10,"Received error code {0} when writing to PAS config".format(resp[2]))
-                    else:
-                        self.screen.addstr(16,10,"Successfully written to PAS controller flash...")
-                    self.screen.refresh()
-                
-                if t != self.throttle_dict:
-                    self.screen.addstr(18,10, "Writing THROTTLE controller flash area.....")
-                    self.screen.refresh()
-                    sleep(1) # at least show briefly if read is quick
-                    frame = bytearray()
-                    frame.append(0x16)  # write command
-                    frame.append(0x54)  # section
-                    frame.append(0x06)  # packet length
-                    c = 0x54 + 0x06
-                    for key in t:
-                        frame.append(t[key][0])
-                        c = c + t[key][0]
-                    checksum = c % 256
-                    frame.append(checksum)
-                    resp = self.read_config(frame)
-                    if resp[1] != 0x06:
-                        self.screen.addstr(19,10,"Received error code {0} when writing to THROTTLE config".format(resp[2]))
-                    else:
-                        self.screen.addstr(19,10,"Successfully written to THROTTLE controller flash...")
-                    self.screen.refresh()
-                sleep(3)
-                
-                # write a time stamped file
-                try:
-                    tl = time.localtime()
-                    timestamp = time.strftime('%b-%d-%Y-%H:%M:%S', tl)
-                    filename = (timestamp + '-config.bdac')
-
-                    f = open(filename, 'w')
-                    # build one dictionary to hold the other 3
-                    fd = OrderedDict()
-                    # add them
-                    fd['basic'] = b
-                    fd['pas'] = p
-                    fd['throttle'] = t
-                    #write them to a json file
-                    json.dump(fd, f)
-                    f.close()
-                except:
-                    pass
-                config_changed = False
+            elif resp == 'Add Controller':
+                file_operation = True
+                self.add_session()
 
             elif resp == 'Quit':
+                self.close_sessions()
                 sys.exit(0)
             self.screen.erase()
             self.screen.refresh()
@@ -434,11 +493,12 @@ class BdacTerm():
 
             if not file_operation:
                 # now process UP / DOWN arrows keys
-                config_changed = self.up_down_select(dic, index, config_changed)
+                self.session.config_changed = self.up_down_select(dic, index,
+                                                                  self.session.config_changed, area)
 
             # If conf changed save in original dictionary unless it's a file operation
             # If we read in a file we don't want to write over the dictionaries.
-            if config_changed and file_operation == False:
+            if self.session.config_changed and file_operation == False:
                 if resp == 'Edit Basic Configuration':
                     self.basic_dict = dic
                 elif resp == 'Edit Pedal Assist Configuration':
@@ -447,7 +507,110 @@ class BdacTerm():
                     self.throttle_dict = dic
 
 
-    def up_down_select(self, dic, index, config_changed):
+    # write a time stamped file of what was written, named after the port
+    # when there is more than one, the controller it went to is saved in it
+    def save_snapshot(self, targets, session=None):
+        try:
+            timestamp = self.clock.strftime('%b-%d-%Y-%H:%M:%S')
+            if session is not None and len(self.sessions) > 1:
+                filename = '{0}-{1}-config.bdac'.format(timestamp, session.label())
+            else:
+                filename = (timestamp + '-config.bdac')
+            if session is None:
+                session = self.session
+
+            f = open(filename, 'w')
+            # build one dictionary to hold the other 3
+            fd = OrderedDict()
+            # add them
+            fd['basic'] = targets['basic']
+            fd['pas'] = targets['pas']
+            fd['throttle'] = targets['throttle']
+            fd['controller'] = snapshot_identity(session.info, session.bike)
+            #write them to a json file
+            with tracer.span('json dump', 'file'):
+                json.dump(fd, f)
+            f.close()
+        except:
+            pass
+
+    # open another controller, it is read in the background
+    def add_session(self):
+        if self.open_port is None:
+            self.popup_error("No more controllers can be opened")
+            return
+        name = self.popup_filename('Port: ')
+        if name == None:
+            return
+        try:
+            session = open_session(name, self.open_port, self.read_config, self.sessions[0].dicts)
+        except Exception as e:
+            self.screen.erase()
+            self.screen.refresh()
+            self.popup_error('Could not open\n{0}\n{1}'.format(name, e)[:200])
+            return
+        self.sessions.append(session)
+        session.read_all()
+        self.current = len(self.sessions) - 1
+
+    # waits for each session's jobs, then closes the ports added from the menu
+    def close_sessions(self):
+        for session in self.sessions:
+            session.close()
+
+    # write the current session's settings to every other controller, all
+    # at once, each on its own session
+    def copy_to_sessions(self):
+        others = [s for s in self.sessions if s is not self.session and not s.test_data]
+        if not others:
+            self.popup_error("No other controllers to copy to,\nuse Add Controller first")
+            return
+        errors = validate_config(self.basic_dict, self.pas_dict, self.throttle_dict)
+        if errors:
+            self.popup_error("Not written, {0} invalid setting(s):\n{1}".format(
+                             len(errors), errors[0]))
+            return
+        jobs = []
+        for session in others:
+            targets = OrderedDict([('basic', area_copy(self.basic_dict)),
+                                   ('pas', area_copy(self.pas_dict)),
+                                   ('throttle', area_copy(self.throttle_dict))])
+            jobs.append((session, targets, session.write(targets)))
+
+        self.screen.erase()
+        self.screen.addstr(10,10, "Copying {0} settings to {1} controllers.....".format(
+                           self.session.label(), len(others)), curses.A_BLINK)
+        while True:
+            done = all(future.done() for session, targets, future in jobs)
+            for i, (session, targets, future) in enumerate(jobs):
+                if future.done():
+                    try:
+                        status = 'Written' if future.result() else 'Not written, ' + session.status
+                    except Exception as e:
+                        status = 'Failed, {0}'.format(e)
+                else:
+                    status = session.status
+                self.screen.move(12 + i, 0)
+                self.screen.clrtoeol()
+                self.screen.addstr(12 + i, 14, '{0:<16}{1}'.format(session.label(), status)[:72])
+            self.screen.refresh()
+            if done:
+                break
+            self.clock.sleep(0.1)
+        for session, targets, future in jobs:
+            if future.exception() is None and future.result():
+                self.save_snapshot(targets, session)
+        with tracer.span('sleep', 'sleep'):
+            self.clock.sleep(3)
+
+    # progress lines from write_transaction
+    def report_write(self, text):
+        if self.report_y < 26:
+            self.screen.addstr(self.report_y, 14, text[:72])
+            self.report_y += 1
+            self.screen.refresh()
+
+    def up_down_select(self, dic, index, config_changed, area):
         self.screen.nodelay(0)
         self.screen.keypad(1)
         curses.curs_set(0)
@@ -503,7 +666,12 @@ class BdacTerm():
                     i = int(self.screen.getstr(3))
                 except:
                     pass
+                err = None
                 if i >= 0 and i <= 255:
+                    err = check_value(area, key, i)
+                    if err:
+                        self.popup_error(err)
+                if i >= 0 and i <= 255 and not err:
                     dic[key][0] = i
                     index[idx][0] = key
                     index[idx][1] = i
@@ -561,7 +729,7 @@ class BdacTerm():
         self.screen.touchwin()
         self.screen.refresh()
 
-    def popup_filename(self):
+    def popup_filename(self, label='File: '):
         try:
             popup = curses.newwin(6, 78, 10, 5)
             popup.attrset(curses.color_pair(0))
@@ -570,9 +738,10 @@ class BdacTerm():
             popup.addstr(0, 2, "[ ")
             popup.addstr(os.getcwd())
             popup.addstr(" ]")
-            popup.addstr(2, 2, "File: ")
-            popup.addstr(4,2, "Type filename and press <Enter> or just press <Enter> to exit")
-            popup.move(2,8)
+            popup.addstr(2, 2, label)
+            popup.addstr(4,2, "Type {0} and press <Enter> or just press <Enter> to exit".format(
+                         'filename' if label == 'File: ' else label[:-2].lower()))
+            popup.move(2, 2 + len(label))
             curses.echo()
             s = popup.getstr().decode(encoding="utf-8")
             sfile = os.path.join(os.getcwd(), s)
@@ -603,8 +772,6 @@ class BdacTerm():
         self.screen.refresh()
 
     def show_report(self):
-        wy,wx=self.screen.getmaxyx()
-
         data = "Current Bafang controller flash settings with explainations.\n\n"
         data += '[Basic]\n'
         for key in self.basic_dict:
@@ -618,6 +785,91 @@ class BdacTerm():
         for key in self.throttle_dict:
             data += "{0}\t{1}\t{2}\n".format(key, self.throttle_dict[key][0],self.throttle_dict[key][1])
 
+        self.show_text(data, ('[Basic]', '[Pedal Assist]', '[Throttle Handle]'))
+
+    # PAS current curves for the settings being edited
+    def show_simulation(self):
+        try:
+            from bdac_simulate import default_input, simulation_report
+        except ImportError:
+            self.popup_error("The PAS simulator needs numpy,\nsee install.sh")
+            return
+        t, cadence, speed = default_input()
+        data = simulation_report(['Current settings'], [(self.basic_dict, self.pas_dict)],
+                                 t, cadence, speed, width=44)
+        self.show_text(data, ('[Current settings]',))
+
+    # telemetry and anomaly events as they come in, from bdacd's ring or
+    # polled here once a second when there is no bdacd
+    def show_telemetry(self):
+        try:
+            reader = RingReader()
+        except (OSError, ValueError):
+            reader = None
+            if self.get_telemetry is None:
+                self.popup_error("No telemetry, is bdacd running?")
+                return
+        last = OrderedDict((key, None) for key in ('rpm', 'status', 'amps', 'battery'))
+        poll = 0.0
+        drawn = False
+        self.screen.nodelay(1)
+        while True:
+            c = self.screen.getch()
+            if c != NOCHAR and chr(c) in ('q', 'Q'):
+                break
+            if reader is not None:
+                records = reader.poll()
+            elif self.clock.monotonic() - poll >= 1.0:
+                poll = self.clock.monotonic()
+                t = self.get_telemetry()
+                t['time'] = self.clock.time()
+                records = [t]
+            else:
+                records = []
+            for t in records:
+                # bdacd logs the events it sees itself
+                for e in self.detector.observe(t):
+                    if reader is None and self.log_event is not None:
+                        self.log_event(e)
+                last = t
+            if drawn and not records:
+                self.clock.sleep(0.1)
+                continue
+            drawn = True
+
+            self.screen.erase()
+            title = "Live Telemetry"
+            self.screen.addstr(0, int((79 - len(title)) / 2), title, curses.A_BOLD)
+            y = 2
+            summary = self.detector.summary()
+            for key, unit in (('rpm', ' rpm'), ('status', ''), ('amps', ' A'), ('battery', '%')):
+                value = '--' if last[key] is None else '{0}{1}'.format(last[key], unit)
+                line = "{0:<10}{1:>10}".format(key, value)
+                if key in summary:
+                    mean, sigma = summary[key]
+                    line += "    mean {0:7.1f}  deviation {1:6.1f}".format(mean, sigma)
+                self.screen.addstr(y, 2, line)
+                y += 1
+            if reader is not None and reader.lost:
+                self.screen.addstr(y, 2, "{0} records lost".format(reader.lost))
+            self.screen.addstr(8, 2, "Events", curses.A_BOLD)
+            events = list(self.detector.events)[-16:]
+            for i, e in enumerate(events):
+                attr = curses.A_BOLD if e['kind'] == 'anomaly' else curses.A_NORMAL
+                self.screen.addstr(10 + i, 2, "{0}  {1}".format(
+                                   time.strftime('%H:%M:%S', time.localtime(e['time'])),
+                                   e['text'])[:84], attr)
+            self.screen.addstr(27, 32, "Press 'q' to go back", curses.color_pair(0)|curses.A_BOLD)
+            self.screen.refresh()
+        if reader is not None:
+            reader.close()
+        self.screen.touchwin()
+        self.screen.refresh()
+
+    # scrolling view of some text, lines in bold are highlighted
+    def show_text(self, data, bold=()):
+        wy,wx=self.screen.getmaxyx()
+
         if type(data) == str:
             data = data.split('\n')
 
@@ -632,7 +884,7 @@ class BdacTerm():
         #pad.addstr(0,0,"[HOME / END / UP / DOWN / \"q\" to quit and \"s\" to save]",curses.color_pair(0)|curses.A_BOLD)
         pad.addstr(0,0,"[ HOME / END / UP / DOWN / \"q\" to quit ]",curses.color_pair(0)|curses.A_BOLD)
         for i,line in enumerate(data):
-            if str(line) == '[Basic]' or str(line) == '[Pedal Assist]' or str(line) == '[Throttle Handle]':
+            if str(line) in bold:
                 pad.addstr(i+2,0,str(line),curses.color_pair(0)|curses.A_BOLD)
             else:
                 pad.addstr(i+2,0,str(line))
@@ -691,7 +943,7 @@ class BdacTerm():
         
         first_char = True
         date_string = ''
-        today = datetime.datetime.today()
+        today = self.clock.today()
 
         # Loop time makes sure process doesn't run wild
         loop_time = 0.0
@@ -720,4 +972,4 @@ class BdacTerm():
             if loop_time <= 0.1:
                 loop_time += 0.000001
             else:
-                time.sleep(loop_time)
+                self.clock.sleep(loop_time)
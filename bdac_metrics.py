@@ -0,0 +1,177 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Serial link statistics for a provisioning station: command latency
+# histograms, timeouts, checksum failures, controller error codes, bytes
+# in and out and how often a write frame was found already encoded.
+# They can be served in Prometheus text format on a local HTTP port
+# (bdac --metrics <port>).
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency bucket upper bounds in seconds, the fixed read wait is 1s
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 1.25, 1.5, 2.0, 3.0, 5.0)
+
+AREA_NAMES = {0x51: 'info', 0x52: 'basic', 0x53: 'pas', 0x54: 'throttle'}
+WRITE_LENGTHS = {0x52: 0x18, 0x53: 0x0b, 0x54: 0x06}
+STATUS_NAMES = {0x08: 'status', 0x0a: 'power', 0x11: 'battery', 0x20: 'speed'}
+
+#-----------------------------------------------------------------------
+# Name of a command frame for labels, "read_basic", "write_pas"...
+#-----------------------------------------------------------------------
+def command_name(cm):
+    if len(cm) < 2:
+        return 'unknown'
+    if cm[0] == 0x11 and cm[1] in AREA_NAMES:
+        return 'read_' + AREA_NAMES[cm[1]]
+    if cm[0] == 0x11 and cm[1] in STATUS_NAMES:
+        return STATUS_NAMES[cm[1]]
+    if cm[0] == 0x16 and cm[1] in AREA_NAMES:
+        return 'write_' + AREA_NAMES[cm[1]]
+    return 'unknown'
+
+#-----------------------------------------------------------------------
+# Check the trailing checksum of an area read response
+#-----------------------------------------------------------------------
+# The checksum is the sum of every byte before it, modulo 256.  Only the
+# BASIC, PAS and THROTTLE responses are checked, INFO is not reliable.
+def checksum_ok(resp):
+    return len(resp) >= 3 and sum(resp[:-1]) % 256 == resp[-1]
+
+class Metrics():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.latency = OrderedDict()    # command -> [bucket counts, sum, count]
+        self.timeouts = OrderedDict()
+        self.checksum_failures = OrderedDict()
+        self.errors = OrderedDict()     # (area, code) -> count
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.frame_hits = 0
+        self.frame_misses = 0
+
+    # a write frame taken from the frame cache, or encoded
+    def frame_cache(self, hit):
+        with self.lock:
+            if hit:
+                self.frame_hits += 1
+            else:
+                self.frame_misses += 1
+
+    #-------------------------------------------------------------------
+    # Record one command and its response
+    #-------------------------------------------------------------------
+    def observe(self, cm, resp, seconds):
+        name = command_name(cm)
+        with self.lock:
+            self.bytes_out += len(cm)
+            self.bytes_in += len(resp)
+            if name not in self.latency:
+                self.latency[name] = [[0] * len(BUCKETS), 0.0, 0]
+            hist = self.latency[name]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    hist[0][i] += 1
+            hist[1] += seconds
+            hist[2] += 1
+
+            if len(resp) == 0:
+                self.timeouts[name] = self.timeouts.get(name, 0) + 1
+            elif cm[0] == 0x11 and cm[1] in WRITE_LENGTHS and not checksum_ok(resp):
+                self.checksum_failures[name] = self.checksum_failures.get(name, 0) + 1
+            elif name.startswith('write_') and cm[1] in WRITE_LENGTHS:
+                if len(resp) > 2 and resp[1] != WRITE_LENGTHS[cm[1]]:
+                    key = (AREA_NAMES[cm[1]], resp[2])
+                    self.errors[key] = self.errors.get(key, 0) + 1
+
+    #-------------------------------------------------------------------
+    # Prometheus text exposition format
+    #-------------------------------------------------------------------
+    def render(self):
+        lines = []
+        with self.lock:
+            lines.append('# HELP bdac_command_seconds Serial command round trip time.')
+            lines.append('# TYPE bdac_command_seconds histogram')
+            for name, (counts, total, count) in self.latency.items():
+                for bound, c in zip(BUCKETS, counts):
+                    lines.append('bdac_command_seconds_bucket{{command="{0}",le="{1}"}} {2}'.format(name, bound, c))
+                lines.append('bdac_command_seconds_bucket{{command="{0}",le="+Inf"}} {1}'.format(name, count))
+                lines.append('bdac_command_seconds_sum{{command="{0}"}} {1}'.format(name, total))
+                lines.append('bdac_command_seconds_count{{command="{0}"}} {1}'.format(name, count))
+
+            lines.append('# HELP bdac_timeouts_total Commands that got no response.')
+            lines.append('# TYPE bdac_timeouts_total counter')
+            for name, c in self.timeouts.items():
+                lines.append('bdac_timeouts_total{{command="{0}"}} {1}'.format(name, c))
+
+            lines.append('# HELP bdac_checksum_failures_total Responses with a bad checksum.')
+            lines.append('# TYPE bdac_checksum_failures_total counter')
+            for name, c in self.checksum_failures.items():
+                lines.append('bdac_checksum_failures_total{{command="{0}"}} {1}'.format(name, c))
+
+            lines.append('# HELP bdac_controller_errors_total Error codes returned for area writes.')
+            lines.append('# TYPE bdac_controller_errors_total counter')
+            for (area, code), c in self.errors.items():
+                lines.append('bdac_controller_errors_total{{area="{0}",code="{1}"}} {2}'.format(area, code, c))
+
+            lines.append('# HELP bdac_bytes_out_total Bytes sent to the controller.')
+            lines.append('# TYPE bdac_bytes_out_total counter')
+            lines.append('bdac_bytes_out_total {0}'.format(self.bytes_out))
+            lines.append('# HELP bdac_bytes_in_total Bytes received from the controller.')
+            lines.append('# TYPE bdac_bytes_in_total counter')
+            lines.append('bdac_bytes_in_total {0}'.format(self.bytes_in))
+            lines.append('# HELP bdac_frame_cache_hits_total Write frames found already encoded.')
+            lines.append('# TYPE bdac_frame_cache_hits_total counter')
+            lines.append('bdac_frame_cache_hits_total {0}'.format(self.frame_hits))
+            lines.append('# HELP bdac_frame_cache_misses_total Write frames encoded.')
+            lines.append('# TYPE bdac_frame_cache_misses_total counter')
+            lines.append('bdac_frame_cache_misses_total {0}'.format(self.frame_misses))
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+#-----------------------------------------------------------------------
+# HTTP endpoint, only ever bound to localhost
+#-----------------------------------------------------------------------
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # keep the curses screen clean
+
+def start_metrics_server(port, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
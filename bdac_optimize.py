@@ -0,0 +1,126 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Assist level optimizer, finds the ALC1-9 current and ALSL1-9 speed
+# tables closest to a target curve (bdac --optimize).  The target is
+# "linear" (equal steps), "smooth" (equal ratios between levels, so each
+# step feels the same) or nine comma separated percentages.
+#
+# Candidate tables are every curve start + (end - start) * x^g over all
+# integer start and end values the constraints allow and a range of
+# shapes g, rounded to whole percent.  All candidates are built, checked
+# and scored at once as arrays, those breaking a constraint are dropped:
+#   - every value within the controller's range (bdac_validate)
+#   - levels strictly increasing
+#   - top level current no more than the amps cap (LC * ALC9 / 100)
+# The best is the lowest squared error to the target, ties going to the
+# table with the most even steps.  Level 0 is left as it is.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import numpy as np
+
+from collections import OrderedDict
+from bdac_validate import constraint_dict
+
+LEVELS = 9                              # levels 1-9 are optimized
+SHAPES = np.exp(np.linspace(np.log(0.25), np.log(4.0), 41))
+EVEN_WEIGHT = 1e-3                      # tie break on step evenness
+
+#-----------------------------------------------------------------------
+# Target values for levels 1-9, from start to end or as given
+#-----------------------------------------------------------------------
+def target_shape(name, start, end):
+    x = np.linspace(0, 1, LEVELS)
+    if name == 'linear':
+        return start + (end - start) * x
+    if name == 'smooth':
+        start = max(start, 1.0)
+        return start * (end / start) ** x
+    values = np.array([float(v) for v in name.split(',')])
+    if len(values) != LEVELS:
+        raise ValueError('Target needs {0} values, got {1}'.format(LEVELS, len(values)))
+    return values
+
+#-----------------------------------------------------------------------
+# Every candidate table, shape (candidates, 9)
+#-----------------------------------------------------------------------
+@functools.lru_cache(maxsize=4)
+def candidates(lo, hi):
+    x = np.linspace(0, 1, LEVELS)
+    start = np.arange(lo, hi + 1, dtype=np.float64)[:, None, None, None]
+    end = np.arange(lo, hi + 1, dtype=np.float64)[None, :, None, None]
+    shape = SHAPES[None, None, :, None]
+    tables = np.rint(start + (end - start) * x ** shape).reshape(-1, LEVELS)
+    # duplicates from rounding are left in, they cannot change the best
+    return tables[tables[:, -1] > tables[:, 0]]
+
+#-----------------------------------------------------------------------
+# Best table for a target, values in percent, scale turns a table into
+# the target's units (amps for current).  None if nothing fits.
+#-----------------------------------------------------------------------
+def best_table(key, target, scale=1.0, cap=None):
+    lo, hi = constraint_dict['basic']['{0}1'.format(key)][0:2]
+    tables = candidates(lo, hi)
+    steps = np.diff(tables, axis=1)
+    ok = (steps > 0).all(axis=1)
+    if cap is not None:
+        ok &= tables[:, -1] * scale <= cap + 1e-9
+    tables = tables[ok]
+    if not len(tables):
+        return None, None
+    steps = np.diff(tables, axis=1).astype(np.float64)
+    error = ((tables * scale - target) ** 2).mean(axis=1)
+    score = error + EVEN_WEIGHT * steps.var(axis=1)
+    best = np.argmin(score)
+    return tables[best], np.sqrt(error[best])
+
+#-----------------------------------------------------------------------
+# Optimize the assist levels of basic_dict, returns a new basic_dict
+# and a report of what was chosen
+#-----------------------------------------------------------------------
+# current and speed are target names (see target_shape).  The current
+# target runs from the current ALC1 level to max_amps, the speed target
+# from the current ALSL1 to 100%.
+def optimize_levels(basic_dict, current='linear', speed='linear', max_amps=None):
+    lc = basic_dict['LC'][0]
+    if max_amps is None:
+        max_amps = lc
+    max_amps = min(max_amps, lc)
+    report = []
+    new = OrderedDict((key, list(val)) for key, val in basic_dict.items())
+
+    amps_target = target_shape(current, basic_dict['ALC1'][0] * lc / 100.0, max_amps)
+    if current not in ('linear', 'smooth'):
+        amps_target = amps_target * lc / 100.0     # given in percent
+    alc, alc_err = best_table('ALC', amps_target, lc / 100.0, max_amps)
+    speed_target = target_shape(speed, float(basic_dict['ALSL1'][0]), 100.0)
+    alsl, alsl_err = best_table('ALSL', speed_target)
+    if alc is None or alsl is None:
+        raise ValueError('No assist table fits the constraints')
+
+    for i in range(LEVELS):
+        new['ALC{0}'.format(i + 1)][0] = int(alc[i])
+        new['ALSL{0}'.format(i + 1)][0] = int(alsl[i])
+    report.append('Current ({0}, LC {1}A, cap {2}A), rms error {3:.2f}A'.format(
+                  current, lc, max_amps, alc_err))
+    report.append('  level  ' + ' '.join('{0:5d}'.format(i + 1) for i in range(LEVELS)))
+    report.append('  target ' + ' '.join('{0:5.1f}'.format(a) for a in amps_target))
+    report.append('  amps   ' + ' '.join('{0:5.1f}'.format(a * lc / 100.0) for a in alc))
+    report.append('  ALC%   ' + ' '.join('{0:5d}'.format(int(a)) for a in alc))
+    report.append('Speed ({0}), rms error {1:.2f}%'.format(speed, alsl_err))
+    report.append('  target ' + ' '.join('{0:5.1f}'.format(s) for s in speed_target))
+    report.append('  ALSL%  ' + ' '.join('{0:5d}'.format(int(s)) for s in alsl))
+    return new, report
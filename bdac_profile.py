@@ -0,0 +1,118 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Run any bdac mode under cProfile (bdac --profile ...).  On exit the raw
+# profile is saved to bdac.prof and a summary to bdac.prof.txt, with
+# time spent in bdac's own functions listed apart from library time.
+#
+# Every thread started after the profile is gets a profiler of its own,
+# bdacd's serial thread and the GUI's session workers do the serial work,
+# and they are all merged at exit.  From Python 3.12 cProfile already
+# sees every thread and only the first profiler is used.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import atexit
+import pstats
+import cProfile
+import threading
+
+PROFILE_FILE = 'bdac.prof'
+TOP = 25
+
+profiler = None
+thread_profilers = []
+lock = threading.Lock()
+
+def start_profile(filename=PROFILE_FILE):
+    global profiler
+    profiler = cProfile.Profile()
+    atexit.register(stop_profile, filename)
+    threading.setprofile(profile_thread)
+    profiler.enable()
+
+# called once in each new thread, before anything else it runs
+def profile_thread(frame, event, arg):
+    sys.setprofile(None)
+    with lock:
+        if profiler is None:
+            return
+        p = cProfile.Profile()
+        try:
+            p.enable()
+        except ValueError:
+            return      # one profiler already sees every thread
+        thread_profilers.append(p)
+
+#-----------------------------------------------------------------------
+# Is a profile entry one of ours (bdac.py, bdac_gui.py, bdac_*.py)
+#-----------------------------------------------------------------------
+def own_function(filename):
+    name = os.path.basename(filename)
+    return name.startswith('bdac') and name != 'bdac_profile.py'
+
+def format_rows(rows):
+    lines = ['  {0:>8} {1:>10} {2:>10}  {3}'.format('calls', 'own s', 'total s', 'function')]
+    for (filename, lineno, func), (cc, nc, tt, ct, callers) in rows[:TOP]:
+        if filename == '~':
+            where = func    # built in
+        else:
+            where = '{0}:{1}({2})'.format(os.path.basename(filename), lineno, func)
+        lines.append('  {0:>8} {1:>10.4f} {2:>10.4f}  {3}'.format(nc, tt, ct, where))
+    return lines
+
+#-----------------------------------------------------------------------
+# Hot function summary, bdac functions first then everything else
+#-----------------------------------------------------------------------
+def profile_summary(stats, threads=1):
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+    own = [row for row in rows if own_function(row[0][0])]
+    lib = [row for row in rows if not own_function(row[0][0])]
+    own_time = sum(row[1][2] for row in own)
+    lib_time = sum(row[1][2] for row in lib)
+
+    lines = ['bdac profile, {0:.3f}s total over {1} threads'.format(stats.total_tt, threads), '']
+    lines.append('Time in bdac functions:   {0:.3f}s'.format(own_time))
+    lines.append('Time in library/builtins: {0:.3f}s'.format(lib_time))
+    lines.append('')
+    lines.append('[bdac functions by own time]')
+    lines.extend(format_rows(own))
+    lines.append('')
+    lines.append('[bdac functions by total time, including what they call]')
+    lines.extend(format_rows(sorted(own, key=lambda item: item[1][3], reverse=True)))
+    lines.append('')
+    lines.append('[library functions by own time]')
+    lines.extend(format_rows(lib))
+    return '\n'.join(lines) + '\n'
+
+def stop_profile(filename=PROFILE_FILE):
+    global profiler
+    with lock:
+        if profiler is None:
+            return
+        threading.setprofile(None)
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        # threads still running are cut off where they are
+        for p in thread_profilers:
+            stats.add(p)
+        threads = 1 + len(thread_profilers)
+        profiler = None
+        del thread_profilers[:]
+    stats.dump_stats(filename)
+    with open(filename + '.txt', 'w') as f:
+        f.write(profile_summary(stats, threads))
+    print('Profile saved to {0}, summary in {0}.txt...'.format(filename))
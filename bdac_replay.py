@@ -0,0 +1,148 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Record and replay of serial sessions.  bdac --record <fixture> ... logs
+# every write to and read from the controller with its timing into a
+# fixture file (json).  bdac --replay <fixture> ... then uses the fixture
+# in place of the serial port, so a session from the field can be run
+# again anywhere without a controller.  --speed <factor> replays faster,
+# 0 does not wait at all.
+#
+# Replay expects the same commands in the same order.  A command that is
+# not next in the fixture is looked for further on, commands skipped that
+# way are reported at the end, a command not in the fixture at all is an
+# error.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import time
+import atexit
+import threading
+
+FIXTURE_VERSION = 1
+
+class ReplayError(Exception):
+    pass
+
+#-----------------------------------------------------------------------
+# Serial port wrapper that records the session
+#-----------------------------------------------------------------------
+# Events are [seconds since start, "w", hex] for a write and
+# [seconds since start, "r", bytes asked for, hex, seconds taken] for
+# a read.
+class RecordingSerial():
+
+    def __init__(self, ser, filename, port=None):
+        self.ser = ser
+        self.filename = filename
+        self.port = port
+        self.events = []
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime())
+        atexit.register(self.save)
+
+    @property
+    def timeout(self):
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.ser.timeout = value
+
+    def write(self, cm):
+        with self.lock:
+            self.events.append([time.monotonic() - self.start, 'w', bytes(cm).hex()])
+        return self.ser.write(cm)
+
+    def flush(self):
+        self.ser.flush()
+
+    def read(self, size):
+        began = time.monotonic()
+        resp = self.ser.read(size)
+        with self.lock:
+            self.events.append([began - self.start, 'r', size, resp.hex(),
+                                time.monotonic() - began])
+        return resp
+
+    def close(self):
+        self.save()
+        self.ser.close()
+
+    def save(self):
+        with self.lock:
+            fixture = {'version': FIXTURE_VERSION, 'port': self.port,
+                       'recorded': self.stamp, 'events': list(self.events)}
+        with open(self.filename, 'w') as f:
+            json.dump(fixture, f, indent=0)
+
+#-----------------------------------------------------------------------
+# Stand in for the serial port that plays a recorded session back
+#-----------------------------------------------------------------------
+class ReplaySerial():
+
+    def __init__(self, filename, speed=1.0, sleep=time.sleep):
+        with open(filename) as f:
+            fixture = json.load(f)
+        if fixture.get('version') != FIXTURE_VERSION:
+            raise ReplayError('{0} is not a version {1} fixture'.format(filename, FIXTURE_VERSION))
+        self.events = fixture['events']
+        self.speed = speed
+        self.sleep = sleep
+        self.timeout = 1
+        self.pos = 0
+        self.skipped = 0
+        self.reads = []     # reads belonging to the last write
+
+    #-------------------------------------------------------------------
+    # Find the write in the fixture and line up the reads after it
+    #-------------------------------------------------------------------
+    def write(self, cm):
+        want = bytes(cm).hex()
+        pos = self.pos
+        while pos < len(self.events) and not (self.events[pos][1] == 'w' and
+                                              self.events[pos][2] == want):
+            pos += 1
+        if pos == len(self.events):
+            raise ReplayError('Command {0} is not in the fixture after event {1}'.format(
+                              want, self.pos))
+        self.skipped += sum(1 for e in self.events[self.pos:pos] if e[1] == 'w')
+        end = pos + 1
+        while end < len(self.events) and self.events[end][1] == 'r':
+            end += 1
+        self.reads = self.events[pos + 1:end]
+        self.pos = end
+        return len(cm)
+
+    def flush(self):
+        pass
+
+    # a read takes as long as it did when recorded, time spent between
+    # reads is bdac's own and is not replayed
+    def read(self, size):
+        if not self.reads:
+            return b''
+        event = self.reads.pop(0)
+        self.wait(event[4])
+        return bytes.fromhex(event[3])[:size]
+
+    def wait(self, seconds):
+        if self.speed and seconds > 0:
+            self.sleep(seconds / self.speed)
+
+    def close(self):
+        if self.skipped:
+            print('Replay skipped {0} recorded commands...'.format(self.skipped))
@@ -0,0 +1,164 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Telemetry ring in shared memory.  The process holding the serial port
+# (bdacd) publishes every telemetry poll into a file in /dev/shm that any
+# number of local readers map, the curses screen, a logger (bdac
+# --telemetry), a plotting script.  Readers only look at memory, they
+# take no locks and make no system calls per sample.
+#
+#   header   magic, record size, slots, epoch, next sequence number
+#   slots    sequence, time, rpm, status, amps, battery, sequence
+#
+# Record n goes in slot n % slots.  The writer fills a slot from the
+# front, so the first sequence number changes before anything else, and
+# then moves the header's next sequence on.  A reader takes the last
+# sequence number, then a copy of the record, then the first sequence
+# number again, and keeps its own next sequence; when the writer is more
+# than a ring ahead the records in between are gone and counted as lost.
+# A slot where any of the sequence numbers read is not the one expected
+# was overwritten while it was read and is lost too.  A new epoch means
+# the publisher restarted.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import mmap
+import math
+import time
+import struct
+
+from collections import OrderedDict
+
+RING = '/dev/shm/bdac-telemetry' if os.path.isdir('/dev/shm') else '/tmp/bdac-telemetry'
+SLOTS = 1024
+MAGIC = b'BDRING1\x00'
+
+HEADER = struct.Struct('<8sIIQQ')       # magic, record size, slots, epoch, next
+NEXT = 24                               # offset of next in the header
+RECORD = struct.Struct('<QdiifiQ')      # seq, time, rpm, status, amps, battery, seq
+FIELDS = ('time', 'rpm', 'status', 'amps', 'battery')
+NONE = -1                               # int fields with no reading
+
+def pack_values(telemetry):
+    def whole(key):
+        val = telemetry.get(key)
+        return NONE if val is None else int(val)
+    amps = telemetry.get('amps')
+    return (float(telemetry.get('time', time.time())), whole('rpm'), whole('status'),
+            math.nan if amps is None else float(amps), whole('battery'))
+
+def unpack_values(values):
+    telemetry = OrderedDict(zip(FIELDS, values))
+    for key in ('rpm', 'status', 'battery'):
+        if telemetry[key] == NONE:
+            telemetry[key] = None
+    if math.isnan(telemetry['amps']):
+        telemetry['amps'] = None
+    return telemetry
+
+#-----------------------------------------------------------------------
+# Publisher, only one per ring
+#-----------------------------------------------------------------------
+class RingWriter():
+
+    def __init__(self, path=RING, slots=SLOTS):
+        self.path = path
+        self.slots = slots
+        size = HEADER.size + slots * RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.next = 0
+        # readers still mapping the old ring see the epoch change
+        HEADER.pack_into(self.map, 0, MAGIC, RECORD.size, slots, time.time_ns(), 0)
+
+    def publish(self, telemetry):
+        seq = self.next
+        offset = HEADER.size + (seq % self.slots) * RECORD.size
+        RECORD.pack_into(self.map, offset, seq, *pack_values(telemetry), seq)
+        self.next = seq + 1
+        struct.pack_into('<Q', self.map, NEXT, self.next)
+        return seq
+
+    def close(self):
+        self.map.close()
+
+#-----------------------------------------------------------------------
+# Reader, any number per ring
+#-----------------------------------------------------------------------
+# oldest starts with everything still in the ring, otherwise only new
+# records are read.
+class RingReader():
+
+    def __init__(self, path=RING, oldest=False):
+        self.path = path
+        self.map = None
+        self.lost = 0
+        head = self.attach()
+        self.next = max(0, head - self.slots) if oldest else head
+
+    def attach(self):
+        if self.map is not None:
+            self.map.close()
+        with open(self.path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size, self.slots, self.epoch, head = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or size != RECORD.size:
+            raise ValueError('{0} is not a telemetry ring'.format(self.path))
+        return head
+
+    #-------------------------------------------------------------------
+    # Records published since the last call, oldest first
+    #-------------------------------------------------------------------
+    def poll(self):
+        magic, size, slots, epoch, head = HEADER.unpack_from(self.map, 0)
+        if epoch != self.epoch:
+            # publisher restarted, start over with its first record
+            head = self.attach()
+            self.next = 0
+        if head - self.next > self.slots:
+            self.lost += head - self.slots - self.next
+            self.next = head - self.slots
+        records = []
+        while self.next < head:
+            seq = self.next
+            offset = HEADER.size + (seq % self.slots) * RECORD.size
+            # end sequence, then a copy of the record, then the start
+            # sequence again, all of them must be seq
+            last = struct.unpack_from('<Q', self.map, offset + RECORD.size - 8)[0]
+            values = RECORD.unpack_from(self.map, offset)
+            first = struct.unpack_from('<Q', self.map, offset)[0]
+            self.next += 1
+            if not first == last == values[0] == values[-1] == seq:
+                self.lost += 1      # overwritten while we read it
+                continue
+            telemetry = unpack_values(values[1:-1])
+            telemetry['seq'] = seq
+            records.append(telemetry)
+        return records
+
+    def follow(self, interval=0.1):
+        while True:
+            records = self.poll()
+            for telemetry in records:
+                yield telemetry
+            if not records:
+                time.sleep(interval)
+
+    def close(self):
+        self.map.close()
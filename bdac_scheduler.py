@@ -0,0 +1,154 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Command scheduler for the one serial line.  Jobs are run one at a time
+# in priority order, writes first, then config reads, then telemetry.
+# Telemetry only gets the line when nothing else is waiting, not at all
+# for a short hold off after config traffic (edits come in bursts), and
+# never more than its share of recent line time.  A telemetry job with
+# the same key as one already waiting is not queued again, the caller
+# shares the waiting job's result.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import heapq
+import itertools
+import threading
+
+from collections import deque
+
+WRITE = 0
+CONFIG = 1
+TELEMETRY = 2
+
+priority_names = {WRITE: 'write', CONFIG: 'config', TELEMETRY: 'telemetry'}
+
+class Job():
+
+    def __init__(self, priority, func, args, key):
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.key = key
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.queued = time.monotonic()
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+class Scheduler():
+
+    def __init__(self, telemetry_share=0.5, holdoff=0.5, window=10.0):
+        self.telemetry_share = telemetry_share  # most of the line telemetry may use
+        self.holdoff = holdoff                  # seconds after config traffic
+        self.window = window                    # seconds of line use remembered
+        self.cond = threading.Condition()
+        self.heap = []                          # (priority, sequence, job)
+        self.sequence = itertools.count()
+        self.pending = dict()                   # key -> waiting job
+        self.used = deque()                     # (end, seconds) telemetry line use
+        self.last_config = 0.0
+        self.counts = dict((p, [0, 0.0]) for p in priority_names)  # runs, wait seconds
+        self.coalesced = 0
+
+    #-------------------------------------------------------------------
+    # Queue a job, returns the Job to wait on
+    #-------------------------------------------------------------------
+    def submit(self, priority, func, args=(), key=None):
+        with self.cond:
+            if key is not None and key in self.pending:
+                self.coalesced += 1
+                return self.pending[key]
+            job = Job(priority, func, args, key)
+            heapq.heappush(self.heap, (priority, next(self.sequence), job))
+            if key is not None:
+                self.pending[key] = job
+            self.cond.notify()
+            return job
+
+    def call(self, priority, func, *args, key=None):
+        return self.submit(priority, func, args, key).result()
+
+    #-------------------------------------------------------------------
+    # How long until telemetry may have the line, 0 if it may now
+    #-------------------------------------------------------------------
+    def telemetry_wait(self, now):
+        while self.used and self.used[0][0] < now - self.window:
+            self.used.popleft()
+        wait = self.last_config + self.holdoff - now
+        spent = sum(seconds for end, seconds in self.used)
+        if spent > self.telemetry_share * self.window and self.used:
+            # wait for the oldest use to fall out of the window
+            wait = max(wait, self.used[0][0] + self.window - now)
+        return max(wait, 0.0)
+
+    #-------------------------------------------------------------------
+    # Next job to run, None if there is none within timeout seconds
+    #-------------------------------------------------------------------
+    def next(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                wait = None
+                if self.heap:
+                    if self.heap[0][0] < TELEMETRY:
+                        wait = 0.0
+                    else:
+                        wait = self.telemetry_wait(now)
+                    if wait == 0.0:
+                        job = heapq.heappop(self.heap)[2]
+                        if job.key is not None:
+                            self.pending.pop(job.key, None)
+                        return job
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self.cond.wait(wait)
+
+    def run(self, job):
+        start = time.monotonic()
+        try:
+            job.value = job.func(*job.args)
+        except Exception as e:
+            job.error = e
+        end = time.monotonic()
+        with self.cond:
+            self.counts[job.priority][0] += 1
+            self.counts[job.priority][1] += start - job.queued
+            if job.priority == TELEMETRY:
+                self.used.append((end, end - start))
+            else:
+                self.last_config = end
+        job.done.set()
+
+    #-------------------------------------------------------------------
+    # Jobs run and average queue wait for each priority
+    #-------------------------------------------------------------------
+    def stats(self):
+        with self.cond:
+            stats = dict()
+            for p, (runs, waited) in self.counts.items():
+                stats[priority_names[p]] = {'runs': runs,
+                                            'wait': waited / runs if runs else 0.0}
+            stats['coalesced'] = self.coalesced
+            stats['waiting'] = len(self.heap)
+            return stats
@@ -0,0 +1,140 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Controller sessions for the GUI, one per connected controller.  A
+# session holds its port's area readers and send function, the area
+# dictionaries being edited for it and whether they have been read or
+# changed.  All of its serial work runs on a worker thread of its own,
+# one job after another, so the screen never blocks on a port, switching
+# sessions only changes which dictionaries are shown, and jobs on
+# different sessions, a config copied to every controller, run side by
+# side.
+#
+# Jobs take a report function for their progress lines, the session
+# also keeps the last one as its status.  Reading or writing also reads
+# the controller's INFO once, the snapshots saved after a write name it.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from bdac_frames import area_dict
+from bdac_batch import port_config
+from bdac_transaction import write_transaction
+
+INFO_CMD = b'\x11\x51\x04\xb0\x05'
+
+class Session():
+
+    # get_config maps each area to its reader, send is read_config for
+    # this session's port.  dicts are the area dictionaries to start
+    # with, empty ones if not given.
+    def __init__(self, name, get_config, send, dicts=None, port=None, test_data=False,
+                 bike=None):
+        self.name = name
+        self.bike = bike
+        self.info = None
+        self.get_config = get_config
+        self.send = send
+        self.port = port
+        self.test_data = test_data
+        self.dicts = dicts if dicts is not None else OrderedDict((area, OrderedDict())
+                                                                 for area in area_dict)
+        self.flash_read = False
+        self.config_changed = False
+        self.reading = None
+        self.status = ''
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+    def label(self):
+        return os.path.basename(self.name) or self.name
+
+    def submit(self, func, *args):
+        return self.pool.submit(func, *args)
+
+    def reporter(self, report=None):
+        def status(text):
+            self.status = text
+            if report is not None:
+                report(text)
+        return status
+
+    #-------------------------------------------------------------------
+    # Read every area, a read already on its way is waited for instead
+    #-------------------------------------------------------------------
+    def read_all(self, report=None):
+        if self.reading is None or (self.reading.done() and not self.flash_read):
+            self.reading = self.submit(self.do_read_all, self.reporter(report))
+        return self.reading
+
+    # a controller that does not answer is left unnamed, the job itself
+    # reports the port's trouble
+    def identify(self):
+        if self.info is not None or self.test_data:
+            return
+        try:
+            resp = self.send(INFO_CMD)
+        except (OSError, ValueError):
+            return
+        if len(resp) >= 18 and resp[0] == INFO_CMD[1]:
+            self.info = resp
+
+    def do_read_all(self, report):
+        self.identify()
+        for area in area_dict:
+            self.dicts[area] = self.get_config[area]()
+            report('Reading {0} flash area.....'.format(area_dict[area][2]))
+        self.flash_read = True
+        return True
+
+    #-------------------------------------------------------------------
+    # Write areas as one transaction, targets maps areas to dictionaries
+    #-------------------------------------------------------------------
+    def write(self, targets, report=None):
+        return self.submit(self.do_write, targets, self.reporter(report))
+
+    def do_write(self, targets, report):
+        self.identify()
+        written = write_transaction(targets, self.get_config, self.send, report)
+        # the edits are kept to try again when the controller kept its own,
+        # a copy is kept so the caller's lists are never this session's
+        if written:
+            for area, dic in targets.items():
+                self.dicts[area] = area_copy(dic)
+            self.flash_read = True
+        self.config_changed = not written
+        return written
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        if self.port is not None:
+            self.port.close()
+
+#-----------------------------------------------------------------------
+# Copy of an area dictionary down to its [value, description] lists,
+# values are edited in place and must not change another session's
+#-----------------------------------------------------------------------
+def area_copy(dic):
+    return OrderedDict((key, list(value)) for key, value in dic.items())
+
+#-----------------------------------------------------------------------
+# A session on another port, read_config(cm, length, port=...) sends a
+# frame on it, templates give the keys and descriptions of each area
+#-----------------------------------------------------------------------
+def open_session(name, open_port, read_config, templates):
+    port = open_port(name)
+    send = lambda cm, length=None: read_config(cm, length, port=port)
+    return Session(name, port_config(send, templates), send, port=port)
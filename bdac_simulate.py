@@ -0,0 +1,196 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Pedal assist simulator, preview what the PAS and assist level settings
+# do to the motor current without flashing the controller.  Any number of
+# candidate configs are run over the same cadence and speed input at
+# once, one row of the result arrays per config and assist level.
+#
+# The controller firmware is not published, the model below follows the
+# setting descriptions and is meant for comparing configs, not for exact
+# amps:
+#        no pedal pulse for 0.25s means pedalling has stopped
+#   SDN  pedal pulses needed (PT sensor pulses per turn) before assist
+#   SC   assist starts at SC% of the level current ...
+#   SSM  ... and ramps to 100% in SSM * 0.25s
+#   CD   current drops as cadence rises from 60 to 120 rpm, CD 8 none
+#   KC   current never decays below KC% of the level current
+#   SD   assist carries on SD * 10ms after pedalling stops ...
+#   TS   ... then falls to nothing over TS * 10ms
+#   ALCn level current is ALCn% of LC, ALSLn level speed limit is ALSLn%
+#        of SL, assist fades out over the last 2km/h before it
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from collections import OrderedDict
+
+BY_DISPLAY = 0xFF
+DISPLAY_SPEED = 25.0            # km/h assumed when SL is set by display
+PULSES = {0: 12, 1: 12, 2: 32, 3: 24}   # pedal sensor pulses per turn by PT
+RAMP_STEP = 0.25                # seconds of start ramp per SSM step
+PULSE_TIMEOUT = 0.25            # seconds without a pedal pulse to stop
+FADE = 2.0                      # km/h over which assist fades at the limit
+SPARK = ' .:-=+*#%@'
+
+#-----------------------------------------------------------------------
+# Default input, a 12s start, cruise and stop at 20 samples a second
+#-----------------------------------------------------------------------
+def default_input(rate=20.0):
+    t = np.arange(0, 12, 1 / rate)
+    cadence = np.where((t >= 1) & (t < 8), np.clip((t - 1) * 40, 0, 80), 0.0)
+    speed = np.where(t < 8, np.clip((t - 1) * 4, 0, 26), np.clip(26 - (t - 8) * 3, 0, 26))
+    return t, cadence, speed
+
+#-----------------------------------------------------------------------
+# Setting arrays for a list of [basic_dict, pas_dict] configs
+#-----------------------------------------------------------------------
+# Every array has one row per config and level, levels 0-9 for each
+# config in turn, shaped (rows, 1) to broadcast against time.
+def config_arrays(configs):
+    rows = OrderedDict((name, []) for name in ('LC', 'ALC', 'ALSL', 'SL', 'PT', 'SC', 'SSM',
+                                               'SDN', 'SD', 'CD', 'TS', 'KC'))
+    for basic, pas in configs:
+        for level in range(10):
+            rows['LC'].append(basic['LC'][0])
+            rows['ALC'].append(basic['ALC{0}'.format(level)][0])
+            rows['ALSL'].append(basic['ALSL{0}'.format(level)][0])
+            sl = pas['SL'][0]
+            rows['SL'].append(DISPLAY_SPEED if sl == BY_DISPLAY else sl)
+            rows['PT'].append(PULSES.get(pas['PT'][0], 12))
+            for key in ('SC', 'SSM', 'SDN', 'SD', 'CD', 'TS', 'KC'):
+                rows[key].append(pas[key][0])
+    return OrderedDict((name, np.array(vals, dtype=np.float64)[:, None])
+                       for name, vals in rows.items())
+
+# Time of the last True at or before each sample along each row, -inf if none
+def last_time(t, mask):
+    return np.maximum.accumulate(np.where(mask, t, -np.inf), axis=1)
+
+# Samples where a row goes from False to True
+def rising(mask):
+    edge = mask.copy()
+    edge[:, 1:] &= ~mask[:, :-1]
+    return edge
+
+#-----------------------------------------------------------------------
+# Motor current for every config and level over the input
+#-----------------------------------------------------------------------
+# t in seconds, cadence in rpm, speed in km/h, all the same length.
+# Returns amps shaped (configs * 10, samples).
+def simulate(configs, t, cadence, speed):
+    p = config_arrays(configs)
+    t = np.asarray(t, dtype=np.float64)[None, :]
+    cadence = np.asarray(cadence, dtype=np.float64)[None, :]
+    speed = np.asarray(speed, dtype=np.float64)[None, :]
+
+    # seconds between pedal pulses
+    pulse = np.where(cadence > 0, 60.0 / np.maximum(cadence, 1e-9) / p['PT'], np.inf)
+    pedalling = pulse <= PULSE_TIMEOUT
+
+    # assist starts SDN pulses into each pedalling run
+    run_start = last_time(t, rising(pedalling))
+    with np.errstate(invalid='ignore'):
+        on = pedalling & (t - run_start >= p['SDN'] * pulse)
+    assist_start = last_time(t, rising(on))
+    # after the stop delay the current falls away over TS
+    stopped = t - last_time(t, on) - p['SD'] * 0.01
+    stop = np.where(stopped <= 0, 1.0, 1 - stopped / np.maximum(p['TS'] * 0.01, 1e-9))
+    stop = np.where(on, 1.0, np.clip(stop, 0, 1))
+
+    ramp = np.clip((t - assist_start) / np.maximum(p['SSM'] * RAMP_STEP, 1e-9), 0, 1)
+    level = p['SC'] / 100 + (1 - p['SC'] / 100) * ramp
+    decay = (8 - np.clip(p['CD'], 1, 8)) / 8 * np.clip((cadence - 60) / 60, 0, 1)
+    level = np.minimum(level, np.maximum(1 - decay, p['KC'] / 100))
+    # once pedalling stops the current holds where it was
+    level = np.broadcast_to(level, on.shape)
+    held = np.maximum.accumulate(np.where(on, np.arange(on.shape[1]), 0), axis=1)
+    level = np.take_along_axis(level, held, axis=1)
+    limit = p['SL'] * p['ALSL'] / 100
+    fade = np.clip((limit - speed) / FADE, 0, 1)
+    return p['LC'] * p['ALC'] / 100 * level * fade * stop
+
+#-----------------------------------------------------------------------
+# Figures for each row of simulate()
+#-----------------------------------------------------------------------
+def curve_summary(t, amps):
+    t = np.asarray(t, dtype=np.float64)
+    peak = amps.max(axis=1)
+    first = np.argmax(amps > 0, axis=1)
+    rise = np.argmax(amps >= 0.9 * peak[:, None], axis=1)
+    rise_s = np.where(peak > 0, t[rise] - t[first], np.nan)
+    nonzero = amps > 0
+    last = amps.shape[1] - 1 - np.argmax(nonzero[:, ::-1], axis=1)
+    dt = np.diff(t)
+    charge = ((amps[:, 1:] + amps[:, :-1]) / 2 * dt).sum(axis=1)
+    return OrderedDict([('peak', peak), ('rise', rise_s),
+                        ('start', np.where(peak > 0, t[first], np.nan)),
+                        ('stop', np.where(peak > 0, t[last], np.nan)),
+                        ('average', charge / (t[-1] - t[0]))])
+
+#-----------------------------------------------------------------------
+# A curve as one line of characters, width samples wide
+#-----------------------------------------------------------------------
+def sparkline(amps, top, width=60):
+    idx = np.linspace(0, len(amps) - 1, width).astype(np.int64)
+    steps = np.clip(amps[idx] / top * (len(SPARK) - 1), 0, len(SPARK) - 1) if top > 0 else idx * 0
+    return ''.join(SPARK[int(round(s))] for s in steps)
+
+#-----------------------------------------------------------------------
+# Report lines for a set of named configs, used by the CLI and the GUI
+#-----------------------------------------------------------------------
+def simulation_report(names, configs, t, cadence, speed, levels=range(1, 10), width=60):
+    amps = simulate(configs, t, cadence, speed)
+    summary = curve_summary(t, amps)
+    top = amps.max()
+    lines = ['PAS simulation over {0:.1f}s, peak {1:.1f}A, cadence and speed:'.format(
+             t[-1] - t[0], top)]
+    lines.append('  rpm  {0}'.format(sparkline(np.asarray(cadence, dtype=np.float64),
+                                               max(np.max(cadence), 1), width)))
+    lines.append('  km/h {0}'.format(sparkline(np.asarray(speed, dtype=np.float64),
+                                               max(np.max(speed), 1), width)))
+    for n, name in enumerate(names):
+        lines.append('')
+        lines.append('[{0}]'.format(name))
+        lines.append('  lvl  {0}  peak   rise  start  stop   avg'.format('current'.ljust(width)))
+        for level in levels:
+            row = n * 10 + level
+            if summary['peak'][row] > 0:
+                times = '{0:5.2f}s {1:5.2f}s {2:5.2f}s'.format(
+                    summary['rise'][row], summary['start'][row], summary['stop'][row])
+            else:
+                times = '    -      -      - '
+            lines.append('  {0:<4} {1}  {2:4.1f}A {3} {4:4.1f}A'.format(
+                level, sparkline(amps[row], top, width), summary['peak'][row],
+                times, summary['average'][row]))
+    return lines
+
+#-----------------------------------------------------------------------
+# Cadence and speed from a log, time plus cadence and speed (or rpm)
+#-----------------------------------------------------------------------
+# A ValueError names what the log is missing, rows without a reading
+# are left out.
+def load_input(filename, wd=56):
+    from bdac_analytics import load_series, columns, finite_rows, speed_kmh
+    series = load_series(filename)
+    t, cadence = columns(series, 'time', 'cadence')
+    if 'speed' in series:
+        speed = series['speed']
+    else:
+        speed = speed_kmh(columns(series, 'rpm')[0], wd)
+    t, cadence, speed = finite_rows(t, cadence, speed)
+    if len(t) < 2:
+        raise ValueError('fewer than 2 samples in the log')
+    return t, cadence, speed
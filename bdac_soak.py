@@ -0,0 +1,237 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Soak harness (bdac --soak).  Runs thousands of read, write and
+# telemetry cycles through read_config against the controller stand-in,
+# with a FaultSerial between them that spoils a share of the replies:
+#
+#   timeout    no reply at all, after the port's timeout
+#   truncate   only the first part of the reply
+#   checksum   one bit of the reply flipped
+#
+# Every so many cycles a sample is taken of throughput, latency (median
+# and 99th percentile of the cycles since the last sample), resident
+# memory, open file descriptors and the files the run left on disk.  At
+# the end the first and last samples are compared and anything still
+# growing is pointed out, memory or descriptors that leak, latency that
+# drifts, logs and snapshots nothing ever trims.
+#
+# The clock is moved on a second per cycle, as a station's would, so
+# names and stamps in the logs and snapshots look like a run of days.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import random
+import resource
+
+from collections import OrderedDict
+
+RATE = 0.02                 # share of commands given a fault
+FAULTS = ('timeout', 'truncate', 'checksum')
+MIX = ('read', 'telemetry', 'read', 'telemetry', 'write')
+SAMPLES = 20                # samples over a run
+PACE = 1.0                  # clock seconds per cycle
+RSS_GROWTH = 256            # KB per 1000 cycles that counts as a leak
+DRIFT = 0.5                 # latency up by this much counts as drift
+COLUMNS = ('cycle', 'seconds', 'rate', 'p50_ms', 'p99_ms', 'rss_kb', 'fds',
+           'disk_kb', 'files', 'errors')
+
+#-----------------------------------------------------------------------
+# Serial port that spoils some replies
+#-----------------------------------------------------------------------
+# port is the stand-in, or anything with its write/flush/read.  A fault
+# is chosen when a command is written and applied to its reply.
+class FaultSerial():
+
+    def __init__(self, port, rate=RATE, seed=None, clock=None):
+        self.port = port
+        self.rate = rate
+        self.random = random.Random(seed)
+        self.clock = clock if clock is not None else port.clock
+        self.timeout = port.timeout
+        self.faults = OrderedDict((kind, 0) for kind in FAULTS)
+        self.fault = None
+
+    def write(self, cm):
+        self.fault = None
+        if self.random.random() < self.rate:
+            self.fault = self.random.choice(FAULTS)
+            self.faults[self.fault] += 1
+        return self.port.write(cm)
+
+    def flush(self):
+        self.port.flush()
+
+    def read(self, size):
+        fault = self.fault
+        self.fault = None
+        resp = self.port.read(size)
+        if fault is None or not resp:
+            return resp
+        # what the controller would still send is lost with the fault
+        self.port.read(4096)
+        if fault == 'timeout':
+            self.clock.sleep(self.timeout)
+            return b''
+        if fault == 'truncate':
+            return resp[:self.random.randrange(len(resp))]
+        i = self.random.randrange(len(resp))
+        return resp[:i] + bytes((resp[i] ^ (1 << self.random.randrange(8)),)) + resp[i + 1:]
+
+    def close(self):
+        self.port.close()
+
+#-----------------------------------------------------------------------
+# Process and disk measurements, None where the system has no /proc
+#-----------------------------------------------------------------------
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+def open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd')) - 1     # less the listing's own
+    except OSError:
+        return None
+
+def disk_usage(path):
+    total = 0
+    files = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+                files += 1
+            except OSError:
+                pass
+    return total // 1024, files
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+# least squares slope of ys over xs
+def slope(xs, ys):
+    if len(xs) < 2:
+        return 0.0
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    den = sum((x - mx) ** 2 for x in xs)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / den if den else 0.0
+
+#-----------------------------------------------------------------------
+# Run the soak
+#-----------------------------------------------------------------------
+# ops maps the names in MIX to functions of the cycle number returning
+# True when the cycle did what it should and False when it failed the
+# way it should, with nothing changed or wrong taken as right.  expected
+# are the exception types that are such a failure too, a reply refused
+# as garbled.  Any other exception is a bug, counted by its type.
+# Returns the samples and the errors.
+def soak(ops, cycles, path='.', clock=None, report=print, csv=None, expected=()):
+    names = [name for name in MIX if name in ops]
+    every = max(1, cycles // SAMPLES)
+    samples = []
+    errors = OrderedDict()
+    latencies = []
+    if csv is not None:
+        csv.write(','.join(COLUMNS) + '\n')
+    report(' '.join('{0:>8}'.format(c) for c in COLUMNS))
+    start = last = time.perf_counter()
+    for n in range(cycles):
+        name = names[n % len(names)]
+        began = time.perf_counter()
+        try:
+            error = None if ops[name](n) else 'failed'
+        except expected as e:
+            error = 'failed ' + type(e).__name__
+        except Exception as e:
+            error = type(e).__name__
+        latencies.append(time.perf_counter() - began)
+        if error is not None:
+            key = '{0} {1}'.format(name, error)
+            errors[key] = errors.get(key, 0) + 1
+        if clock is not None and hasattr(clock, 'advance'):
+            clock.advance(PACE)
+        if (n + 1) % every and n + 1 != cycles:
+            continue
+        now = time.perf_counter()
+        disk, files = disk_usage(path)
+        sample = OrderedDict([('cycle', n + 1), ('seconds', round(now - start, 2)),
+                              ('rate', round(len(latencies) / max(now - last, 1e-9), 1)),
+                              ('p50_ms', round(percentile(latencies, 0.5) * 1000, 3)),
+                              ('p99_ms', round(percentile(latencies, 0.99) * 1000, 3)),
+                              ('rss_kb', rss_kb()), ('fds', open_fds()),
+                              ('disk_kb', disk), ('files', files),
+                              ('errors', sum(errors.values()))])
+        samples.append(sample)
+        line = ['' if sample[c] is None else str(sample[c]) for c in COLUMNS]
+        if csv is not None:
+            csv.write(','.join(line) + '\n')
+            csv.flush()
+        report(' '.join('{0:>8}'.format(v) for v in line))
+        latencies = []
+        last = now
+    return samples, errors
+
+#-----------------------------------------------------------------------
+# Compare the start of a run with its end, returns (lines, warnings)
+#-----------------------------------------------------------------------
+# The first sample is left out of the trends, imports and caches fill
+# while it is taken.
+def soak_summary(samples, errors, faults=None):
+    lines = []
+    warnings = []
+    if not samples:
+        return lines, warnings
+    steady = samples[1:] if len(samples) > 2 else samples
+    first, end = steady[0], steady[-1]
+    per = lambda key: 1000 * slope([s['cycle'] for s in steady], [s[key] for s in steady])
+
+    lines.append('{0} cycles in {1}s, {2:.1f} station hours'.format(
+                 end['cycle'], end['seconds'], end['cycle'] * PACE / 3600))
+    lines.append('Throughput {0} -> {1} cycles/s'.format(first['rate'], end['rate']))
+    for key in ('p50_ms', 'p99_ms'):
+        lines.append('Latency {0} {1} -> {2} ms'.format(key[:3], first[key], end[key]))
+    if first['p50_ms'] and end['p50_ms'] > first['p50_ms'] * (1 + DRIFT):
+        warnings.append('Latency drifts up, median {0} -> {1} ms'.format(
+                        first['p50_ms'], end['p50_ms']))
+    if first['rss_kb'] is not None:
+        growth = per('rss_kb')
+        lines.append('Memory {0} -> {1} KB, {2:+.0f} KB per 1000 cycles'.format(
+                     first['rss_kb'], end['rss_kb'], growth))
+        if growth > RSS_GROWTH:
+            warnings.append('Memory keeps growing, {0:.0f} KB per 1000 cycles'.format(growth))
+    if first['fds'] is not None:
+        lines.append('Open files {0} -> {1}'.format(first['fds'], end['fds']))
+        if end['fds'] > first['fds']:
+            warnings.append('File descriptors leak, {0} -> {1}'.format(first['fds'], end['fds']))
+    growth = per('disk_kb')
+    lines.append('Disk {0} -> {1} KB in {2} files, {3:+.0f} KB per 1000 cycles'.format(
+                 first['disk_kb'], end['disk_kb'], end['files'], growth))
+    if growth > 0:
+        warnings.append('Files grow without bound, {0:.0f} KB and {1:.0f} files per 1000 cycles'.format(
+                        growth, per('files')))
+    if faults:
+        lines.append('Faults injected: ' + ', '.join('{0} {1}'.format(k, v) for k, v in faults.items()))
+    for key, count in errors.items():
+        lines.append('  {0:<28} {1}'.format(key, count))
+        if key.split()[1] != 'failed':
+            warnings.append('{0} raised {1} times'.format(key, count))
+    return lines, warnings
@@ -0,0 +1,130 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Controller stand-in (bdac --standin ...).  StandInSerial takes the place
+# of the serial port and answers like a BBS02 controller: INFO, reads of
+# the BASIC, PAS and THROTTLE areas, writes to them and the status
+# commands.  A write with a value out of range is refused with the error
+# code the controller gives for the first bad field, a write that is
+# accepted changes what later reads return.
+#
+# Replies are ready at once.  latency gives every read a delay, taken
+# by sleeping on the clock, which with a VirtualClock costs no time.  A
+# read waits no longer than timeout, as a port does, and a reply slower
+# than that is lost.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from collections import OrderedDict
+from bdac_frames import area_dict
+from bdac_validate import check_value, constraint_dict
+from bdac_clock import clock as real_clock
+
+READ_CMD = 0x11
+WRITE_CMD = 0x16
+INFO = b'\x51\x10\x48\x5a\x58\x54\x53\x5a\x5a\x39\x31\x31\x32\x30\x31\x31\x02\x19\x22'
+
+# Factory settings, the same as the --test data
+AREAS = OrderedDict()
+AREAS['basic'] = b'\x29\x0f\x00\x34\x3a\x40\x46\x4c\x52\x58\x5e\x64\x00\x24\x2c\x34\x3c\x44\x4c\x54\x5c\x64\x38\x01'
+AREAS['pas'] = b'\x03\xff\xff\x32\x04\x04\xff\x19\x08\x00\x3c'
+AREAS['throttle'] = b'\x0b\x24\x01\xff\x28\x0a'
+
+# Status command replies
+STATUS = {0x08: b'\x01',                # normal
+          0x0a: b'\x00\x00',            # 0 watts, checksum
+          0x11: b'\x50\x50',            # 80% battery, checksum
+          0x20: b'\x00\x20\x20'}        # 32 wheel rpm, checksum
+
+#-----------------------------------------------------------------------
+# Controller error code for a refused field
+#-----------------------------------------------------------------------
+# BASIC error codes pair each level's current and speed limit, ALC0
+# ALSL0 ALC1 ..., while the area holds ALC0-9 then ALSL0-9.  The other
+# areas number their errors in byte order.
+def error_code(area, index):
+    if area == 'basic' and 2 <= index < 12:
+        return 2 + (index - 2) * 2
+    if area == 'basic' and 12 <= index < 22:
+        return 3 + (index - 12) * 2
+    return index
+
+class StandInSerial():
+
+    def __init__(self, areas=None, latency=0.0, clock=None):
+        self.clock = clock if clock is not None else real_clock
+        self.latency = latency
+        self.timeout = 1
+        self.lock = threading.Lock()
+        self.areas = OrderedDict((area, bytearray(data))
+                                 for area, data in (areas or AREAS).items())
+        self.sections = dict((area_dict[area][0], area) for area in area_dict)
+        self.out = b''
+        self.writes = 0
+        self.refused = 0
+
+    #-------------------------------------------------------------------
+    # Reply to a command
+    #-------------------------------------------------------------------
+    def answer(self, cm):
+        if len(cm) < 2:
+            return b''
+        if cm[0] == READ_CMD and cm[1] == INFO[0]:
+            return INFO
+        if cm[0] == READ_CMD and cm[1] in self.sections:
+            data = bytes(self.areas[self.sections[cm[1]]])
+            return bytes((cm[1], len(data))) + data + bytes(((cm[1] + len(data) + sum(data)) % 256,))
+        if cm[0] == READ_CMD and cm[1] in STATUS:
+            return STATUS[cm[1]]
+        if cm[0] == WRITE_CMD and cm[1] in self.sections and len(cm) >= 4:
+            return self.write_area(self.sections[cm[1]], cm)
+        return b''
+
+    def write_area(self, area, cm):
+        section, length, name = area_dict[area]
+        data = cm[3:-1]
+        # a garbled frame gets no reply at all
+        if cm[2] != length or len(data) != length or (section + length + sum(data)) % 256 != cm[-1]:
+            return b''
+        self.writes += 1
+        for index, (key, val) in enumerate(zip(constraint_dict[area], data)):
+            if check_value(area, key, val):
+                self.refused += 1
+                return bytes((section, 0, error_code(area, index)))
+        self.areas[area][:] = data
+        return bytes((section, length))
+
+    def write(self, cm):
+        cm = bytes(cm)
+        with self.lock:
+            self.out = self.answer(cm)
+        return len(cm)
+
+    def flush(self):
+        pass
+
+    def read(self, size):
+        if self.latency:
+            self.clock.sleep(min(self.latency, self.timeout))
+        with self.lock:
+            if self.latency > self.timeout:
+                self.out = b''
+            resp = self.out[:size]
+            self.out = self.out[size:]
+        return resp
+
+    def close(self):
+        pass
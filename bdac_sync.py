@@ -0,0 +1,194 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Station sync through a shared directory or USB stick (bdac --export,
+# bdac --import).  The sync directory holds delta bundles (.bdacb), one
+# per export, named after the station and time.  Every record is named
+# by the sha1 of its content:
+#
+#   snapshot   a time stamped -config.bdac file and its name
+#   log        a piece of bdac.log, the station it came from and where
+#              in that log it starts
+#
+# Export reads only the indexes of the bundles already there and writes
+# what none of them holds, so an export costs what is new since the last
+# one.  bdac.log is cut at the first line end after every 64k, pieces
+# before the last stay the same as the log grows, the last is sent
+# again once it has grown.
+#
+# A station is named by its host name unless given one.
+#
+# Import writes snapshots it does not have into the current directory
+# and other stations' logs to sync-logs/<station>-bdac.log, and keeps the
+# hashes it has applied in bdac.sync so a bundle is only read once.  A
+# snapshot whose name is already taken here by a different file, two
+# stations writing in the same second, is saved with the start of its
+# hash added to the name and reported.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import socket
+import hashlib
+
+from collections import OrderedDict
+from bdac_bundle import Bundle, EXTENSION
+
+SEGMENT = 65536
+LOG = 'bdac.log'
+STATE = 'bdac.sync'
+LOG_DIR = 'sync-logs'
+SNAPSHOT_END = '-config.bdac'
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+def station_name():
+    return socket.gethostname().split('.')[0] or 'station'
+
+#-----------------------------------------------------------------------
+# Pieces of a log, [start offset, bytes], cut at line ends
+#-----------------------------------------------------------------------
+def log_segments(filename, size=SEGMENT):
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    segments = []
+    start = 0
+    while start < len(data):
+        end = data.find(b'\n', start + size - 1)
+        end = len(data) if end < 0 else end + 1
+        segments.append([start, data[start:end]])
+        start = end
+    return segments
+
+#-----------------------------------------------------------------------
+# Everything this station has to offer, hash -> (record, stamp)
+#-----------------------------------------------------------------------
+def local_records(path='.', station=None):
+    station = station or station_name()
+    records = OrderedDict()
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(SNAPSHOT_END):
+            continue
+        filename = os.path.join(path, name)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            text = data.decode()
+            json.loads(text)
+        except (OSError, ValueError):
+            continue
+        # kept as text so the copy on the other side hashes the same
+        records[content_hash(data)] = (OrderedDict([('kind', 'snapshot'), ('name', name),
+                                                    ('text', text)]),
+                                       os.path.getmtime(filename))
+    for start, data in log_segments(os.path.join(path, LOG)):
+        records[content_hash(data)] = (OrderedDict([('kind', 'log'), ('station', station),
+                                                    ('start', start),
+                                                    ('text', data.decode('utf-8', 'replace'))]),
+                                       time.time())
+    return records
+
+def sync_bundles(syncdir):
+    return sorted(os.path.join(syncdir, f) for f in os.listdir(syncdir)
+                  if f.endswith(EXTENSION))
+
+#-----------------------------------------------------------------------
+# Write a delta bundle of what the sync directory does not hold yet
+#-----------------------------------------------------------------------
+# Returns (records exported, bytes written, bundle filename or None)
+def export_delta(syncdir, path='.', station=None):
+    station = station or station_name()
+    os.makedirs(syncdir, exist_ok=True)
+    known = set()
+    for filename in sync_bundles(syncdir):
+        known.update(Bundle(filename).names())
+    items = [(h, record, stamp) for h, (record, stamp) in local_records(path, station).items()
+             if h not in known]
+    if not items:
+        return 0, 0, None
+    # names sort in the order a station exported them
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    n = 0
+    while True:
+        filename = os.path.join(syncdir, '{0}-{1}-{2:03d}{3}'.format(station, stamp, n, EXTENSION))
+        if not os.path.exists(filename):
+            break
+        n += 1
+    # written aside and renamed so an importer never sees half a bundle
+    Bundle(filename + '.part').add(items)
+    os.replace(filename + '.part', filename)
+    return len(items), os.path.getsize(filename), filename
+
+#-----------------------------------------------------------------------
+# Apply every delta bundle in the sync directory not applied before
+#-----------------------------------------------------------------------
+# Returns (snapshots written, log pieces written)
+def import_deltas(syncdir, path='.', station=None, report=print):
+    station = station or station_name()
+    state = os.path.join(path, STATE)
+    try:
+        with open(state) as f:
+            seen = set(json.load(f))
+    except (OSError, ValueError):
+        seen = set()
+    ours = set(local_records(path, station))
+    snapshots = 0
+    logs = 0
+    for filename in sync_bundles(syncdir):
+        bundle = Bundle(filename)
+        if seen.issuperset(bundle.names()):
+            continue
+        for h, stamp, record in bundle.records():
+            if h in seen or h in ours:
+                seen.add(h)
+                continue
+            if record['kind'] == 'snapshot':
+                name = os.path.basename(record['name'])
+                target = os.path.join(path, name)
+                if os.path.exists(target):
+                    # the same content would be one of ours
+                    if name.endswith(SNAPSHOT_END):
+                        name = name[:-len(SNAPSHOT_END)]
+                    name = '{0}-{1}{2}'.format(name, h[:8], SNAPSHOT_END)
+                    report('{0} differs from the one here, saved as {1}'.format(
+                           record['name'], name))
+                    target = os.path.join(path, name)
+                if not os.path.exists(target):
+                    with open(target, 'wb') as f:
+                        f.write(record['text'].encode())
+                    os.utime(target, (stamp, stamp))
+                    snapshots += 1
+            elif record['kind'] == 'log' and record['station'] != station:
+                logdir = os.path.join(path, LOG_DIR)
+                os.makedirs(logdir, exist_ok=True)
+                target = os.path.join(logdir, '{0}-{1}'.format(
+                                      os.path.basename(record['station']), LOG))
+                with open(target, 'r+b' if os.path.exists(target) else 'w+b') as f:
+                    # a piece sent again after growing replaces the old one
+                    f.seek(record['start'])
+                    f.write(record['text'].encode('utf-8'))
+                    f.truncate()
+                logs += 1
+            seen.add(h)
+        report('Applied {0}...'.format(os.path.basename(filename)))
+    with open(state + '.tmp', 'w') as f:
+        json.dump(sorted(seen), f)
+    os.replace(state + '.tmp', state)
+    return snapshots, logs
@@ -0,0 +1,167 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Response time calibration.  Every command's round trip is measured and
+# remembered per controller model, and the read deadline for the next one
+# is taken from the recent times (95th percentile plus a margin) instead
+# of always waiting a full second.  Until there are enough samples the
+# old conservative waits are used.  A reply that does not come in time is
+# recorded as twice the wait it was given, and the last time recorded is
+# always allowed for, so a slow controller's waits back off upward, past
+# the old ones if need be, up to CEILING.  Estimates are kept in
+# bdac.timing between runs.
+#
+# The model is learned from each port's INFO reply and kept per port, so
+# sessions on different controllers do not share estimates.  The timer
+# is switched off for the stand-in, replays and the soak, their times say
+# nothing about a real controller and would only drag its deadlines down.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import atexit
+import weakref
+import threading
+
+from collections import deque
+from bdac_frames import area_dict
+from bdac_metrics import command_name
+
+TIMING = 'bdac.timing'
+
+SAMPLES = 50        # response times kept per model and command
+MIN_SAMPLES = 5     # below this the default is used
+PERCENTILE = 95
+MARGIN = 1.5        # deadline = percentile * MARGIN + SLACK
+SLACK = 0.05
+MIN_DEADLINE = 0.1
+BACKOFF = 2.0       # a timeout is recorded as the wait given * BACKOFF
+CEILING = 5.0       # longest wait for any reply
+
+READ_DEFAULT = 1.0  # the old fixed wait
+WRITE_DEFAULT = 2.0 # writes also program flash
+
+READ_CMD = 0x11
+WRITE_CMD = 0x16
+INFO_AREA = 0x51
+INFO_LENGTH = 19
+
+section_length = dict((v[0], v[1]) for v in area_dict.values())
+
+#-----------------------------------------------------------------------
+# Bytes expected back for a command, None if we do not know
+#-----------------------------------------------------------------------
+# Area reads answer command, length, data and checksum.  A write answers
+# the section and length, or section, 0 and an error code, the caller
+# reads the third byte when the length does not match.
+def response_length(cm):
+    if len(cm) < 2:
+        return None
+    if cm[0] == READ_CMD and cm[1] in section_length:
+        return section_length[cm[1]] + 3
+    if cm[0] == READ_CMD and cm[1] == INFO_AREA:
+        return INFO_LENGTH
+    if cm[0] == WRITE_CMD and cm[1] in section_length:
+        return 2
+    return None
+
+def percentile(values, p):
+    ordered = sorted(values)
+    i = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[i]
+
+class ResponseTimer():
+
+    def __init__(self, filename=TIMING):
+        self.filename = filename
+        self.enabled = True
+        self.models = weakref.WeakKeyDictionary()   # port -> model
+        self.samples = None     # model -> command -> deque of seconds
+        self.lock = threading.Lock()
+
+    def load(self):
+        self.samples = dict()
+        try:
+            with open(self.filename) as f:
+                for model, commands in json.load(f).items():
+                    self.samples[model] = dict((name, deque(times, SAMPLES))
+                                               for name, times in commands.items())
+        except (OSError, ValueError, AttributeError):
+            pass
+        atexit.register(self.save)
+
+    def save(self):
+        with self.lock:
+            data = dict((model, dict((name, list(times)) for name, times in commands.items() if times))
+                        for model, commands in self.samples.items())
+        try:
+            with open(self.filename, 'w') as f:
+                json.dump(data, f)
+        except OSError:
+            pass
+
+    def model(self, port):
+        try:
+            return self.models.get(port, 'unknown')
+        except TypeError:
+            return 'unknown'
+
+    def times(self, model, name):
+        if self.samples is None:
+            self.load()
+        return self.samples.setdefault(model, dict()).setdefault(name, deque(maxlen=SAMPLES))
+
+    #-------------------------------------------------------------------
+    # Read deadline for a command in seconds
+    #-------------------------------------------------------------------
+    def deadline(self, cm, port=None):
+        default = WRITE_DEFAULT if cm[0] == WRITE_CMD else READ_DEFAULT
+        if not self.enabled:
+            return default
+        with self.lock:
+            times = self.times(self.model(port), command_name(cm))
+            if len(times) < MIN_SAMPLES:
+                estimate = default
+            else:
+                estimate = percentile(times, PERCENTILE) * MARGIN + SLACK
+            if times:
+                estimate = max(estimate, times[-1] * MARGIN + SLACK)
+        return min(max(estimate, MIN_DEADLINE), CEILING)
+
+    #-------------------------------------------------------------------
+    # Record a round trip, a short response waited the whole deadline
+    # and is recorded as BACKOFF times that, so the next wait is longer
+    #-------------------------------------------------------------------
+    def observe(self, cm, resp, seconds, expected, port=None):
+        if not self.enabled:
+            return
+        if expected is not None and len(resp) < expected:
+            seconds = min(max(seconds, self.deadline(cm, port)) * BACKOFF, CEILING)
+        with self.lock:
+            if cm[0] == READ_CMD and cm[1] == INFO_AREA and len(resp) >= 10 and port is not None:
+                try:
+                    self.models[port] = resp[6:10].decode('ascii', 'replace')
+                except TypeError:
+                    pass
+            self.times(self.model(port), command_name(cm)).append(seconds)
+
+    def estimates(self):
+        with self.lock:
+            if self.samples is None:
+                self.load()
+            return dict((model, dict((name, percentile(times, PERCENTILE))
+                                     for name, times in commands.items() if times))
+                        for model, commands in self.samples.items())
+
+timer = ResponseTimer()
@@ -0,0 +1,123 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Timing spans for serial commands, area reads and writes, transactions,
+# file operations and screen refreshes, saved in Chrome trace event
+# format (bdac --trace out.json) to open in chrome://tracing or Perfetto.
+# When tracing is off a span is a shared object that does nothing.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+
+class NullSpan():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span():
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.tracer.add(self.name, self.cat, self.start, end - self.start, self.args)
+        return False
+
+class Tracer():
+
+    def __init__(self):
+        self.enabled = False
+        self.filename = None
+        self.events = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def start(self, filename):
+        self.filename = filename
+        self.events = []
+        self.origin = time.perf_counter()
+        self.enabled = True
+        atexit.register(self.save)
+
+    def span(self, name, cat='bdac', **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, cat, args)
+
+    def add(self, name, cat, start, duration, args):
+        event = {'name': name, 'cat': cat, 'ph': 'X',
+                 'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6,
+                 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if args:
+            event['args'] = args
+        with self.lock:
+            self.events.append(event)
+
+    def save(self):
+        if not self.enabled:
+            return
+        with self.lock:
+            events = list(self.events)
+        with open(self.filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+tracer = Tracer()
+
+#-----------------------------------------------------------------------
+# Decorator, one span per call of the function
+#-----------------------------------------------------------------------
+def traced(name, cat='bdac'):
+    def wrap(func):
+        @functools.wraps(func)
+        def call(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with Span(tracer, name, cat, None):
+                return func(*args, **kwargs)
+        return call
+    return wrap
+
+#-----------------------------------------------------------------------
+# Curses window whose refresh() is traced, only used when tracing
+#-----------------------------------------------------------------------
+class TracedWindow():
+
+    def __init__(self, window):
+        self.window = window
+
+    def refresh(self, *args):
+        with tracer.span('screen refresh', 'screen'):
+            return self.window.refresh(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.window, name)
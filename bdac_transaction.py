@@ -0,0 +1,219 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# All or nothing writing of the BASIC, PAS and THROTTLE areas.  The
+# current controller areas are saved first, only changed areas are
+# written, everything touched is read back once to verify and on any
+# failure the saved areas are written back.  Every step goes to a
+# journal (bdac.journal) so an interrupted write can be resumed.
+# A reply that is missing, short or garbled, or any other error from a
+# serial step, is a failure like a refused write.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+
+from collections import OrderedDict
+from bdac_frames import area_dict, build_frame
+from bdac_validate import validate_area
+from bdac_trace import traced
+
+JOURNAL = 'bdac.journal'
+
+#-----------------------------------------------------------------------
+# Journal, one json object per line, synced to disk on every entry
+#-----------------------------------------------------------------------
+# journal is a filename, or an object with a write(entry) method that
+# returns once the entry is on disk (see bdac_batch.BatchJournal).
+def journal_write(entry, journal=JOURNAL):
+    entry['stamp'] = time.strftime('%Y%m%d_%H%M%S', time.localtime())
+    if not isinstance(journal, str):
+        journal.write(entry)
+        return
+    with open(journal, mode='a') as f:
+        f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_journal(journal=JOURNAL):
+    entries = []
+    try:
+        with open(journal, 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    pass    # torn last line from a crash
+    except OSError:
+        pass
+    return entries
+
+#-----------------------------------------------------------------------
+# Find the last transaction that never committed or rolled back
+#-----------------------------------------------------------------------
+def unfinished_transaction(journal=JOURNAL):
+    begun = OrderedDict()
+    for entry in read_journal(journal):
+        if entry.get('state') == 'begin':
+            begun[entry['id']] = entry
+        elif entry.get('state') in ('commit', 'rollback'):
+            begun.pop(entry.get('id'), None)
+    if not begun:
+        return None
+    return begun[list(begun)[-1]]
+
+def area_values(dic):
+    return [dic[key][0] for key in dic]
+
+def write_ok(area, resp):
+    return len(resp) >= 2 and resp[1] == area_dict[area][1]
+
+# run one serial step, returns (result, None) or (None, error text)
+def serial_step(func, *args):
+    try:
+        return func(*args), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+#-----------------------------------------------------------------------
+# Write areas as one transaction
+#-----------------------------------------------------------------------
+# targets    - OrderedDict of area name -> [value, description] dictionary
+# get_config - dictionary of area name -> get_*_config function
+# read_config - function sending a frame and returning the response
+# report     - called with a progress message for each step
+# Returns True if the controller now holds the targets.
+@traced('transaction', 'transaction')
+def write_transaction(targets, get_config, read_config, report=print,
+                      journal=JOURNAL, tid=None):
+    # copy now, get_*_config may reuse the dictionaries we were given
+    targets = OrderedDict((area, dic.copy()) for area, dic in targets.items())
+    if tid is None:
+        tid = '{0}-{1}'.format(time.strftime('%Y%m%d_%H%M%S', time.localtime()), os.getpid())
+
+    for area, dic in targets.items():
+        errors = validate_area(area, dic)
+        if errors:
+            report('{0} config failed validation, nothing written...'.format(area_dict[area][2]))
+            for err in errors:
+                report('  {0}'.format(err))
+            return False
+
+    journal_write({'id': tid, 'state': 'begin',
+                   'targets': targets}, journal)
+
+    # snapshot what the controller has now
+    snapshot = OrderedDict()
+    for area in targets:
+        report('Reading {0} flash area...'.format(area_dict[area][2]))
+        dic, error = serial_step(get_config[area])
+        if error is not None:
+            failed = 'Could not read {0} config - {1}'.format(area_dict[area][2], error)
+            report(failed)
+            journal_write({'id': tid, 'state': 'rollback', 'error': failed}, journal)
+            report('Nothing was written, controller unchanged...')
+            return False
+        snapshot[area] = dic.copy()
+    dirty = [area for area in targets
+             if area_values(targets[area]) != area_values(snapshot[area])]
+    journal_write({'id': tid, 'state': 'snapshot', 'snapshot': snapshot,
+                   'dirty': dirty}, journal)
+    if not dirty:
+        report('Controller already matches, nothing to write...')
+        journal_write({'id': tid, 'state': 'commit', 'written': []}, journal)
+        return True
+
+    written = []
+    failed = None
+    for area in dirty:
+        report('Writing {0} flash area...'.format(area_dict[area][2]))
+        resp, error = serial_step(read_config, build_frame(area, targets[area]))
+        if error is not None:
+            # no telling whether it reached the controller
+            written.append(area)
+            failed = 'Error writing to {0} config - {1}'.format(area_dict[area][2], error)
+            break
+        # an error code means the controller refused it, anything else
+        # (no answer, garbage) might have been written
+        if write_ok(area, resp) or len(resp) < 3:
+            written.append(area)
+        if not write_ok(area, resp) and len(resp) < 3:
+            failed = 'No response when writing to {0} config'.format(area_dict[area][2])
+            break
+        if not write_ok(area, resp):
+            failed = 'Received error code {0} when writing to {1} config'.format(
+                resp[2], area_dict[area][2])
+            break
+        journal_write({'id': tid, 'state': 'written', 'area': area}, journal)
+
+    # single verification pass over everything we touched
+    if failed is None:
+        report('Verifying written areas...')
+        for area in written:
+            dic, error = serial_step(get_config[area])
+            if error is not None:
+                failed = 'Could not verify {0} area - {1}'.format(area_dict[area][2], error)
+                break
+            if area_values(dic) != area_values(targets[area]):
+                failed = '{0} area did not verify after writing'.format(area_dict[area][2])
+                break
+
+    if failed is None:
+        journal_write({'id': tid, 'state': 'commit', 'written': written}, journal)
+        report('Successfully written {0} to controller flash...'.format(
+            ', '.join(area_dict[area][2] for area in written)))
+        return True
+
+    report(failed)
+    if not written:
+        journal_write({'id': tid, 'state': 'rollback', 'error': failed}, journal)
+        report('Nothing was written, controller unchanged...')
+        return False
+    report('Rolling back {0}...'.format(', '.join(area_dict[area][2] for area in written)))
+    restored = True
+    for area in written:
+        resp, error = serial_step(read_config, build_frame(area, snapshot[area]))
+        if error is not None or not write_ok(area, resp):
+            restored = False
+    if restored:
+        for area in written:
+            dic, error = serial_step(get_config[area])
+            if error is not None or area_values(dic) != area_values(snapshot[area]):
+                restored = False
+    if restored:
+        journal_write({'id': tid, 'state': 'rollback', 'error': failed}, journal)
+        report('Controller restored to its previous settings...')
+    else:
+        # leave the transaction open so it can be resumed
+        journal_write({'id': tid, 'state': 'rollback_failed', 'error': failed}, journal)
+        report('Rollback failed, run "bdac --write --resume" to finish...')
+    return False
+
+#-----------------------------------------------------------------------
+# Resume the last unfinished transaction from the journal
+#-----------------------------------------------------------------------
+# The targets are taken from the journal and the whole transaction is
+# run again, areas already holding the targets are simply not rewritten.
+def resume_transaction(get_config, read_config, report=print, journal=JOURNAL):
+    entry = unfinished_transaction(journal)
+    if entry is None:
+        report('No unfinished write in {0}...'.format(journal))
+        return True
+    report('Resuming write {0} from {1}...'.format(entry['id'], entry['stamp']))
+    targets = OrderedDict((area, OrderedDict(entry['targets'][area]))
+                          for area in area_dict if area in entry['targets'])
+    return write_transaction(targets, get_config, read_config, report,
+                             journal, entry['id'])
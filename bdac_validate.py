@@ -0,0 +1,172 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Local range checking of every controller setting so a bad value is
+# caught before any bytes go down the serial line.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from collections import OrderedDict
+from bdac_bundle import load_config, expand_source, BundleError
+
+BY_DISPLAY = 0xFF   # "by display's command" for DA and SL
+
+#-----------------------------------------------------------------------
+# CONSTRAINT TABLE
+#-----------------------------------------------------------------------
+# One entry per field, in controller byte order:
+#   [minimum, maximum, extra allowed values, error text]
+# The error text matches the controller's own error code list, see
+# bdac_standin.error_code for how the codes are numbered.
+constraint_dict = OrderedDict()
+constraint_dict['basic'] = OrderedDict()
+constraint_dict['pas'] = OrderedDict()
+constraint_dict['throttle'] = OrderedDict()
+
+constraint_dict['basic']['LBP'] = [20, 60, (), 'Low Battery Protection out of range']
+constraint_dict['basic']['LC'] = [1, 30, (), 'Current Limit out of range']
+for i in range(10):
+    constraint_dict['basic']['ALC{0}'.format(i)] = [0, 100, (),
+        'Current Limit for PAS{0} out of range'.format(i)]
+for i in range(10):
+    constraint_dict['basic']['ALSL{0}'.format(i)] = [0, 100, (),
+        'Speed Limit for PAS{0} out of range'.format(i)]
+# 16" to 30" wheels, value is inches * 2
+constraint_dict['basic']['WD'] = [0x20, 0x3C, (), 'Wheel Diameter out of range']
+# top 2 bits speed meter model (0-2), low 6 bits signals per revolution (1-63)
+constraint_dict['basic']['SM'] = [0x01, 0xBF, (), 'Speed Meter Signals out of range']
+
+constraint_dict['pas']['PT'] = [0, 3, (), 'Pedal Sensor Type error']
+constraint_dict['pas']['DA'] = [0, 9, (BY_DISPLAY,), 'Designated Assist Level error']
+constraint_dict['pas']['SL'] = [15, 40, (BY_DISPLAY,), 'Speed Limit error']
+constraint_dict['pas']['SC'] = [0, 100, (), 'Start Current out of range']
+constraint_dict['pas']['SSM'] = [1, 8, (), 'Slow-start Mode error']
+constraint_dict['pas']['SDN'] = [2, 24, (), 'Start Degree out of range']
+constraint_dict['pas']['WM'] = [10, 80, (0xFF,), 'Work Mode error']
+constraint_dict['pas']['SD'] = [1, 100, (), 'Stop Delay out of range']
+constraint_dict['pas']['CD'] = [1, 8, (), 'Current Decay out of range']
+constraint_dict['pas']['TS'] = [0, 100, (), 'Stop Decay out of range']
+constraint_dict['pas']['KC'] = [0, 100, (), 'Keep Current out of range']
+
+# throttle handle voltages are * 100mV, controller accepts 1.0V to 4.2V
+constraint_dict['throttle']['SV'] = [10, 42, (), 'Start voltage out of range']
+constraint_dict['throttle']['EV'] = [10, 42, (), 'End voltage out of range']
+constraint_dict['throttle']['MODE'] = [0, 1, (), 'Mode error']
+constraint_dict['throttle']['DA'] = [0, 9, (BY_DISPLAY,), 'Designated Assist error']
+constraint_dict['throttle']['SL'] = [15, 40, (BY_DISPLAY,), 'Speed limit error']
+constraint_dict['throttle']['SC'] = [0, 100, (), 'Start current out of range']
+
+#-----------------------------------------------------------------------
+# Rules that need more than a simple range check
+#-----------------------------------------------------------------------
+# Each rule is [area, first key, second key, test, error text]
+# test is called with the two values and returns True when they are valid.
+cross_rules = [
+    ['throttle', 'SV', 'EV', lambda sv, ev: sv < ev,
+        'Start voltage must be lower than End voltage'],
+    ['basic', 'SM', 'SM', lambda sm, x: (sm >> 6) <= 2 and (sm & 0x3F) >= 1,
+        'Speed Meter model must be 0-2 with at least 1 signal'],
+]
+
+#-----------------------------------------------------------------------
+# Check a single value against the constraint table
+#-----------------------------------------------------------------------
+# Returns None if the value is good or the error text if it is not.
+def check_value(area, key, val):
+    if key not in constraint_dict[area]:
+        return None
+    lo, hi, extra, err = constraint_dict[area][key]
+    if not isinstance(val, int) or isinstance(val, bool):
+        return '{0} {1} is not a number'.format(key, val)
+    if (val < lo or val > hi) and val not in extra:
+        return '{0} {1} - {2} ({3}-{4})'.format(key, val, err, lo, hi)
+    return None
+
+#-----------------------------------------------------------------------
+# Check one config area dictionary ([value, description] pairs)
+#-----------------------------------------------------------------------
+def validate_area(area, dic):
+    errors = []
+    for key in constraint_dict[area]:
+        if key not in dic:
+            errors.append('{0} missing from {1} area'.format(key, area.upper()))
+            continue
+        err = check_value(area, key, dic[key][0])
+        if err:
+            errors.append(err)
+    if errors:
+        return errors
+    for rule_area, k1, k2, test, err in cross_rules:
+        if rule_area == area and not test(dic[k1][0], dic[k2][0]):
+            errors.append(err)
+    return errors
+
+#-----------------------------------------------------------------------
+# Check all three areas, returns a list of error strings
+#-----------------------------------------------------------------------
+def validate_config(basic_dict, pas_dict, throttle_dict):
+    errors = []
+    for area, dic in (('basic', basic_dict), ('pas', pas_dict), ('throttle', throttle_dict)):
+        for err in validate_area(area, dic):
+            errors.append('[{0}] {1}'.format(area.upper(), err))
+    return errors
+
+#-----------------------------------------------------------------------
+# Batch check a list of .bdac files or a whole directory of them
+#-----------------------------------------------------------------------
+# Each file is checked with validate_area, as a config about to be
+# written is.  Returns OrderedDict of filename -> errors.
+def validate_files(filenames):
+    results = OrderedDict()
+    for filename in filenames:
+        results[filename] = errors = []
+        try:
+            fd = load_config(filename)
+        except (OSError, ValueError, KeyError, BundleError) as e:
+            errors.append('Could not read file - {0}'.format(e))
+            continue
+        for area in constraint_dict:
+            if area not in fd:
+                errors.append('[{0}] area missing'.format(area.upper()))
+                continue
+            for err in validate_area(area, fd[area]):
+                errors.append('[{0}] {1}'.format(area.upper(), err))
+    return results
+
+def validate_directory(path):
+    if os.path.isdir(path):
+        filenames = sorted(os.path.join(path, f) for f in os.listdir(path)
+                           if f.endswith('.bdac'))
+    else:
+        filenames = expand_source(path)
+    return validate_files(filenames)
+
+#-----------------------------------------------------------------------
+# Print a validation report, returns number of bad files
+#-----------------------------------------------------------------------
+def print_validation(results):
+    bad = 0
+    for filename, errors in results.items():
+        if errors:
+            bad += 1
+            print('{0} -> INVALID'.format(filename))
+            for err in errors:
+                print('    {0}'.format(err))
+        else:
+            print('{0} -> OK'.format(filename))
+    print('\n{0} files checked, {1} valid, {2} invalid...'.format(
+        len(results), len(results) - bad, bad))
+    return bad
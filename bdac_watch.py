@@ -0,0 +1,131 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Bench watcher (bdac --watch <job>).  /dev/serial/by-id is polled, only
+# re-listed when the directory changes, and every serial adapter that
+# appears is handed to one worker thread which opens it, runs the job
+# and always closes it again.  Jobs run one at a time because the bdac
+# functions share one port.  Unplugging a cable before its turn drops it
+# from the queue, plugging it back in queues it again.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import time
+import queue
+import threading
+
+BY_ID = '/dev/serial/by-id'
+FALLBACK = ('/dev/ttyUSB*', '/dev/ttyACM*')
+
+#-----------------------------------------------------------------------
+# Serial devices present now, by-id names when udev provides them
+#-----------------------------------------------------------------------
+def list_devices(path=BY_ID):
+    if os.path.isdir(path):
+        return set(os.path.join(path, name) for name in os.listdir(path))
+    devices = set()
+    for pattern in FALLBACK:
+        devices.update(glob.glob(pattern))
+    return devices
+
+def dir_stamp(path=BY_ID):
+    # the by-id directory changes mtime on every plug and unplug, without
+    # it /dev itself is watched
+    try:
+        return os.stat(path if os.path.isdir(path) else '/dev').st_mtime_ns
+    except OSError:
+        return None
+
+class Watcher():
+
+    def __init__(self, run_job, path=BY_ID, interval=0.5, report=print):
+        self.run_job = run_job      # run_job(device) -> status text
+        self.path = path
+        self.interval = interval
+        self.report = report
+        self.jobs = queue.Queue()
+        self.queued = set()         # devices waiting for the worker
+        self.present = set()
+        self.lock = threading.Lock()
+        self.running = False
+        self.done = 0
+        self.failed = 0
+
+    def status(self, text):
+        self.report('[{0}] ok {1} failed {2} waiting {3} - {4}'.format(
+            time.strftime('%H:%M:%S'), self.done, self.failed, len(self.queued), text))
+
+    #-------------------------------------------------------------------
+    # Queue devices that were not there last time
+    #-------------------------------------------------------------------
+    def scan(self):
+        devices = list_devices(self.path)
+        with self.lock:
+            added = devices - self.present
+            removed = self.present - devices
+            self.present = devices
+            self.queued -= removed
+            for device in sorted(added):
+                self.queued.add(device)
+                self.jobs.put(device)
+        for device in sorted(added):
+            self.status('{0} plugged in'.format(os.path.basename(device)))
+        for device in sorted(removed):
+            self.status('{0} unplugged'.format(os.path.basename(device)))
+
+    def worker(self):
+        while self.running:
+            try:
+                device = self.jobs.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            with self.lock:
+                if device not in self.queued:
+                    continue        # unplugged while waiting
+                self.queued.discard(device)
+            self.status('{0} running...'.format(os.path.basename(device)))
+            try:
+                ok, text = self.run_job(device)
+            except Exception as e:
+                ok, text = False, str(e)
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+            self.status('{0} {1}'.format(os.path.basename(device), text))
+
+    #-------------------------------------------------------------------
+    # Watch until interrupted, devices already plugged in are ignored
+    # unless existing is True
+    #-------------------------------------------------------------------
+    def watch(self, existing=False):
+        self.running = True
+        if not existing:
+            self.present = list_devices(self.path)
+        thread = threading.Thread(target=self.worker, daemon=True)
+        thread.start()
+        self.status('watching {0}'.format(self.path if os.path.isdir(self.path) else '/dev'))
+        stamp = None
+        try:
+            while True:
+                now = dir_stamp(self.path)
+                if now != stamp:
+                    stamp = now
+                    self.scan()
+                time.sleep(self.interval)
+        finally:
+            self.running = False
+            thread.join()
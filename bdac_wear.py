@@ -0,0 +1,220 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Flash wear ledger.  Every area write that reaches a controller is
+# counted in bdac.wear by controller and area, with the hash of the last
+# frame written.  bdac --wear reports the counts across the fleet.
+#
+# A write of what the controller already holds only wears its flash:
+#   - if this connection has read or written the area and it holds the
+#     same bytes the write is not sent, the controller's own reply to a
+#     good write is returned instead
+#   - if only the ledger knows, from an earlier run, it is sent but a
+#     warning is given, the area may have been changed by something else
+#     since
+#
+# The controller has no serial number to read, a controller is its INFO
+# reply (manufacturer, model, hardware and firmware versions) on a port.
+# On a bench with one adapter per bike the /dev/serial/by-id name tells
+# them apart.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import atexit
+import hashlib
+import weakref
+import threading
+
+from collections import OrderedDict
+from bdac_frames import area_dict
+
+WEAR = 'bdac.wear'
+ENDURANCE = 10000   # typical rated erase cycles of on-chip flash, the
+                    # controller's own figure is not published
+
+READ_CMD = 0x11
+WRITE_CMD = 0x16
+INFO_AREA = 0x51
+
+section_area = dict((v[0], area) for area, v in area_dict.items())
+
+# Hash of an area's section, length, data and checksum, the same bytes
+# in a write frame (after the command) and a read response
+def area_hash(data):
+    return hashlib.sha1(bytes(data)).hexdigest()[:16]
+
+def port_name(port):
+    name = getattr(port, 'port', None)
+    return os.path.basename(name) if isinstance(name, str) else 'unknown'
+
+def controller_id(info, port):
+    if info is None or len(info) < 18 or info[0] != INFO_AREA:
+        return 'unknown@{0}'.format(port_name(port))
+    return '{0}@{1}'.format(info[2:16].decode('ascii', 'replace'), port_name(port))
+
+#-----------------------------------------------------------------------
+# Identity saved in a config file, the bike id given with --bike and the
+# controller's INFO text.  Controllers report no serial number, bikes
+# with the same controller model are only told apart by their bike id.
+#-----------------------------------------------------------------------
+def snapshot_identity(info, bike=None):
+    text = None
+    if info is not None and len(info) >= 18 and info[0] == INFO_AREA:
+        text = info[2:16].decode('ascii', 'replace')
+    return OrderedDict([('bike', bike), ('info', text)])
+
+class PortSession():
+
+    def __init__(self):
+        self.ident = None
+        self.known = dict()     # section -> hash of what the area holds
+
+class WearLedger():
+
+    def __init__(self, filename=WEAR, report=print):
+        self.filename = filename
+        self.report = report    # None to only log warnings
+        self.enabled = True
+        self.ledger = None      # ident -> area -> counts
+        self.sessions = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def load(self):
+        self.ledger = OrderedDict()
+        try:
+            with open(self.filename) as f:
+                self.ledger.update(json.load(f, object_pairs_hook=OrderedDict))
+        except (OSError, ValueError):
+            pass
+        atexit.register(self.save)
+
+    def save(self):
+        with self.lock:
+            if self.ledger is None:
+                return
+            data = json.dumps(self.ledger, indent=1)
+        try:
+            # replace in one step so a crash never leaves half a ledger
+            with open(self.filename + '.tmp', 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.filename + '.tmp', self.filename)
+        except OSError:
+            pass
+
+    def session(self, port):
+        s = self.sessions.get(port)
+        if s is None:
+            s = self.sessions[port] = PortSession()
+        return s
+
+    def entry(self, ident, area):
+        if self.ledger is None:
+            self.load()
+        return self.ledger.setdefault(ident, OrderedDict()).setdefault(
+            area, OrderedDict([('writes', 0), ('redundant', 0), ('last', None), ('stamp', None)]))
+
+    def identity(self, port):
+        with self.lock:
+            return self.session(port).ident
+
+    #-------------------------------------------------------------------
+    # Decide on a write frame before it is sent
+    #-------------------------------------------------------------------
+    # Returns (reply, warning).  reply is the response to use in place of
+    # sending the frame, None to send it.  warning is text for the log.
+    def check(self, port, cm):
+        area = section_area.get(cm[1])
+        if area is None:
+            return None, None
+        h = area_hash(cm[1:])
+        with self.lock:
+            s = self.session(port)
+            ident = s.ident or controller_id(None, port)
+            e = self.entry(ident, area)
+            if s.known.get(cm[1]) == h:
+                e['redundant'] += 1
+                warning = '{0} {1} already holds this frame, not written'.format(
+                          ident, area_dict[area][2])
+                reply = bytes((cm[1], cm[2]))
+            elif cm[1] not in s.known and e['last'] == h:
+                warning = '{0} {1} was last written with this frame on {2}, writing anyway'.format(
+                          ident, area_dict[area][2], e['stamp'])
+                reply = None
+            else:
+                return None, None
+        if self.report is not None:
+            self.report(warning)
+        return reply, warning
+
+    #-------------------------------------------------------------------
+    # Learn from every command and reply that went to the controller
+    #-------------------------------------------------------------------
+    def observe(self, port, cm, resp):
+        if len(cm) < 2:
+            return
+        written = False
+        with self.lock:
+            s = self.session(port)
+            if cm[0] == READ_CMD and cm[1] == INFO_AREA:
+                s.ident = controller_id(resp, port)
+            elif cm[0] == READ_CMD and cm[1] in section_area:
+                length = area_dict[section_area[cm[1]]][1]
+                if len(resp) >= length + 3 and resp[0] == cm[1]:
+                    s.known[cm[1]] = area_hash(resp[:length + 3])
+                else:
+                    s.known.pop(cm[1], None)
+            elif cm[0] == WRITE_CMD and cm[1] in section_area:
+                if len(resp) >= 2 and resp[0] == cm[1] and resp[1] == cm[2]:
+                    h = area_hash(cm[1:])
+                    s.known[cm[1]] = h
+                    e = self.entry(s.ident or controller_id(None, port), section_area[cm[1]])
+                    e['writes'] += 1
+                    e['last'] = h
+                    e['stamp'] = time.strftime('%Y%m%d_%H%M%S', time.localtime())
+                    written = True
+                else:
+                    # refused or lost, it may hold anything now
+                    s.known.pop(cm[1], None)
+        if written:
+            self.save()
+
+    #-------------------------------------------------------------------
+    # Report lines for the whole fleet, most written first
+    #-------------------------------------------------------------------
+    def report_lines(self):
+        with self.lock:
+            if self.ledger is None:
+                self.load()
+            rows = []
+            for ident, areas in self.ledger.items():
+                for area, e in areas.items():
+                    rows.append([ident, area, e['writes'], e['redundant'], e['stamp']])
+        rows.sort(key=lambda r: -r[2])
+        lines = ['{0:<36} {1:<9} {2:>7} {3:>6} {4:>9}  {5}'.format(
+                 'controller', 'area', 'writes', 'wear', 'not sent', 'last written')]
+        for ident, area, writes, redundant, stamp in rows:
+            lines.append('{0:<36} {1:<9} {2:>7} {3:>5.1f}% {4:>9}  {5}'.format(
+                         ident, area_dict[area][2], writes, 100.0 * writes / ENDURANCE,
+                         redundant, stamp or '-'))
+        lines.append('{0} controllers, {1} writes, {2} redundant writes not sent...'.format(
+                     len(set(r[0] for r in rows)), sum(r[2] for r in rows),
+                     sum(r[3] for r in rows)))
+        return lines
+
+wear = WearLedger()
@@ -83,6 +83,7 @@ if [ $OS = "Debian" ]; then
     echo
     sleep 2
     apt-get install python3-serial
+    apt-get install python3-numpy
     apt-get install python3-dev
     echo
     echo "Adding you to the \"DIALOUT\" group"
@@ -97,6 +98,7 @@ elif [ $OS = "arch" ]; then
     echo
     sleep 2
     pacman -S python-pyserial
+    pacman -S python-numpy
     echo "Adding you to the \"UUCP\" group"
     echo
     usermod -a -G uucp $SUDO_USER
@@ -0,0 +1,44 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Test fixtures.  bdac keeps its port, clock and ledgers in module
+# globals set up by its __main__ block, the bdac fixture sets them up
+# the same way against the controller stand-in on a virtual clock, with
+# the ledgers and every file written kept in the test's own directory.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def bdac(tmp_path, monkeypatch):
+    import bdac
+    from bdac_clock import VirtualClock
+    from bdac_standin import StandInSerial
+    from bdac_wear import WearLedger
+    from bdac_timing import ResponseTimer
+
+    monkeypatch.chdir(tmp_path)
+    clock = VirtualClock()
+    monkeypatch.setattr(bdac, 'clock', clock)
+    monkeypatch.setattr(bdac, 'ser', StandInSerial(clock=clock), raising=False)
+    monkeypatch.setattr(bdac, 'test_data', False, raising=False)
+    monkeypatch.setattr(bdac, 'wear', WearLedger(str(tmp_path / 'bdac.wear'), report=None))
+    monkeypatch.setattr(bdac, 'timer', ResponseTimer(str(tmp_path / 'bdac.timing')))
+    return bdac
@@ -0,0 +1,776 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# Reading, editing and writing a controller through the stand-in, write
+# transactions that fail and roll back, the validator, config bundles,
+# the telemetry ring and the fleet store.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import struct
+
+import pytest
+import subprocess
+
+from collections import OrderedDict
+
+from bdac_bundle import Bundle
+from bdac_fleet import FleetStore, ingest, query_lines
+from bdac_ring import RingWriter, RingReader, RECORD, HEADER
+from bdac_soak import FaultSerial
+from bdac_standin import AREAS
+from bdac_transaction import write_transaction, read_journal, area_values
+from bdac_validate import validate_area, validate_files
+
+
+def quiet(text):
+    pass
+
+def edited(dic, **values):
+    dic = OrderedDict((key, list(val)) for key, val in dic.items())
+    for key, val in values.items():
+        dic[key][0] = val
+    return dic
+
+def config(bdac):
+    return OrderedDict((area, bdac.get_config[area]().copy()) for area in ('basic', 'pas', 'throttle'))
+
+#-----------------------------------------------------------------------
+# Stand-in round trip
+#-----------------------------------------------------------------------
+def test_read_edit_write_round_trip(bdac, capsys):
+    standin = bdac.ser
+    bdac.get_info_config()
+    assert 'Model:          -> SZZ9' in capsys.readouterr().out
+    targets = OrderedDict([('basic', edited(bdac.get_basic_config(), LBP=42, LC=20)),
+                           ('pas', edited(bdac.get_pas_config(), SC=30))])
+
+    assert write_transaction(targets, bdac.get_config, bdac.read_config, report=quiet)
+    assert standin.areas['basic'][:2] == bytes((42, 20))
+    assert standin.areas['pas'][3] == 30
+    assert bdac.get_basic_config()['LBP'][0] == 42
+    assert bdac.get_pas_config()['SC'][0] == 30
+    assert read_journal()[-1]['state'] == 'commit'
+
+def test_config_file_round_trip(bdac):
+    before = config(bdac)
+    bdac.write_config_file('bike.bdac')
+    bdac.basic_dict = OrderedDict()
+    bdac.read_config_file('bike.bdac')
+    assert area_values(bdac.basic_dict) == area_values(before['basic'])
+    assert area_values(bdac.throttle_dict) == area_values(before['throttle'])
+
+def test_bad_config_file_fails_the_job(bdac, tmp_path, monkeypatch):
+    from bdac_standin import StandInSerial
+    standin = StandInSerial(clock=bdac.clock)
+    monkeypatch.setattr(bdac, 'Serial', lambda device, baud, timeout: standin)
+    (tmp_path / 'torn.bdac').write_text('{"basic": ')
+    with pytest.raises(bdac.ConfigFileError):
+        bdac.read_config_file('torn.bdac')
+
+    ok, text = bdac.provision('/dev/ttyUSB3', 'torn.bdac')
+    assert not ok and text.startswith('Could not open torn.bdac')
+    assert standin.writes == 0
+    config(bdac)
+    bdac.write_config_file('bike.bdac')
+    ok, text = bdac.provision('/dev/ttyUSB3', 'bike.bdac')
+    assert ok and text.startswith('SZZ9 written, saved ')
+
+def test_same_config_to_two_controllers_encodes_once(bdac, monkeypatch):
+    from bdac_metrics import metrics
+    from bdac_standin import StandInSerial
+    targets = OrderedDict([('pas', edited(bdac.get_pas_config(), SC=31))])
+    hits, misses = metrics.frame_hits, metrics.frame_misses
+    assert write_transaction(targets, bdac.get_config, bdac.read_config, report=quiet)
+    monkeypatch.setattr(bdac, 'ser', StandInSerial(clock=bdac.clock))
+    assert write_transaction(targets, bdac.get_config, bdac.read_config, report=quiet)
+    assert bdac.ser.areas['pas'][3] == 31
+    assert (metrics.frame_hits - hits, metrics.frame_misses - misses) == (1, 1)
+    assert 'bdac_frame_cache_hits_total' in metrics.render()
+
+#-----------------------------------------------------------------------
+# A write that goes wrong half way leaves the controller as it was
+#-----------------------------------------------------------------------
+def test_transaction_rolls_back_under_faults(bdac, monkeypatch):
+    standin = bdac.ser
+    port = FaultSerial(standin, 0.0, seed=1, clock=bdac.clock)
+    monkeypatch.setattr(bdac, 'ser', port)
+    targets = OrderedDict([('basic', edited(bdac.get_basic_config(), LBP=42)),
+                           ('pas', edited(bdac.get_pas_config(), SC=30))])
+
+    # the reply to the PAS write is spoiled after it reached the flash,
+    # the rollback's own writes go through
+    pas_writes = []
+    def send(cm, length=None):
+        if bytes(cm[:2]) == b'\x16\x53':
+            pas_writes.append(cm)
+        port.rate = 1.0 if len(pas_writes) == 1 and bytes(cm[:2]) == b'\x16\x53' else 0.0
+        return bdac.read_config(cm, length)
+
+    assert not write_transaction(targets, bdac.get_config, send, report=quiet)
+    assert sum(port.faults.values()) == 1
+    assert bytes(standin.areas['basic']) == AREAS['basic']
+    assert bytes(standin.areas['pas']) == AREAS['pas']
+    assert read_journal()[-1]['state'] == 'rollback'
+
+def test_transaction_refuses_garbled_snapshot(bdac, monkeypatch):
+    standin = bdac.ser
+    targets = OrderedDict([('basic', edited(bdac.get_basic_config(), LBP=42))])
+    # every reply spoiled, the snapshot can not be taken
+    port = FaultSerial(standin, 1.0, seed=2, clock=bdac.clock)
+    monkeypatch.setattr(bdac, 'ser', port)
+    assert not write_transaction(targets, bdac.get_config, bdac.read_config, report=quiet)
+    assert standin.writes == 0
+
+#-----------------------------------------------------------------------
+# Record and replay, neither the stand-in nor a replay are timed
+#-----------------------------------------------------------------------
+def test_replay_leaves_timing_alone(tmp_path):
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bdac.py')
+    def run(*args):
+        return subprocess.run([sys.executable, script] + list(args), cwd=str(tmp_path),
+                              capture_output=True, text=True, timeout=60)
+
+    recorded = run('--standin', '--record', 'session.json', '--report')
+    replayed = run('--replay', 'session.json', '--speed', '0', '--report')
+    assert recorded.returncode == 0 and replayed.returncode == 0
+    assert replayed.stdout.splitlines()[1:] == recorded.stdout.splitlines()[1:]
+    assert not os.path.exists(str(tmp_path / 'bdac.timing'))
+
+#-----------------------------------------------------------------------
+# Response timing, a slow controller earns a longer wait
+#-----------------------------------------------------------------------
+def test_slow_controller_read_succeeds_after_backoff(bdac, monkeypatch):
+    from bdac_standin import StandInSerial
+    from bdac_timing import CEILING, READ_DEFAULT
+    monkeypatch.setattr(bdac, 'ser', StandInSerial(latency=1.5, clock=bdac.clock))
+    read_basic = b'\x11\x52'
+    expected = len(bdac.ser.areas['basic']) + 3
+
+    assert len(bdac.read_config(read_basic)) < expected     # the old 1s wait
+    assert bdac.timer.deadline(read_basic) > READ_DEFAULT
+    for n in range(10):
+        assert len(bdac.read_config(read_basic)) == expected
+    assert bdac.ser.timeout == 1
+
+    # one that never answers in time is not waited on for ever
+    bdac.ser.latency = 60
+    for n in range(5):
+        assert bdac.read_config(read_basic) == b''
+    assert bdac.timer.deadline(read_basic) == CEILING
+
+#-----------------------------------------------------------------------
+# Validator
+#-----------------------------------------------------------------------
+def test_validator_rejections(bdac):
+    cfg = config(bdac)
+    assert validate_area('basic', cfg['basic']) == []
+
+    errors = validate_area('basic', edited(cfg['basic'], LBP=99))
+    assert errors == ['LBP 99 - Low Battery Protection out of range (20-60)']
+    assert validate_area('pas', edited(cfg['pas'], SC=True)) == ['SC True is not a number']
+    assert validate_area('throttle', edited(cfg['throttle'], SV=30, EV=20)) == \
+        ['Start voltage must be lower than End voltage']
+    missing = OrderedDict(cfg['pas'])
+    del missing['KC']
+    assert validate_area('pas', missing) == ['KC missing from PAS area']
+
+def test_validate_files(bdac, tmp_path):
+    cfg = config(bdac)
+    good = tmp_path / 'good.bdac'
+    good.write_text(json.dumps(cfg))
+    bad = OrderedDict(cfg)
+    bad['basic'] = edited(cfg['basic'], LC=50)
+    del bad['throttle']
+    (tmp_path / 'bad.bdac').write_text(json.dumps(bad))
+    (tmp_path / 'torn.bdac').write_text('{"basic": ')
+    # JSON true loads as a bool, which is an int to isinstance
+    flagged = OrderedDict(cfg)
+    flagged['throttle'] = edited(cfg['throttle'], MODE=True)
+    (tmp_path / 'bool.bdac').write_text(json.dumps(flagged))
+
+    results = validate_files([str(good), str(tmp_path / 'bad.bdac'), str(tmp_path / 'torn.bdac'),
+                              str(tmp_path / 'bool.bdac')])
+    assert results[str(good)] == []
+    assert results[str(tmp_path / 'bad.bdac')] == [
+        '[BASIC] LC 50 - Current Limit out of range (1-30)', '[THROTTLE] area missing']
+    assert results[str(tmp_path / 'bool.bdac')] == ['[THROTTLE] MODE True is not a number']
+    assert results[str(tmp_path / 'torn.bdac')][0].startswith('Could not read file')
+
+#-----------------------------------------------------------------------
+# Bundles
+#-----------------------------------------------------------------------
+def test_bundle_append(bdac, tmp_path):
+    cfg = config(bdac)
+    filename = str(tmp_path / 'fleet.bdacb')
+    Bundle(filename).add([('a', cfg, 1.0), ('b', cfg, 2.0)])
+    Bundle(filename).add([('a', OrderedDict(cfg, basic=edited(cfg['basic'], LBP=42)), 3.0)])
+
+    bundle = Bundle(filename)
+    assert bundle.names() == ['a', 'b']
+    assert bundle.stamp('a') == 3.0
+    assert bundle.get('a')['basic']['LBP'][0] == 42
+    assert bundle.get('b') == json.loads(json.dumps(cfg))
+    assert [name for name, stamp, fd in bundle.records()] == ['b', 'a']
+
+def test_bundle_torn_append(bdac, tmp_path):
+    cfg = config(bdac)
+    filename = str(tmp_path / 'fleet.bdacb')
+    Bundle(filename).add([('a', cfg), ('b', cfg)])
+    size = os.path.getsize(filename)
+    Bundle(filename).add([('c', cfg)])
+    # a crash part way through the next record, trailer and index gone
+    with open(filename, 'r+b') as f:
+        f.truncate(size + 10)
+
+    bundle = Bundle(filename)
+    assert bundle.names() == ['a', 'b']
+    bundle.add([('d', cfg)])
+    assert Bundle(filename).names() == ['a', 'b', 'd']
+    assert Bundle(filename).get('d') == json.loads(json.dumps(cfg))
+
+def test_bundle_sees_other_writers(bdac, tmp_path):
+    import threading
+    from bdac_bundle import open_bundle, load_config
+    cfg = config(bdac)
+    filename = str(tmp_path / 'shared.bdacb')
+    Bundle(filename).add([('a', cfg)])
+    assert open_bundle(filename).names() == ['a']
+    Bundle(filename).add([('b', OrderedDict(cfg, basic=edited(cfg['basic'], LBP=44)))])
+    assert open_bundle(filename).names() == ['a', 'b']
+    assert load_config(filename + '#b')['basic']['LBP'][0] == 44
+
+    # two writers at once take turns on the lock, nothing is lost
+    def add(prefix):
+        bundle = Bundle(filename)
+        for n in range(20):
+            bundle.add([('{0}{1}'.format(prefix, n), cfg)])
+    threads = [threading.Thread(target=add, args=(prefix,)) for prefix in 'xy']
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(Bundle(filename).names()) == 42
+
+#-----------------------------------------------------------------------
+# Telemetry ring
+#-----------------------------------------------------------------------
+def telemetry(n):
+    return {'time': 1000.0 + n, 'rpm': n, 'status': 1, 'amps': 1.5, 'battery': 90}
+
+def test_ring_overrun(tmp_path):
+    path = str(tmp_path / 'ring')
+    writer = RingWriter(path, slots=4)
+    reader = RingReader(path)
+    for n in range(3):
+        writer.publish(telemetry(n))
+    assert [t['rpm'] for t in reader.poll()] == [0, 1, 2]
+    for n in range(3, 13):
+        writer.publish(telemetry(n))
+    assert [t['seq'] for t in reader.poll()] == [9, 10, 11, 12]
+    assert reader.lost == 6
+    assert reader.poll() == []
+
+def test_ring_torn_slot(tmp_path):
+    path = str(tmp_path / 'ring')
+    writer = RingWriter(path, slots=4)
+    reader = RingReader(path)
+    for n in range(3):
+        writer.publish(telemetry(n))
+    # the writer has started on slot 1 again, its first sequence changed
+    offset = HEADER.size + 1 * RECORD.size
+    RECORD.pack_into(writer.map, offset, 5, *RECORD.unpack_from(writer.map, offset)[1:])
+    records = reader.poll()
+    assert [t['seq'] for t in records] == [0, 2]
+    assert reader.lost == 1
+    assert records[1]['amps'] == 1.5 and records[1]['status'] == 1
+
+#-----------------------------------------------------------------------
+# Fleet store
+#-----------------------------------------------------------------------
+def test_fleet_ingest_and_query(bdac, tmp_path):
+    cfg = config(bdac)
+    files = tmp_path / 'files'
+    files.mkdir()
+    for name, lbp in (('Oct-01-2026-10:00:00-ttyUSB0-config.bdac', 41),
+                      ('Oct-02-2026-10:00:00-ttyUSB0-config.bdac', 44),
+                      ('Oct-02-2026-11:00:00-ttyUSB1-config.bdac', 30)):
+        (files / name).write_text(json.dumps(OrderedDict(cfg, basic=edited(cfg['basic'], LBP=lbp))))
+    (files / 'broken.bdac').write_text('{')
+
+    store = FleetStore(str(tmp_path / 'fleet'))
+    assert ingest(store, [str(files)], report=quiet) == (3, 0, 1)
+    assert ingest(store, [str(files)], report=quiet) == (0, 3, 1)
+
+    store = FleetStore(str(tmp_path / 'fleet'))
+    assert len(store) == 3
+    assert query_lines(store, ['LBP>35'])[0] == '2 configs from 1 bikes match'
+    assert query_lines(store, ['latest', 'LBP>35'])[0] == '1 configs from 1 bikes match'
+    assert query_lines(store, ['latest', 'dist:LBP'])[:2] == [
+        '   30       1  50.0% ' + '#' * 20, '   44       1  50.0% ' + '#' * 20]
+
+def test_fleet_bike_from_saved_identity(bdac, tmp_path, monkeypatch):
+    bdac.get_info_config()
+    files = tmp_path / 'files'
+    files.mkdir()
+    # one adapter moved between two bikes, and a GUI snapshot without one
+    monkeypatch.setattr(bdac, 'bike_id', 'cargo')
+    bdac.write_config_file(str(files / 'Oct-01-2026-10:00:00-ttyUSB0-config.bdac'))
+    monkeypatch.setattr(bdac, 'bike_id', 'commuter')
+    bdac.write_config_file(str(files / 'Oct-02-2026-10:00:00-ttyUSB0-config.bdac'))
+    monkeypatch.setattr(bdac, 'bike_id', None)
+    bdac.write_config_file(str(files / 'Oct-03-2026-10:00:00-config.bdac'))
+    (files / 'old.bdac').write_text(json.dumps(config(bdac)))
+
+    lines = []
+    store = FleetStore(str(tmp_path / 'fleet'))
+    assert ingest(store, [str(files)], report=lines.append) == (4, 0, 0)
+    assert lines == ['1 configs have no controller identity, their bike is taken from the file name']
+    assert sorted(store.index['bikes']) == ['HZXTSZZ9112011', 'cargo', 'commuter', 'name:old']
+
+def test_ring_slot_overwritten_during_copy(tmp_path, monkeypatch):
+    import bdac_ring
+    path = str(tmp_path / 'ring')
+    writer = RingWriter(path, slots=4)
+    reader = RingReader(path)
+    for n in range(2):
+        writer.publish(telemetry(n))
+    # the writer starts on slot 0 again after the reader copied it, only
+    # the start sequence read after the copy shows it
+    unpack_from = bdac_ring.RECORD.unpack_from
+    def copy_then_overwrite(buffer, offset=0):
+        values = unpack_from(buffer, offset)
+        if values[0] == 0:
+            struct.pack_into('<Q', writer.map, offset, 4)
+        return values
+    monkeypatch.setattr(bdac_ring, 'RECORD', type('Record', (), {
+        'size': RECORD.size, 'unpack_from': staticmethod(copy_then_overwrite)}))
+    assert [t['seq'] for t in reader.poll()] == [1]
+    assert reader.lost == 1
+
+#-----------------------------------------------------------------------
+# GUI sessions
+#-----------------------------------------------------------------------
+def test_session_keeps_dicts_when_not_written(bdac):
+    from bdac_session import Session
+    session = Session('standin', bdac.get_config, bdac.read_config)
+    assert session.read_all().result()
+    read = session.dicts['basic']
+
+    refused = OrderedDict([('basic', edited(read, LBP=99))])
+    assert not session.write(refused, quiet).result()
+    assert session.dicts['basic'] is read and session.config_changed
+
+    targets = OrderedDict([('basic', edited(read, LBP=42))])
+    assert session.write(targets, quiet).result()
+    assert session.dicts['basic']['LBP'][0] == 42 and not session.config_changed
+    assert session.info is not None
+    session.close()
+
+def test_copied_config_is_not_shared(bdac):
+    from bdac_session import Session, area_copy
+    first = Session('standin', bdac.get_config, bdac.read_config)
+    second = Session('standin', bdac.get_config, bdac.read_config)
+    assert first.read_all().result() and second.read_all().result()
+
+    targets = OrderedDict([('basic', area_copy(first.dicts['basic']))])
+    assert second.write(targets, quiet).result()
+    # edited in place, as the GUI does
+    first.dicts['basic']['LC'][0] = 25
+    targets['basic']['LC'][0] = 24
+    assert second.dicts['basic']['LC'][0] != 25
+    assert second.dicts['basic']['LC'][0] != 24
+    first.close()
+    second.close()
+
+#-----------------------------------------------------------------------
+# Station sync
+#-----------------------------------------------------------------------
+def test_import_keeps_both_snapshots_of_one_name(bdac, tmp_path):
+    from bdac_sync import export_delta, import_deltas
+    cfg = config(bdac)
+    name = 'Oct-01-2026-10:00:00-ttyUSB0-config.bdac'
+    for station, lbp in (('north', 41), ('south', 44)):
+        (tmp_path / station).mkdir()
+        (tmp_path / station / name).write_text(
+            json.dumps(OrderedDict(cfg, basic=edited(cfg['basic'], LBP=lbp))))
+    sync = str(tmp_path / 'sync')
+    assert export_delta(sync, str(tmp_path / 'south'), 'south')[0] == 1
+
+    lines = []
+    assert import_deltas(sync, str(tmp_path / 'north'), 'north', report=lines.append) == (1, 0)
+    names = sorted(os.listdir(str(tmp_path / 'north')))
+    assert name in names and json.loads((tmp_path / 'north' / name).read_text())['basic']['LBP'][0] == 41
+    renamed = [n for n in names if n.endswith('-config.bdac') and n != name]
+    assert len(renamed) == 1 and renamed[0].startswith(name[:-len('-config.bdac')] + '-')
+    assert json.loads((tmp_path / 'north' / renamed[0]).read_text())['basic']['LBP'][0] == 44
+    assert lines[0] == '{0} differs from the one here, saved as {1}'.format(name, renamed[0])
+
+    # imported again nothing changes
+    assert import_deltas(sync, str(tmp_path / 'north'), 'north', report=quiet) == (0, 0)
+
+#-----------------------------------------------------------------------
+# Profile
+#-----------------------------------------------------------------------
+def test_profile_covers_worker_threads(tmp_path):
+    import pstats
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from bdac_profile import start_profile, stop_profile
+
+    def serial_work():
+        return sum(range(1000))
+
+    filename = str(tmp_path / 'bdac.prof')
+    start_profile(filename)
+    pool = ThreadPoolExecutor(max_workers=1)
+    pool.submit(serial_work).result()
+    thread = threading.Thread(target=serial_work)
+    thread.start()
+    thread.join()
+    stop_profile(filename)
+    pool.shutdown()
+
+    calls = [v[1] for k, v in pstats.Stats(filename).stats.items() if k[2] == 'serial_work']
+    assert calls == [2]
+
+#-----------------------------------------------------------------------
+# Analytics
+#-----------------------------------------------------------------------
+def test_energy_skips_unanswered_polls(bdac, tmp_path):
+    import numpy as np
+    from bdac_analytics import load_series, energy_summary, energy_stream
+    config(bdac)
+    log = tmp_path / 'ride.csv'
+    log.write_text('time,rpm,status,amps,battery\n'
+                   '0,200,1,10,90\n1,,,,\n2,200,1,10,\n3,200,1,10,89\n')
+    summary = energy_summary(load_series(str(log)), bdac.basic_dict, 500)
+    assert summary['samples'] == 3
+    assert np.isfinite(summary['wh']) and summary['wh'] > 0
+    assert np.isfinite(summary['km']) and summary['km'] > 0
+    assert summary['battery_used'] == 1
+    assert all(np.isfinite(level[3]) for level in summary['levels'])
+
+    log.write_text('time,rpm\n0,200\n1,200\n')
+    [(name, summary)] = energy_stream([str(log)], bdac.basic_dict)
+    assert summary == {'error': 'no amps or power column in the log'}
+
+def test_ride_reports_missing_column(bdac, tmp_path):
+    config(bdac)
+    bdac.write_config_file('bike.bdac')
+    log = tmp_path / 'ride.csv'
+    log.write_text('time,amps\n0,10\n1,10\n')
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bdac.py')
+    run = subprocess.run([sys.executable, script, '--ride', 'ride.csv', 'bike.bdac'],
+                         cwd=str(tmp_path), capture_output=True, text=True, timeout=60)
+    assert run.returncode == 1
+    assert run.stdout.splitlines()[-1] == 'Could not read log ride.csv - no rpm column in the log'
+    assert 'Traceback' not in run.stderr
+
+def test_simulate_reports_bad_input(bdac, tmp_path):
+    config(bdac)
+    bdac.write_config_file('bike.bdac')
+    (tmp_path / 'empty').mkdir()
+    (tmp_path / 'ride.csv').write_text('time,rpm\n0,200\n1,200\n')
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bdac.py')
+    def run(*args):
+        return subprocess.run([sys.executable, script, '--simulate'] + list(args), cwd=str(tmp_path),
+                              capture_output=True, text=True, timeout=60)
+
+    for args, text in ((['empty'], 'No .bdac files in empty, exiting...'),
+                       (['bike.bdac', 'gone.csv'], 'Could not read log gone.csv - '),
+                       (['bike.bdac', 'ride.csv'],
+                        'Could not read log ride.csv - no cadence column in the log')):
+        result = run(*args)
+        assert result.returncode == 1 and 'Traceback' not in result.stderr
+        assert result.stdout.splitlines()[-1].startswith(text)
+    assert run('bike.bdac').returncode == 0
+
+#-----------------------------------------------------------------------
+# Serial link metrics
+#-----------------------------------------------------------------------
+def test_metrics_count_commands_and_serve_them(bdac, monkeypatch):
+    from urllib.request import urlopen
+    from bdac_frames import encode_frame
+    from bdac_metrics import Metrics, start_metrics_server
+    metrics = Metrics()
+    monkeypatch.setattr(bdac, 'metrics', metrics)
+    monkeypatch.setattr('bdac_metrics.metrics', metrics)
+
+    basic = bdac.get_basic_config()
+    assert bdac.read_config(encode_frame('basic', edited(basic, LBP=99))) == b'\x52\x00\x00'
+    bdac.ser.latency = 5                    # longer than any wait
+    assert bdac.read_config(b'\x11\x53') == b''
+
+    text = metrics.render()
+    assert 'bdac_command_seconds_count{command="read_basic"} 1' in text
+    assert 'bdac_controller_errors_total{area="basic",code="0"} 1' in text
+    assert 'bdac_timeouts_total{command="read_pas"} 1' in text
+
+    server = start_metrics_server(0)
+    try:
+        with urlopen('http://127.0.0.1:{0}/metrics'.format(server.server_address[1])) as f:
+            assert f.read().decode() == metrics.render()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+#-----------------------------------------------------------------------
+# Tracing
+#-----------------------------------------------------------------------
+def test_trace_nests_serial_spans_in_area_reads(bdac, tmp_path, monkeypatch):
+    from bdac_trace import tracer, NULL_SPAN
+    assert tracer.span('off') is NULL_SPAN
+    monkeypatch.setattr(tracer, 'enabled', True)
+    monkeypatch.setattr(tracer, 'events', [])
+    monkeypatch.setattr(tracer, 'filename', str(tmp_path / 'trace.json'))
+
+    bdac.get_basic_config()
+    tracer.save()
+    with open(tracer.filename) as f:
+        events = dict((e['name'], e) for e in json.load(f)['traceEvents'])
+    area, serial = events['read BASIC'], events['serial read_basic']
+    assert area['cat'] == 'area' and serial['cat'] == 'serial'
+    assert area['ts'] <= serial['ts']
+    assert serial['ts'] + serial['dur'] <= area['ts'] + area['dur']
+
+#-----------------------------------------------------------------------
+# bdacd
+#-----------------------------------------------------------------------
+@pytest.fixture
+def daemon(bdac, tmp_path):
+    import time
+    import threading
+    from bdac_daemon import Bdacd, connect_daemon
+    path = str(tmp_path / 'bdacd.sock')
+    server = Bdacd(bdac.get_config, bdac.read_config, bdac.get_telemetry, socket_path=path)
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    client = None
+    for n in range(100):
+        client = connect_daemon(path)
+        if client is not None:
+            break
+        time.sleep(0.05)
+    assert client is not None
+    yield server, client
+    client.close()
+    server.stop()
+    thread.join(5)
+
+def test_daemon_serves_areas_and_checks_writes(bdac, daemon):
+    from bdac_daemon import Bdacd
+    server, client = daemon
+    assert client.request({'cmd': 'info'})['info']['model'] == 'SZZ9'
+    assert client.request({'cmd': 'read', 'area': 'pas'})['values']['SC'][0] == bdac.ser.areas['pas'][3]
+
+    assert client.request({'cmd': 'write', 'area': 'pas', 'values': {'SC': 30}})['values']['SC'][0] == 30
+    assert bdac.ser.areas['pas'][3] == 30
+    with pytest.raises(IOError, match='Start Current out of range'):
+        client.request({'cmd': 'write', 'area': 'pas', 'values': {'SC': 130}})
+    assert bdac.ser.areas['pas'][3] == 30
+
+    # a client's own read_config goes through bdacd
+    assert bdac.read_config(b'\x11\x53', port=client)[5] == 30
+    assert client.request({'cmd': 'stats'})['stats']['write']['runs'] == 2
+
+    # --record while bdacd holds the port talks to it as a port
+    from bdac_replay import RecordingSerial
+    recording = RecordingSerial(client, os.devnull)
+    assert bdac.read_config(b'\x11\x53', port=recording)[5] == 30
+    assert recording.events[-1][1:3] == ['r', 14]
+
+    # a second bdacd on the same socket refuses to start
+    with pytest.raises(OSError, match='another bdacd'):
+        Bdacd(bdac.get_config, bdac.read_config, bdac.get_telemetry,
+              socket_path=server.socket_path).serve()
+
+#-----------------------------------------------------------------------
+# Command scheduler
+#-----------------------------------------------------------------------
+def test_scheduler_runs_writes_first_and_coalesces_polls(bdac):
+    from bdac_scheduler import Scheduler, WRITE, CONFIG, TELEMETRY
+    scheduler = Scheduler(holdoff=0.0)
+    ran = []
+    def job(name, func, *args):
+        def run():
+            ran.append(name)
+            return func(*args)
+        return run
+
+    targets = OrderedDict([('basic', edited(bdac.get_basic_config(), LBP=42))])
+    poll = scheduler.submit(TELEMETRY, job('telemetry', bdac.get_telemetry), key='telemetry')
+    again = scheduler.submit(TELEMETRY, job('telemetry', bdac.get_telemetry), key='telemetry')
+    read = scheduler.submit(CONFIG, job('config', bdac.get_basic_config))
+    write = scheduler.submit(WRITE, job('write', write_transaction, targets, bdac.get_config,
+                                        bdac.read_config, quiet))
+    while scheduler.stats()['waiting']:
+        scheduler.run(scheduler.next(1.0))
+
+    assert ran == ['write', 'config', 'telemetry']
+    assert write.result() and read.result()['LBP'][0] == 42
+    assert again is poll and poll.result()['rpm'] is not None
+    stats = scheduler.stats()
+    assert stats['coalesced'] == 1 and stats['telemetry']['runs'] == 1
+
+    # a poll after the last one ran is queued again
+    assert scheduler.submit(TELEMETRY, bdac.get_telemetry, key='telemetry') is not poll
+
+#-----------------------------------------------------------------------
+# Batch provisioning
+#-----------------------------------------------------------------------
+def test_interrupted_batch_resumes(bdac, tmp_path):
+    from bdac_batch import run_batch
+    from bdac_standin import StandInSerial
+
+    class PulledPlug(StandInSerial):
+        def write(self, cm):
+            if cm[0] == 0x16:
+                raise KeyboardInterrupt
+            return StandInSerial.write(self, cm)
+
+    cfg = config(bdac)
+    for name, lbp in (('commuter', 42), ('cargo', 44)):
+        target = OrderedDict(cfg)
+        target['basic'] = edited(cfg['basic'], LBP=lbp)
+        (tmp_path / (name + '.bdac')).write_text(json.dumps(target))
+    jobfile = tmp_path / 'bikes.jobs'
+    jobfile.write_text('# port  target\nttyA  commuter.bdac\nttyB  cargo.bdac\n')
+    ports = {'ttyA': StandInSerial(clock=bdac.clock), 'ttyB': PulledPlug(clock=bdac.clock)}
+
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(str(jobfile), ports.get, bdac.read_config, report=quiet, workers=1)
+    assert ports['ttyA'].areas['basic'][0] == 42
+    assert ports['ttyB'].areas['basic'][0] != 44
+    writes = ports['ttyA'].writes
+
+    ports['ttyB'] = StandInSerial(clock=bdac.clock)
+    assert run_batch(str(jobfile), ports.get, bdac.read_config, report=quiet,
+                     resume=True) == (1, 1, 0)
+    assert ports['ttyB'].areas['basic'][0] == 44
+    assert ports['ttyA'].writes == writes
+
+def test_batch_journal_error_reaches_every_writer(bdac, tmp_path, monkeypatch):
+    import errno
+    import threading
+    from bdac_batch import BatchJournal, run_batch
+    def disk_full(fd):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+    monkeypatch.setattr(os, 'fsync', disk_full)
+
+    journal = BatchJournal(str(tmp_path / 'bikes.jobs.journal'))
+    errors = []
+    def write(n):
+        try:
+            journal.write({'state': 'job_start', 'job': n})
+        except OSError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=write, args=(n,), daemon=True) for n in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(errors) == 3
+    journal.close()
+
+    (tmp_path / 'bikes.jobs').write_text('')
+    with pytest.raises(OSError, match='No space left'):
+        run_batch(str(tmp_path / 'bikes.jobs'), None, bdac.read_config, report=quiet)
+
+#-----------------------------------------------------------------------
+# Assist level optimizer
+#-----------------------------------------------------------------------
+def test_optimized_levels_pass_validation(bdac):
+    from bdac_optimize import optimize_levels
+    basic = bdac.get_basic_config()
+    before = area_values(basic)
+    lc = basic['LC'][0]
+    for current, speed, cap in (('linear', 'linear', None), ('smooth', 'smooth', lc - 5),
+                                ('10,20,30,40,50,60,70,80,90', 'linear', None)):
+        new, report = optimize_levels(basic, current, speed, cap)
+        assert validate_area('basic', new) == []
+        alc = [new['ALC{0}'.format(i)][0] for i in range(1, 10)]
+        alsl = [new['ALSL{0}'.format(i)][0] for i in range(1, 10)]
+        assert alc == sorted(set(alc)) and alsl == sorted(set(alsl))
+        assert alc[-1] * lc / 100.0 <= (cap or lc)
+        assert report[0].startswith('Current ({0}'.format(current))
+    assert area_values(basic) == before
+
+    # and the controller takes it
+    assert write_transaction(OrderedDict([('basic', new)]), bdac.get_config, bdac.read_config,
+                             report=quiet)
+
+    with pytest.raises(ValueError, match='needs 9 values'):
+        optimize_levels(basic, '10,20,30')
+
+#-----------------------------------------------------------------------
+# Flash wear ledger
+#-----------------------------------------------------------------------
+def test_wear_skips_and_counts_redundant_writes(bdac, tmp_path, monkeypatch):
+    from bdac_frames import encode_frame
+    from bdac_wear import WearLedger
+    from bdac_standin import StandInSerial
+    frame = encode_frame('basic', edited(bdac.get_basic_config(), LBP=42))
+
+    assert bdac.read_config(frame) == b'\x52\x18'
+    writes = bdac.ser.writes
+    assert bdac.read_config(frame) == b'\x52\x18'
+    assert bdac.ser.writes == writes
+    [(ident, areas)] = bdac.wear.ledger.items()
+    assert ident == 'HZXTSZZ9112011@unknown'
+    assert (areas['basic']['writes'], areas['basic']['redundant']) == (1, 1)
+    assert bdac.wear.report_lines()[-1] == '1 controllers, 1 writes, 1 redundant writes not sent...'
+
+    # the next run only has the ledger, the write is sent with a warning
+    warnings = []
+    monkeypatch.setattr(bdac, 'wear', WearLedger(str(tmp_path / 'bdac.wear'), report=warnings.append))
+    monkeypatch.setattr(bdac, 'ser', StandInSerial(clock=bdac.clock))
+    assert bdac.read_config(frame) == b'\x52\x18'
+    assert bdac.ser.writes == 1
+    assert warnings[0].endswith('writing anyway')
+    assert 'already holds this frame, not written' in (tmp_path / 'bdac.log').read_text()
+
+#-----------------------------------------------------------------------
+# Telemetry anomalies
+#-----------------------------------------------------------------------
+def test_anomaly_spike_drop_and_silence(bdac):
+    from bdac_anomaly import Detector, WARMUP, MISSED
+    events = []
+    detector = Detector(report=events.append)
+    def poll(**change):
+        telemetry = bdac.get_telemetry()
+        for key, val in change.items():
+            telemetry[key] += val
+        return detector.observe(telemetry)
+
+    for n in range(WARMUP + 5):
+        assert poll() == []
+    assert [e['kind'] for e in poll(amps=15)] == ['anomaly']
+    assert events[-1]['signal'] == 'amps' and events[-1]['text'].startswith('Current spike')
+    assert [(e['signal'], e['kind']) for e in poll()] == [('amps', 'cleared')]
+
+    [drop] = poll(battery=-20)
+    assert (drop['signal'], drop['kind']) == ('battery', 'anomaly')
+
+    # the controller stops answering
+    bdac.ser.latency = 5
+    raised = []
+    for n in range(MISSED):
+        raised += poll()
+    assert [(e['signal'], e['kind']) for e in raised] == [('reply', 'anomaly')]
+    assert len(events) == 4
@@ -0,0 +1,44 @@
+# bdac - Bafang display and config
+# Copyright (C) 2022  George Farris - VE7FRG
+
+# A short soak with a fixed seed, every fault injected must end as a
+# failure the harness expects, never as an exception it does not.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bdac_frames import ReplyError
+from bdac_soak import FaultSerial, soak, soak_summary
+from bdac_standin import AREAS
+
+
+def test_soak_has_no_unexpected_exceptions(bdac, tmp_path, monkeypatch):
+    standin = bdac.ser
+    port = FaultSerial(standin, 0.05, seed=1, clock=bdac.clock)
+    monkeypatch.setattr(bdac, 'ser', port)
+
+    samples, errors = soak(bdac.soak_ops(standin), 500, str(tmp_path), bdac.clock,
+                           report=lambda line: None, expected=(ReplyError,))
+
+    assert sum(port.faults.values()) > 0
+    unexpected = [key for key in errors if key.split()[1] != 'failed']
+    assert unexpected == []
+    lines, warnings = soak_summary(samples, errors, port.faults)
+    assert not [w for w in warnings if 'raised' in w]
+
+    # whatever failed, the stand-in's flash is only ever one of the two
+    # configs the soak writes
+    basic = list(standin.areas['basic'])
+    assert basic[0] in (41, 42)
+    assert basic[1:] == list(AREAS['basic'])[1:]
+    assert list(standin.areas['pas']) == list(AREAS['pas'])